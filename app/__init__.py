@@ -1,22 +1,38 @@
-from flask import Flask
-from config import Config
-from .extensions import db, login_manager
-from .models import User
-
 from dotenv import load_dotenv
+# load .env before config.py reads the environment
 load_dotenv()
 
+from flask import Flask
+import os
+from config import configs
+from .extensions import db, login_manager, apply_sqlite_pragmas
+from .models import User, UserSnapshot
+from .cache import feed_fragment_cache, user_cache
+from .moderation import moderation_queue
+from .live import story_watcher
+from .commands import register_commands
+from . import assets, metrics, security
+
 from flask_login import current_user
 
-def create_app(config_class=Config):
+def create_app(config_class=None):
     app = Flask(__name__)
-    app.config.from_object(config_class)
+    app.config.from_object(config_class or configs[os.environ.get('APP_PROFILE', 'default')])
 
     db.init_app(app)
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, app.config.get('SQLITE_PRAGMAS'))
     login_manager.init_app(app)
+    security.init_app(app)
     login_manager.login_view = 'auth.login_register'
     login_manager.login_message_category = 'info'
 
+    feed_fragment_cache.max_bytes = app.config['FEED_CACHE_MAX_BYTES']
+    feed_fragment_cache.ttl = app.config['FEED_CACHE_TTL']
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+
+    assets.init_app(app)
+
     from .main_views import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
@@ -26,14 +42,24 @@ def create_app(config_class=Config):
     # --- FLASK-LOGIN USER LOADER ---
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        user_id = int(user_id)
+        snapshot = user_cache.get(user_id)
+        if snapshot is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            snapshot = UserSnapshot(user)
+            user_cache.set(user_id, snapshot)
+        return snapshot
 
     # --- Provide streak to all templates ---
     @app.context_processor
     def inject_streak():
         return {'current_streak': current_user.current_streak if current_user.is_authenticated else 0}
 
-    # --- CREATE DATABASE TABLES ---
-    with app.app_context():
-        db.create_all()
+    moderation_queue.init_app(app)
+    story_watcher.init_app(app)
+    metrics.init_app(app, db)
+    register_commands(app)
+    # schema creation is explicit: `flask --app run.py db init` (see app/commands.py)
     return app
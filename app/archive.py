@@ -0,0 +1,326 @@
+"""Streaming JSON Lines export, and archival of old days into export files.
+
+A day is written as one prompt record, then its stories, then the comments on
+those stories, each as a JSON object with a "type" key. Rows are streamed
+from the database and compressed as they go, so memory stays flat however
+many days are exported.
+"""
+import gzip
+import json
+import os
+import zlib
+
+from sqlalchemy import delete, insert, or_, select
+
+from .counters import uncount_stories
+from .extensions import db
+from .models import (ArchivedComment, ArchivedStory, CommentLike, Comments, DailyEmoji, ModerationJob, Story,
+                     StoryLike, User, MODERATION_APPROVED)
+
+STREAM_CHUNK = 1000
+GZIP_FLUSH_BYTES = 64 * 1024
+
+
+# --- EXPORT ---
+def _prompt_record(prompt):
+    return {'type': 'prompt', 'id': prompt.id, 'date': prompt.date_posted.isoformat(), 'emojis': prompt.emojis}
+
+def _story_records(daily_emoji_id, user_id=None, approved_only=True):
+    query = (select(Story.id, Story.daily_emoji_id, Story.user_id, User.username, Story.title, Story.content,
+                    Story.timestamp, Story.likes, Story.moderation_status)
+             .outerjoin(User, User.id == Story.user_id)
+             .where(Story.daily_emoji_id == daily_emoji_id)
+             .order_by(Story.id))
+    if user_id is not None:
+        query = query.where(Story.user_id == user_id)
+    if approved_only:
+        query = query.where(Story.moderation_status == MODERATION_APPROVED)
+    for row in db.session.execute(query).yield_per(STREAM_CHUNK):
+        yield {'type': 'story', 'id': row.id, 'prompt_id': row.daily_emoji_id, 'user_id': row.user_id,
+               'username': row.username, 'title': row.title, 'content': row.content,
+               'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+               'likes': row.likes, 'moderation_status': row.moderation_status}
+
+def _comment_records(daily_emoji_id, user_id=None, approved_only=True):
+    query = (select(Comments.id, Comments.story_id, Comments.user_id, User.username, Comments.content,
+                    Comments.timestamp, Comments.likes)
+             .join(Story, Story.id == Comments.story_id)
+             .outerjoin(User, User.id == Comments.user_id)
+             .where(Story.daily_emoji_id == daily_emoji_id)
+             .order_by(Comments.story_id, Comments.id))
+    if user_id is not None:
+        query = query.where(Comments.user_id == user_id)
+    if approved_only:
+        query = query.where(Story.moderation_status == MODERATION_APPROVED)
+    for row in db.session.execute(query).yield_per(STREAM_CHUNK):
+        yield {'type': 'comment', 'id': row.id, 'story_id': row.story_id, 'user_id': row.user_id,
+               'username': row.username, 'content': row.content,
+               'timestamp': row.timestamp.isoformat() if row.timestamp else None, 'likes': row.likes}
+
+def _archived_records(directory, prompt, user_id=None, approved_only=True):
+    """Story and comment records for an archived day, read back from its archive file"""
+    hidden = set()
+    with gzip.open(archive_path(directory, prompt.date_posted), 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record['type'] == 'story':
+                if approved_only and record['moderation_status'] != MODERATION_APPROVED:
+                    hidden.add(record['id'])
+                    continue
+            elif record['type'] == 'comment':
+                # the file lists a day's stories before their comments
+                if record['story_id'] in hidden:
+                    continue
+            else:
+                continue
+            if user_id is None or record['user_id'] == user_id:
+                yield record
+
+def archived_day_ids():
+    """Ids of the DailyEmoji days `flask archive` has moved into archive files"""
+    return set(db.session.scalars(select(ArchivedStory.daily_emoji_id).distinct()))
+
+def missing_archives(prompts, directory):
+    """Dates among `prompts` that were archived but whose archive file is gone"""
+    archived = archived_day_ids()
+    return [prompt.date_posted for prompt in prompts
+            if prompt.id in archived and not os.path.exists(archive_path(directory, prompt.date_posted))]
+
+def export_records(prompts, user_id=None, approved_only=True, archive_dir=None):
+    """Yield export records for each DailyEmoji in `prompts`, one day at a time.
+
+    With `user_id`, only that user's stories and comments are included (the
+    comments may be on other people's stories). With `archive_dir`, archived
+    days are read back from their archive files; check missing_archives()
+    first, as a missing file raises mid-stream.
+    """
+    archived = archived_day_ids() if archive_dir is not None else set()
+    for prompt in prompts:
+        yield _prompt_record(prompt)
+        if prompt.id in archived:
+            yield from _archived_records(archive_dir, prompt, user_id, approved_only)
+            continue
+        yield from _story_records(prompt.id, user_id, approved_only)
+        yield from _comment_records(prompt.id, user_id, approved_only)
+
+def export_prompts(since=None, until=None, user_id=None):
+    """DailyEmoji rows to export, oldest first; with `user_id`, only days the user wrote on"""
+    query = select(DailyEmoji).order_by(DailyEmoji.date_posted)
+    if since is not None:
+        query = query.where(DailyEmoji.date_posted >= since)
+    if until is not None:
+        query = query.where(DailyEmoji.date_posted <= until)
+    if user_id is not None:
+        wrote_story = select(Story.id).where(Story.daily_emoji_id == DailyEmoji.id, Story.user_id == user_id)
+        wrote_comment = (select(Comments.id).join(Story, Story.id == Comments.story_id)
+                         .where(Story.daily_emoji_id == DailyEmoji.id, Comments.user_id == user_id))
+        wrote_archived_story = select(ArchivedStory.id).where(ArchivedStory.daily_emoji_id == DailyEmoji.id,
+                                                              ArchivedStory.user_id == user_id)
+        wrote_archived_comment = select(ArchivedComment.id).where(ArchivedComment.daily_emoji_id == DailyEmoji.id,
+                                                                  ArchivedComment.user_id == user_id)
+        query = query.where(or_(wrote_story.exists(), wrote_comment.exists(),
+                                wrote_archived_story.exists(), wrote_archived_comment.exists()))
+    # one small row per day, so the list is cheap; the stories and comments are what stream
+    return db.session.scalars(query).all()
+
+def _jsonl_line(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def gzip_jsonl(records):
+    """Encode records as gzip-compressed JSON Lines, yielding compressed chunks"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending = []
+    size = 0
+    for record in records:
+        line = _jsonl_line(record)
+        pending.append(line)
+        size += len(line)
+        if size >= GZIP_FLUSH_BYTES:
+            chunk = compressor.compress(b''.join(pending))
+            pending, size = [], 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(b''.join(pending)) + compressor.flush()
+
+def write_export(path, records):
+    """Stream records into a gzip JSON Lines file, atomically; returns bytes written"""
+    tmp_path = path + '.tmp'
+    written = 0
+    with open(tmp_path, 'wb') as f:
+        for chunk in gzip_jsonl(records):
+            f.write(chunk)
+            written += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return written
+
+
+# --- ARCHIVE ---
+def archive_path(directory, day):
+    return os.path.join(directory, f'{day.isoformat()}.jsonl.gz')
+
+def archive_index_path(directory, day):
+    return os.path.join(directory, f'{day.isoformat()}.index.json')
+
+def write_archive(path, index_path, records):
+    """Write one day's records as an archive file and its story index, atomically; returns bytes written.
+
+    The prompt, each story, and the comments on each story are separate gzip
+    members, so the file still reads as one gzip JSON Lines stream. The index
+    maps each story id to [story offset, length, comments offset, length],
+    letting read_archived_story() decompress only the members it needs.
+    """
+    index = {'prompt': None, 'stories': {}}
+    stories = index['stories']
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        def member(lines):
+            start = f.tell()
+            f.write(gzip.compress(b''.join(lines), compresslevel=6, mtime=0))
+            return [start, f.tell() - start]
+
+        # comments arrive grouped by story, after all the stories
+        comments_of, comments = None, []
+        for record in records:
+            if record['type'] == 'prompt':
+                index['prompt'] = member([_jsonl_line(record)])
+            elif record['type'] == 'story':
+                stories[str(record['id'])] = member([_jsonl_line(record)]) + [0, 0]
+            else:
+                if comments and record['story_id'] != comments_of:
+                    stories[str(comments_of)][2:] = member(comments)
+                    comments = []
+                comments_of = record['story_id']
+                comments.append(_jsonl_line(record))
+        if comments:
+            stories[str(comments_of)][2:] = member(comments)
+        written = f.tell()
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # the archive is in place first; a missing index only makes reads slower
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(index_path + '.tmp', index_path)
+    return written
+
+def _read_archive(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def _read_member(f, offset, length):
+    f.seek(offset)
+    return [json.loads(line) for line in gzip.decompress(f.read(length)).splitlines()]
+
+def archivable_prompts(before):
+    """Days older than `before` that still have stories in the hot tables"""
+    return db.session.scalars(
+        select(DailyEmoji)
+        .where(DailyEmoji.date_posted < before, select(Story.id).where(Story.daily_emoji_id == DailyEmoji.id).exists())
+        .order_by(DailyEmoji.date_posted)
+    ).all()
+
+def archived_prompts():
+    """Days already moved into archive files, oldest first"""
+    return db.session.scalars(
+        select(DailyEmoji)
+        .where(select(ArchivedStory.id).where(ArchivedStory.daily_emoji_id == DailyEmoji.id).exists())
+        .order_by(DailyEmoji.date_posted)
+    ).all()
+
+def archive_day(prompt, directory):
+    """Write one day to its archive file, then remove it from the hot tables.
+
+    The file is complete on disk before anything is deleted, and the
+    deletes run in one transaction. Returns the number of stories moved.
+    """
+    story_ids = select(Story.id).where(Story.daily_emoji_id == prompt.id)
+    os.makedirs(directory, exist_ok=True)
+    write_archive(archive_path(directory, prompt.date_posted), archive_index_path(directory, prompt.date_posted),
+                  export_records([prompt], approved_only=False))
+
+    db.session.execute(insert(ArchivedStory).from_select(
+        ['id', 'daily_emoji_id', 'user_id'],
+        select(Story.id, Story.daily_emoji_id, Story.user_id).where(Story.daily_emoji_id == prompt.id)))
+    db.session.execute(insert(ArchivedComment).from_select(
+        ['id', 'story_id', 'daily_emoji_id', 'user_id'],
+        select(Comments.id, Comments.story_id, Story.daily_emoji_id, Comments.user_id)
+        .join(Story, Story.id == Comments.story_id).where(Story.daily_emoji_id == prompt.id)))
+    uncount_stories(story_ids)
+    comment_ids = select(Comments.id).where(Comments.story_id.in_(story_ids))
+    db.session.execute(delete(CommentLike).where(CommentLike.comment_id.in_(comment_ids)))
+    db.session.execute(delete(Comments).where(Comments.story_id.in_(story_ids)))
+    db.session.execute(delete(StoryLike).where(StoryLike.story_id.in_(story_ids)))
+    db.session.execute(delete(ModerationJob).where(ModerationJob.story_id.in_(story_ids)))
+    moved = db.session.execute(delete(Story).where(Story.daily_emoji_id == prompt.id)).rowcount
+    db.session.commit()
+    return moved
+
+def index_archived_comments(prompt, directory):
+    """Record the comments in an archived day's file that ArchivedComment doesn't list yet.
+
+    Days archived before comments were indexed need this once; returns the rows added.
+    """
+    known = set(db.session.scalars(select(ArchivedComment.id).where(ArchivedComment.daily_emoji_id == prompt.id)))
+    rows = [{'id': record['id'], 'story_id': record['story_id'], 'daily_emoji_id': prompt.id,
+             'user_id': record['user_id']}
+            for record in _archived_records(directory, prompt, approved_only=False)
+            if record['type'] == 'comment' and record['id'] not in known]
+    if rows:
+        db.session.execute(insert(ArchivedComment), rows)
+    db.session.commit()
+    return len(rows)
+
+def index_archive_file(prompt, directory):
+    """Rewrite a day archived before files had a story index into the indexed layout.
+
+    Returns False if the day already has its index.
+    """
+    path = archive_path(directory, prompt.date_posted)
+    index_path = archive_index_path(directory, prompt.date_posted)
+    if os.path.exists(index_path):
+        return False
+    write_archive(path, index_path, _read_archive(path))
+    return True
+
+def read_archived_story(directory, archived):
+    """Load (prompt, story, comments) records for an ArchivedStory from its day file, or None"""
+    day = archived.daily_emoji.date_posted
+    path = archive_path(directory, day)
+    try:
+        with open(archive_index_path(directory, day), encoding='utf-8') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return _scan_archived_story(path, archived.id)
+    span = index['stories'].get(str(archived.id))
+    if span is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            prompt, = _read_member(f, *index['prompt'])
+            story, = _read_member(f, *span[:2])
+            comments = _read_member(f, *span[2:]) if span[3] else []
+    except FileNotFoundError:
+        return None
+    return prompt, story, comments
+
+def _scan_archived_story(path, story_id):
+    """read_archived_story() for a file without an index: read the whole day"""
+    prompt, story, comments = None, None, []
+    try:
+        for record in _read_archive(path):
+            if record['type'] == 'prompt':
+                prompt = record
+            elif record['type'] == 'story' and record['id'] == story_id:
+                story = record
+            elif record['type'] == 'comment' and record['story_id'] == story_id:
+                comments.append(record)
+    except FileNotFoundError:
+        return None
+    if story is None:
+        return None
+    return prompt, story, comments
@@ -0,0 +1,178 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask assets build` copies everything under app/static (except uploaded
+profile pictures) into static/dist under content-hashed names, writes .gz
+(and .br, when the brotli package is installed) next to each text file,
+re-encodes PNGs when Pillow can make them smaller, and records the mapping in
+static/dist/manifest.json. With a manifest present, url_for('static', ...)
+resolves to the fingerprinted file and /static/dist/ serves it with an
+immutable cache header and the best encoding the client accepts.
+"""
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import abort, current_app, request, send_from_directory
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+SKIP_DIRS = {DIST_DIR, 'profile_pics'}
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.ico'}
+MIN_COMPRESS_BYTES = 256
+# (Content-Encoding, file suffix), best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+_manifest = {}
+_fingerprinted = frozenset()
+
+
+# --- BUILD ---
+def _fingerprint(path, data):
+    stem, ext = posixpath.splitext(path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+def _optimize_png(data):
+    if importlib.util.find_spec('PIL') is None:
+        return data
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        out = io.BytesIO()
+        image.save(out, 'PNG', optimize=True)
+    return out.getvalue() if out.tell() < len(data) else data
+
+def _rewrite_css(path, data, manifest):
+    """Point url(...) references at other assets' fingerprinted names"""
+    base = posixpath.dirname(path)
+
+    def replace(match):
+        quote, target = match.groups()
+        if ':' in target or target.startswith(('/', '#')):
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(base, target))
+        if resolved not in manifest:
+            return match.group(0)
+        return f'url({quote}{posixpath.relpath(manifest[resolved], base or ".")}{quote})'
+
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+def _precompress(out_path, data):
+    written = []
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        with open(out_path + '.gz', 'wb') as f:
+            f.write(gz)
+        written.append('gzip')
+    if importlib.util.find_spec('brotli') is not None:
+        import brotli
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            with open(out_path + '.br', 'wb') as f:
+                f.write(br)
+            written.append('br')
+    return written
+
+def build_assets(static_dir):
+    """Build static/dist and its manifest; returns {source path: (fingerprinted path, encodings)}"""
+    out_dir = os.path.join(static_dir, DIST_DIR)
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if not (root == static_dir and d in SKIP_DIRS))
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            sources.append(os.path.relpath(full, static_dir).replace(os.sep, '/'))
+    # stylesheets last, so their url(...)s can point at already-fingerprinted files
+    sources.sort(key=lambda p: (p.endswith('.css'), p))
+
+    manifest, report = {}, {}
+    for path in sources:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            data = f.read()
+        ext = posixpath.splitext(path)[1].lower()
+        if ext == '.png':
+            data = _optimize_png(data)
+        elif ext == '.css':
+            data = _rewrite_css(path, data, manifest)
+        hashed = _fingerprint(path, data)
+        out_path = os.path.join(out_dir, *hashed.split('/'))
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, 'wb') as f:
+            f.write(data)
+        encodings = _precompress(out_path, data) if ext in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES else []
+        manifest[path] = hashed
+        report[path] = (hashed, encodings)
+
+    tmp_path = os.path.join(out_dir, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_NAME))
+    return report
+
+def prune_assets(static_dir):
+    """Delete files in static/dist that the current manifest no longer references; returns how many"""
+    out_dir = os.path.join(static_dir, DIST_DIR)
+    keep = {MANIFEST_NAME}
+    for hashed in load_manifest(static_dir).values():
+        keep.update(hashed + suffix for suffix in ('', '.gz', '.br'))
+    removed = 0
+    for root, _, files in os.walk(out_dir):
+        for name in files:
+            full = os.path.join(root, name)
+            if os.path.relpath(full, out_dir).replace(os.sep, '/') not in keep:
+                os.remove(full)
+                removed += 1
+    return removed
+
+
+# --- SERVING ---
+def load_manifest(static_dir):
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _static_url_defaults(endpoint, values):
+    if endpoint == 'static' and values.get('filename') in _manifest:
+        values['filename'] = f"{DIST_DIR}/{_manifest[values['filename']]}"
+
+def dist_view(filename):
+    if filename not in _fingerprinted:
+        abort(404)
+    directory = os.path.join(current_app.static_folder, DIST_DIR)
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if request.accept_encodings[name] and os.path.exists(os.path.join(directory, filename + suffix)):
+            encoding = name
+            break
+    if encoding is not None:
+        # the type comes from the original name, not the .gz/.br suffix
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(directory, filename + dict(ENCODINGS)[encoding],
+                                       mimetype=mimetype, max_age=31536000)
+        response.content_encoding = encoding
+    else:
+        response = send_from_directory(directory, filename, max_age=31536000)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def init_app(app):
+    """Resolve static URLs through the manifest, if `flask assets build` has produced one"""
+    global _manifest, _fingerprinted
+    if not app.config.get('ASSETS_FINGERPRINT', True):
+        return
+    _manifest = load_manifest(app.static_folder)
+    _fingerprinted = frozenset(_manifest.values())
+    if not _manifest:
+        return
+    app.url_defaults(_static_url_defaults)
+    app.add_url_rule(f'{app.static_url_path}/{DIST_DIR}/<path:filename>', 'static_dist', dist_view)
@@ -1,11 +1,25 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
+from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user
+from sqlalchemy.exc import IntegrityError
 from .forms import LoginForm, RegistrationForm
 from .models import User
 from .extensions import db
+from .security import HasherBusy, login_ip_limiter, login_username_limiter, password_hasher
 
 auth = Blueprint('auth', __name__)
 
+def _render(login_form, reg_form, status=200, retry_after=None):
+    response = render_template('login.html',
+                               title='Login / Register',
+                               login_form=login_form,
+                               reg_form=reg_form)
+    headers = {'Retry-After': str(retry_after)} if retry_after else {}
+    return response, status, headers
+
+def _too_many_attempts(login_form, reg_form, wait):
+    flash(f'Too many sign-in attempts. Please try again in {wait} seconds.', 'danger')
+    return _render(login_form, reg_form, 429, wait)
+
 @auth.route('/login', methods=['GET', 'POST'])
 def login_register():
     if current_user.is_authenticated:
@@ -14,29 +28,54 @@ def login_register():
     login_form = LoginForm()
     reg_form = RegistrationForm()
 
-    if reg_form.submit_register.data and reg_form.validate():
-        user = User(username=reg_form.username.data, email=reg_form.email.data)
-        user.set_password(reg_form.password.data)
-        db.session.add(user)
-        db.session.commit()
-        flash('Congratulations, your account has been created!', 'success')
-        login_user(user)
-        return redirect(url_for('main.dashboard'))
+    # every POST that could reach a password hash is throttled first
+    if request.method == 'POST':
+        wait = login_ip_limiter.take(request.remote_addr)
+        if wait:
+            return _too_many_attempts(login_form, reg_form, wait)
 
-    if login_form.submit_login.data and login_form.validate():
-        user = User.query.filter_by(username=login_form.username.data).first()
-        if user and user.check_password(login_form.password.data):
+    try:
+        if reg_form.submit_register.data and reg_form.validate():
+            user = User(username=reg_form.username.data, email=reg_form.email.data)
+            user.set_password(reg_form.password.data)
+            db.session.add(user)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # a concurrent registration took the username or email after validation
+                db.session.rollback()
+                flash('That username or email address is already taken.', 'danger')
+                return _render(login_form, reg_form)
+            flash('Congratulations, your account has been created!', 'success')
             login_user(user)
             return redirect(url_for('main.dashboard'))
-        else:
+
+        if login_form.submit_login.data and login_form.validate():
+            # only wrong passwords in a valid form spend the username's tokens, so
+            # bare POSTs naming someone else's account can't lock them out
+            username_key = login_form.username.data.strip().lower()
+            wait = login_username_limiter.check(username_key)
+            if wait:
+                return _too_many_attempts(login_form, reg_form, wait)
+            user = User.query.filter_by(username=login_form.username.data).first()
+            if user is not None and user.check_password(login_form.password.data):
+                if password_hasher.needs_rehash(user.password_hash):
+                    user.set_password(login_form.password.data)
+                    db.session.commit()
+                login_user(user)
+                return redirect(url_for('main.dashboard'))
+            if user is None:
+                # same cost as a wrong password, so timing doesn't reveal which usernames exist
+                password_hasher.verify(None, login_form.password.data)
+            login_username_limiter.take(username_key)
             flash('Invalid username or password. Please try again.', 'danger')
+    except HasherBusy:
+        flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+        return _render(login_form, reg_form, 503, 5)
 
-    return render_template('login.html', 
-                           title='Login / Register', 
-                           login_form=login_form, 
-                           reg_form=reg_form)
+    return _render(login_form, reg_form)
 
 @auth.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('main.index'))
\ No newline at end of file
+    return redirect(url_for('main.index'))
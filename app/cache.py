@@ -0,0 +1,183 @@
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+import threading
+import time
+
+# Immutable snapshot of a DailyEmoji row; safe to share between requests/threads
+DailyPrompt = namedtuple('DailyPrompt', ['id', 'date', 'emojis'])
+
+
+def prompt_date(rollover_hour=0, now=None):
+    """Return the prompt day for `now`; the day starts at `rollover_hour` local time"""
+    now = now or datetime.now()
+    return (now - timedelta(hours=rollover_hour)).date()
+
+
+class DailyPromptCache:
+    """Per-worker cache holding the current day's prompt.
+
+    Only one day is ever kept: a lookup for a new date replaces the entry, so the
+    cache rolls over by itself at the day boundary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, day, loader):
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry.date == day:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = loader(day)
+            self._entry = entry
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'date': self._entry.date.isoformat() if self._entry else None}
+
+
+daily_prompt_cache = DailyPromptCache()
+
+
+class FragmentCache:
+    """Size-capped LRU cache of rendered HTML fragments.
+
+    Entries are tagged with the story ids they contain, so a write to one story
+    drops only the fragments that show it. Entries also expire after `ttl`
+    seconds, which bounds staleness between workers that don't see each
+    other's invalidations.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, size, value, story_ids)
+        self._by_story = {}  # story_id -> set(keys)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, size, story_ids=()):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            story_ids = frozenset(story_ids)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value, story_ids)
+            self._size += size
+            for story_id in story_ids:
+                self._by_story.setdefault(story_id, set()).add(key)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def invalidate_matching(self, predicate):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._drop(key)
+
+    def invalidate_story(self, story_id):
+        with self._lock:
+            for key in list(self._by_story.get(story_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_story.clear()
+            self._size = 0
+
+    def _drop(self, key):
+        _, size, _, story_ids = self._entries.pop(key)
+        self._size -= size
+        for story_id in story_ids:
+            keys = self._by_story.get(story_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_story[story_id]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self._size}
+
+
+feed_fragment_cache = FragmentCache()
+
+
+class UserCache:
+    """Per-worker TTL cache of UserSnapshot objects for the login user loader.
+
+    Writes invalidate their own worker's entry; the short TTL bounds how long
+    another worker can keep showing the old values.
+    """
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (expires, snapshot)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+user_cache = UserCache()
@@ -0,0 +1,195 @@
+from datetime import timedelta
+import sys
+
+import click
+from flask import current_app
+from .assets import build_assets, prune_assets
+from .archive import (archivable_prompts, archive_day, archived_prompts, export_prompts, export_records, gzip_jsonl,
+                      index_archive_file, index_archived_comments, missing_archives, write_export)
+from .extensions import db
+from .cache import prompt_date
+from .counters import reconcile_counters
+from .migrations import init_db, reserve_archived_ids
+from .moderation import moderation_queue
+from .models import User
+from .ranking import decay_hot_scores, rebuild_scores
+from .search import install_search_index, rebuild_search_index
+
+
+def register_commands(app):
+    """Attach maintenance commands to `flask --app run.py ...`"""
+
+    @app.cli.group('db')
+    def db_group():
+        """Database schema management."""
+
+    @db_group.command('init')
+    def db_init():
+        """Create the schema on a new database, or upgrade an existing one."""
+        problems = init_db()
+        for problem in problems:
+            click.echo(f"WARNING: {problem}", err=True)
+        click.echo("Schema is up to date." if not problems else "Schema upgrade finished with warnings.")
+
+    # same operation; the name reads better when migrating an existing app.db
+    db_group.add_command(db_init, 'upgrade')
+
+    @app.cli.group()
+    def streaks():
+        """Streak maintenance."""
+
+    @streaks.command('reset')
+    def reset_streaks():
+        """Zero streaks broken by a missed day; run just after the day boundary."""
+        today = prompt_date(current_app.config['DAILY_PROMPT_ROLLOVER_HOUR'])
+        reset = User.reset_streaks_once(today)
+        if reset is None:
+            click.echo(f"Streaks were already reset for {today.isoformat()}.")
+            return
+        click.echo(f"Reset {reset} broken streak(s) for {today.isoformat()}.")
+
+    @app.cli.group()
+    def moderation():
+        """Moderation queue workers."""
+
+    @moderation.command('work')
+    @click.option('--once', is_flag=True, help='Process the jobs that are due now, then exit.')
+    def moderation_work(once):
+        """Run moderation workers in this process until interrupted."""
+        if not moderation_queue.enabled:
+            raise click.ClickException('Moderation is disabled (check MODERATION_BACKEND and GEMINI_API_KEY).')
+        if once:
+            click.echo(f"Processed {moderation_queue.drain()} job(s).")
+            return
+        moderation_queue.start()
+        click.echo(f"Moderating with {current_app.config['MODERATION_WORKERS']} worker(s); Ctrl-C to stop.")
+        try:
+            moderation_queue.wait()
+        except KeyboardInterrupt:
+            moderation_queue.stop()
+
+    @moderation.command('requeue')
+    @click.option('--story', 'story_ids', type=int, multiple=True, help='Only this story (repeatable).')
+    def moderation_requeue(story_ids):
+        """Retry stories whose moderation gave up after MODERATION_MAX_ATTEMPTS."""
+        requeued = moderation_queue.requeue(story_ids or None)
+        click.echo(f"Requeued {requeued} stor{'y' if requeued == 1 else 'ies'} for moderation.")
+
+    @app.cli.group()
+    def search():
+        """Full-text search index maintenance."""
+
+    @search.command('rebuild')
+    def search_rebuild():
+        """Re-index every story and comment (e.g. after restoring an old backup)."""
+        problems = install_search_index()
+        if problems:
+            for problem in problems:
+                click.echo(f"ERROR: {problem}", err=True)
+            raise SystemExit(1)
+        stories, comments = rebuild_search_index()
+        click.echo(f"Indexed {stories} stories and {comments} comments.")
+
+    @app.cli.group()
+    def ranking():
+        """Story ranking maintenance."""
+
+    @ranking.command('decay')
+    def ranking_decay():
+        """Decay hot scores by the time since the last run; run every few minutes."""
+        click.echo(f"Decayed {decay_hot_scores()} hot score(s).")
+
+    @ranking.command('rebuild')
+    def ranking_rebuild():
+        """Recompute hot and top scores from likes and comments (e.g. after upgrading)."""
+        click.echo(f"Rebuilt scores; {rebuild_scores()} stories are currently hot.")
+
+    @app.cli.group()
+    def counters():
+        """Maintained comment/story counters."""
+
+    @counters.command('reconcile')
+    @click.option('--dry-run', is_flag=True, help='Report drifted counters without fixing them.')
+    def counters_reconcile(dry_run):
+        """Recount every counter from the tables and fix any that drifted (e.g. after upgrading)."""
+        drift = reconcile_counters(fix=not dry_run)
+        verb = 'drifted' if dry_run else 'fixed'
+        for name, rows in drift.items():
+            click.echo(f"{name}: {rows} row(s) {verb}.")
+
+    @app.cli.command('export')
+    @click.option('--since', type=click.DateTime(['%Y-%m-%d']), help='First prompt day to include.')
+    @click.option('--until', type=click.DateTime(['%Y-%m-%d']), help='Last prompt day to include.')
+    @click.option('--user', 'username', help='Only this user\'s stories and comments.')
+    @click.option('--all-statuses', is_flag=True, help='Include stories that are pending or rejected.')
+    @click.option('--output', '-o', default='-', help='File to write (default: stdout).')
+    def export(since, until, username, all_statuses, output):
+        """Export prompts, stories and comments as gzipped JSON Lines, one day at a time."""
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise click.ClickException(f'No user named {username!r}.')
+            user_id = user.id
+        prompts = export_prompts(since.date() if since else None, until.date() if until else None, user_id)
+        archive_dir = current_app.config['ARCHIVE_DIR']
+        missing = missing_archives(prompts, archive_dir)
+        if missing:
+            raise click.ClickException('Archive files missing for ' + ', '.join(d.isoformat() for d in missing)
+                                       + f' (looked in {archive_dir}).')
+        records = export_records(prompts, user_id=user_id, approved_only=not all_statuses, archive_dir=archive_dir)
+        if output == '-':
+            for chunk in gzip_jsonl(records):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            written = write_export(output, records)
+            click.echo(f"Wrote {written} bytes to {output}.", err=True)
+
+    @app.cli.command('archive')
+    @click.option('--older-than', type=int, help='Archive days older than this many days (default: ARCHIVE_AFTER_DAYS).')
+    @click.option('--dry-run', is_flag=True, help='List the days that would be archived.')
+    @click.option('--reindex', is_flag=True, help='Index the archive files of days already archived, then exit.')
+    def archive(older_than, dry_run, reindex):
+        """Move old days' stories and comments into archive files under ARCHIVE_DIR."""
+        directory = current_app.config['ARCHIVE_DIR']
+        if reindex:
+            prompts = archived_prompts()
+            missing = set(missing_archives(prompts, directory))
+            for prompt in prompts:
+                if prompt.date_posted in missing:
+                    click.echo(f"Skipped {prompt.date_posted.isoformat()}: archive file missing.", err=True)
+                    continue
+                if index_archive_file(prompt, directory):
+                    click.echo(f"Indexed the stories in {prompt.date_posted.isoformat()}.")
+                added = index_archived_comments(prompt, directory)
+                click.echo(f"Indexed {added} comment(s) from {prompt.date_posted.isoformat()}.")
+            with db.engine.begin() as conn:
+                reserve_archived_ids(conn)
+            return
+        older_than = current_app.config['ARCHIVE_AFTER_DAYS'] if older_than is None else older_than
+        if older_than < 1:
+            raise click.ClickException('--older-than must be at least 1 day.')
+        today = prompt_date(current_app.config['DAILY_PROMPT_ROLLOVER_HOUR'])
+        for prompt in archivable_prompts(today - timedelta(days=older_than)):
+            if dry_run:
+                click.echo(f"Would archive {prompt.date_posted.isoformat()}.")
+                continue
+            moved = archive_day(prompt, directory)
+            click.echo(f"Archived {moved} stories from {prompt.date_posted.isoformat()}.")
+
+    @app.cli.group()
+    def assets():
+        """Static asset pipeline."""
+
+    @assets.command('build')
+    @click.option('--prune', is_flag=True, help='Also delete fingerprinted files from earlier builds.')
+    def assets_build(prune):
+        """Fingerprint, optimize and precompress app/static into app/static/dist."""
+        report = build_assets(current_app.static_folder)
+        for source, (hashed, encodings) in sorted(report.items()):
+            extra = f" (+{', '.join(encodings)})" if encodings else ''
+            click.echo(f"{source} -> {hashed}{extra}")
+        if prune:
+            click.echo(f"Pruned {prune_assets(current_app.static_folder)} stale file(s).")
+        click.echo("Restart the app to pick up the new manifest.")
@@ -0,0 +1,68 @@
+"""Maintained counters: Story.comment_count, User.story_count, User.comment_count.
+
+Writers adjust them with SQL-side UPDATEs in the same transaction as the row
+they add or remove, so concurrent writes never lose an increment. Anything
+that bypasses those paths (a restored backup, a hand-edited database) is put
+right by reconcile_counters(), which recounts with set-based UPDATEs.
+"""
+from sqlalchemy import func, select, update
+
+from .extensions import db
+from .models import Comments, Story, User
+
+
+def count_story(user_id, delta=1):
+    """Adjust a user's story_count; the caller commits"""
+    db.session.execute(update(User).where(User.id == user_id).values(story_count=User.story_count + delta))
+
+def count_comment(story_id, user_id, delta=1):
+    """Adjust a story's and its commenter's comment_count; the caller commits"""
+    db.session.execute(update(Story).where(Story.id == story_id)
+                       .values(comment_count=Story.comment_count + delta))
+    db.session.execute(update(User).where(User.id == user_id).values(comment_count=User.comment_count + delta))
+
+def uncount_stories(story_ids):
+    """Take the stories `story_ids` selects, and the comments on them, off their
+    authors' counters; call before deleting the rows. The caller commits.
+    """
+    stories = (select(func.count(Story.id))
+               .where(Story.user_id == User.id, Story.id.in_(story_ids))
+               .correlate(User).scalar_subquery())
+    comments = (select(func.count(Comments.id))
+                .where(Comments.user_id == User.id, Comments.story_id.in_(story_ids))
+                .correlate(User).scalar_subquery())
+    db.session.execute(update(User)
+                       .where(User.id.in_(select(Story.user_id).where(Story.id.in_(story_ids))))
+                       .values(story_count=User.story_count - stories))
+    db.session.execute(update(User)
+                       .where(User.id.in_(select(Comments.user_id).where(Comments.story_id.in_(story_ids))))
+                       .values(comment_count=User.comment_count - comments))
+
+def _counter_checks():
+    """(name, model, column, true count as a correlated subquery) for every counter"""
+    return (
+        ('story.comment_count', Story, Story.comment_count,
+         select(func.count(Comments.id)).where(Comments.story_id == Story.id).correlate(Story).scalar_subquery()),
+        ('user.story_count', User, User.story_count,
+         select(func.count(Story.id)).where(Story.user_id == User.id).correlate(User).scalar_subquery()),
+        ('user.comment_count', User, User.comment_count,
+         select(func.count(Comments.id)).where(Comments.user_id == User.id).correlate(User).scalar_subquery()),
+    )
+
+def reconcile_counters(fix=True):
+    """Find counters that disagree with the tables and, with `fix`, correct them.
+
+    One statement per counter, each walking the table once against the
+    story_id / user_id indexes. Returns {counter name: rows that had drifted}.
+    """
+    drift = {}
+    for name, model, column, actual in _counter_checks():
+        if fix:
+            drift[name] = db.session.execute(
+                update(model).where(column != actual).values({column.key: actual})
+            ).rowcount
+        else:
+            drift[name] = db.session.scalar(select(func.count()).select_from(model).where(column != actual))
+    if fix:
+        db.session.commit()
+    return drift
@@ -1,5 +1,19 @@
+from sqlalchemy import event
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 
 db = SQLAlchemy()
-login_manager = LoginManager()
\ No newline at end of file
+login_manager = LoginManager()
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run `PRAGMA key=value` for each item on every new SQLite connection"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f'PRAGMA {key}={value}')
+        cursor.close()
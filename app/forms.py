@@ -1,6 +1,8 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
+from sqlalchemy import or_, select
+from .extensions import db
 from .models import User
 import re
 
@@ -15,15 +17,21 @@ class RegistrationForm(FlaskForm):
         'Repeat Password', validators=[DataRequired(), EqualTo('password', message='Passwords must match.')])
     submit_register = SubmitField('Register')
 
-    def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different username.')
-
-    def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different email address.')
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        # username and email uniqueness in one query
+        taken = db.session.execute(
+            select(User.username, User.email)
+            .where(or_(User.username == self.username.data, User.email == self.email.data))
+            .limit(2)
+        ).all()
+        for username, email in taken:
+            if username == self.username.data:
+                self.username.errors.append('Please use a different username.')
+            if email == self.email.data:
+                self.email.errors.append('Please use a different email address.')
+        return not taken
 
     def validate_password(self, password):
         # use match() so the anchored regex is applied to the full string
@@ -0,0 +1,175 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import importlib.util
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from .extensions import db
+
+# (variant name, square edge in px)
+PROFILE_PIC_VARIANTS = (('avatar', 256), ('thumb', 64))
+
+# Content-addressed names look like <sha256 prefix>_<variant>.webp
+HASHED_NAME = re.compile(r'^[0-9a-f]{16}_[a-z]+\.webp$')
+
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def uploads_available():
+    """Pillow is optional (and only imported by the image workers); uploads need it"""
+    return importlib.util.find_spec('PIL') is not None
+
+
+class UploadRejected(ValueError):
+    """The upload is too large or not a supported image type"""
+
+
+def sniff_image_type(head):
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _too_many_pixels(max_pixels):
+    return UploadRejected(f'Profile pictures must be at most {max_pixels // 1_000_000} megapixels.')
+
+
+def check_dimensions(image, max_pixels):
+    """Reject an opened (not yet decoded) image whose header declares too many pixels"""
+    width, height = image.size
+    if width * height > max_pixels:
+        raise _too_many_pixels(max_pixels)
+
+
+def read_upload(file_storage, max_bytes, max_pixels, chunk_size=64 * 1024):
+    """Check an upload's type, size and dimensions, then copy it for the image worker.
+
+    Werkzeug has already spooled the request body, so the checks seek around
+    that file; only the image header is parsed here. The copy is needed
+    because Werkzeug closes its file when the request ends.
+    """
+    stream = file_storage.stream
+    head = stream.read(16)
+    if not head:
+        raise UploadRejected('The uploaded file is empty.')
+    if sniff_image_type(head) is None:
+        raise UploadRejected('Please upload a PNG, JPEG, GIF or WebP image.')
+    stream.seek(0, os.SEEK_END)
+    if stream.tell() > max_bytes:
+        raise UploadRejected(f'Profile pictures must be smaller than {max_bytes // (1024 * 1024)} MB.')
+    stream.seek(0)
+    from PIL import Image, UnidentifiedImageError
+    try:
+        with Image.open(stream) as image:
+            check_dimensions(image, max_pixels)
+    except Image.DecompressionBombError:
+        # Pillow's own, much higher limit, also checked from the header alone
+        raise _too_many_pixels(max_pixels) from None
+    except (UnidentifiedImageError, OSError):
+        raise UploadRejected('That image could not be read.') from None
+    stream.seek(0)
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    shutil.copyfileobj(stream, spool, chunk_size)
+    spool.seek(0)
+    return spool
+
+
+def render_variants(source, max_pixels):
+    """Decode once and return {variant: webp bytes}"""
+    from PIL import Image, ImageOps
+    with Image.open(source) as image:
+        check_dimensions(image, max_pixels)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        variants = {}
+        for name, size in PROFILE_PIC_VARIANTS:
+            resized = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            resized.save(out, 'WEBP', quality=82, method=4)
+            variants[name] = out.getvalue()
+    return variants
+
+
+def store_variants(variants, directory):
+    """Write variants under content-hash names; returns {variant: filename}"""
+    os.makedirs(directory, exist_ok=True)
+    names = {}
+    for name, data in variants.items():
+        filename = f"{hashlib.sha256(data).hexdigest()[:16]}_{name}.webp"
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        names[name] = filename
+    return names
+
+
+def _remove_unreferenced(directory, filenames):
+    from .models import User
+    for filename in filenames:
+        if not filename:
+            continue
+        stored = f'profile_pics/{filename}'
+        in_use = db.session.query(
+            User.query.filter((User.profile_pic == stored) | (User.profile_thumb == stored)).exists()
+        ).scalar()
+        if not in_use:
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+
+
+def process_profile_pic(app, user_id, source):
+    """Worker: build the variants, point the user at them, delete superseded files.
+
+    A failure is recorded in User.profile_pic_error for the profile page.
+    """
+    from .models import User
+    with app.app_context():
+        directory = app.config['PROFILE_PICS_DIR']
+        try:
+            names = store_variants(render_variants(source, app.config['PROFILE_PIC_MAX_PIXELS']), directory)
+        except Exception as e:
+            print(f"ERROR: could not process profile picture for user {user_id}: {e}")
+            user = db.session.get(User, user_id)
+            if user is not None:
+                user.profile_pic_error = (str(e) if isinstance(e, UploadRejected)
+                                          else 'That image could not be processed.')
+                db.session.commit()
+            return
+        finally:
+            source.close()
+        user = db.session.get(User, user_id)
+        if user is None:
+            return
+        superseded = [os.path.basename(p) for p in (user.profile_pic, user.profile_thumb) if p]
+        user.profile_pic = f"profile_pics/{names['avatar']}"
+        user.profile_thumb = f"profile_pics/{names['thumb']}"
+        user.profile_pic_error = None
+        db.session.commit()
+        _remove_unreferenced(directory, [n for n in superseded if n not in names.values()])
+
+
+def submit_profile_pic(app, user_id, source):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='images')
+    return _executor.submit(process_profile_pic, app, user_id, source)
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from sqlalchemy import select, update
+
+from .extensions import db
+
+
+def bump_live_version(story_id):
+    """Advance a story's live_version inside the caller's transaction; returns the new value.
+
+    Comment writes stamp the comment with this value, so "everything that
+    changed since version N" is a range scan on (story_id, live_version).
+    """
+    from .models import Story
+    db.session.execute(update(Story).where(Story.id == story_id)
+                       .values(live_version=Story.live_version + 1))
+    return db.session.scalar(select(Story.live_version).where(Story.id == story_id))
+
+
+class StoryWatcher:
+    """Lets any number of open streams/long-polls wait for a story to change.
+
+    Waiting costs no database work: writes in this worker wake waiters
+    directly, and one background thread per worker picks up writes made by
+    other workers with a single query over all watched stories every
+    `interval` seconds. `max_waiters` bounds how many requests may block at
+    once; past it, callers get an immediate answer instead.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 1.0
+        self._lock = threading.Lock()
+        self._conditions = {}  # story_id -> Condition (present while someone waits)
+        self._waiting = {}  # story_id -> number of waiters
+        self._versions = {}  # story_id -> newest version seen
+        self._slots = None
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('LIVE_POLL_INTERVAL', 1.0)
+        self._slots = threading.BoundedSemaphore(app.config.get('LIVE_MAX_WAITERS', 200))
+        app.extensions['story_watcher'] = self
+
+    def notify(self, story_id, version):
+        with self._lock:
+            condition = self._conditions.get(story_id)
+            # versions are only tracked while someone is waiting on the story
+            if condition is None or version <= self._versions.get(story_id, 0):
+                return
+            self._versions[story_id] = version
+            condition.notify_all()
+
+    def acquire(self):
+        """Reserve a waiting slot; False when the worker is already at max_waiters"""
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def wait(self, story_id, since, timeout):
+        """Block until the story passes version `since` or `timeout` elapses; returns True on change"""
+        self._ensure_thread()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition = self._conditions.setdefault(story_id, threading.Condition(self._lock))
+            self._waiting[story_id] = self._waiting.get(story_id, 0) + 1
+            try:
+                while self._versions.get(story_id, 0) <= since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    condition.wait(remaining)
+                return True
+            finally:
+                self._waiting[story_id] -= 1
+                if not self._waiting[story_id]:
+                    del self._waiting[story_id]
+                    del self._conditions[story_id]
+                    self._versions.pop(story_id, None)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._poll_loop, name='story-watcher', daemon=True)
+                self._thread.start()
+
+    def _poll_loop(self):
+        from .models import Story
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                story_ids = list(self._waiting)
+            if not story_ids:
+                continue
+            try:
+                with self.app.app_context():
+                    rows = db.session.execute(
+                        select(Story.id, Story.live_version).where(Story.id.in_(story_ids))
+                    ).all()
+            except Exception as e:
+                print(f"ERROR: story watcher poll failed: {e}")
+                continue
+            for story_id, version in rows:
+                self.notify(story_id, version)
+
+
+story_watcher = StoryWatcher()
@@ -1,32 +1,29 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, session, jsonify
+from flask import (Blueprint, Response, abort, current_app, render_template, redirect, url_for, request, flash,
+                   jsonify, send_from_directory, stream_with_context)
 from flask_login import current_user, login_required
-from .models import DailyEmoji, Story, User, Comments
+from markupsafe import Markup
+from sqlalchemy import select, update, delete, insert, func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
+from .models import ArchivedStory, DailyEmoji, Story, User, Comments, StoryLike, CommentLike, MODERATION_APPROVED
 from .extensions import db
-from datetime import date
+from .cache import DailyPrompt, daily_prompt_cache, feed_fragment_cache, prompt_date
+from .utils import decode_cursor, keyset_page
+from .moderation import moderation_queue
+from .live import bump_live_version, story_watcher
+from .ranking import bump_scores, top_stories
+from .counters import count_comment, count_story
+from .metrics import long_lived
+from .search import highlight, search, search_available
+from .archive import export_prompts, export_records, gzip_jsonl, missing_archives, read_archived_story
+from .images import HASHED_NAME, UploadRejected, read_upload, submit_profile_pic, uploads_available
+from datetime import date, datetime
+import json
 import random
-import os
-from werkzeug.utils import secure_filename
-import google.generativeai as genai
+import time
 
 main = Blueprint('main', __name__)
 
-# initialize Gemini API client if API key is available
-try:
-    API_KEY = os.environ.get('GEMINI_API_KEY')
-    if API_KEY:
-        genai.configure(api_key=API_KEY)
-        gemini_model = genai.GenerativeModel('gemini-2.5-flash')
-        moderation_enabled = True
-        print("SUCCESS: Gemini API client initialized.")
-    else:
-        print("WARNING: GEMINI_API_KEY not found. Moderation is disabled.")
-        gemini_model = None
-        moderation_enabled = False
-except Exception as e:
-    print(f"WARNING: Gemini client could not be initialized. Moderation is disabled. Error: {e}")
-    gemini_model = None
-    moderation_enabled = False
-
 EMOJI_POOL = [
     "😀", "😃", "😄", "😁", "😆", "😅", "😂", "🤣", "😊", "😇", "🙂", "🙃", "😉", "😌", "😍", "🥰", "😘",
     "😗", "😙", "😚", "😋", "😛", "😜", "🤪", "🤨", "🧐", "🤓", "😎", "🤩", "🥳", "😏", "😒", "😞",
@@ -79,36 +76,92 @@ EMOJI_POOL = [
     "▫️", "🔶", "🔷", "🔸", "🔹", "🔺", "🔻", "💠", "🔘", "🔳", "🔲"
 ]
 
-def get_or_create_daily_prompt():
-    today = date.today()
-    daily_emojis_obj = DailyEmoji.query.filter_by(date_posted=today).first()
+def _load_daily_prompt(day):
+    """Fetch (or create) the DailyEmoji row for `day` and snapshot it"""
+    daily_emojis_obj = DailyEmoji.query.filter_by(date_posted=day).first()
     if not daily_emojis_obj:
-        random.seed(today.isoformat())
-        random_emojis = random.sample(EMOJI_POOL, 6)
+        # seed a private generator so every worker picks the same emojis for the day
+        random_emojis = random.Random(day.isoformat()).sample(EMOJI_POOL, 6)
         emoji_string = " ".join(random_emojis)
-        daily_emojis_obj = DailyEmoji(emojis=emoji_string, date_posted=today)
+        daily_emojis_obj = DailyEmoji(emojis=emoji_string, date_posted=day)
         db.session.add(daily_emojis_obj)
         try:
             db.session.commit()
-        except Exception:
+        except IntegrityError:
+            # another worker created today's row first
             db.session.rollback()
-            daily_emojis_obj = DailyEmoji.query.filter_by(date_posted=today).first()
-    return daily_emojis_obj
+            daily_emojis_obj = DailyEmoji.query.filter_by(date_posted=day).first()
+    # every worker's rollover tries; the first to claim the day closes out yesterday's broken streaks
+    User.reset_streaks_once(day)
+    return DailyPrompt(id=daily_emojis_obj.id,
+                       date=daily_emojis_obj.date_posted,
+                       emojis=tuple(daily_emojis_obj.emojis.split()))
+
+def get_or_create_daily_prompt():
+    """Return today's DailyPrompt; only the first call of the day touches the database"""
+    today = prompt_date(current_app.config.get('DAILY_PROMPT_ROLLOVER_HOUR', 0))
+    return daily_prompt_cache.get(today, _load_daily_prompt)
+
+# --- LIKES ---
+def toggle_like(like_model, fk_column, target_model, target_id, on_change=None):
+    """Toggle the current user's like on a story/comment; the caller commits.
+
+    The counter is adjusted with a single SQL-side UPDATE so concurrent likes
+    never overwrite each other; `on_change(+1/-1)` runs in the same
+    transaction when it actually moved. Returns (likes, liked).
+    """
+    removed = db.session.execute(
+        delete(like_model).where(like_model.user_id == current_user.id, fk_column == target_id)
+    ).rowcount
+    if removed:
+        db.session.execute(
+            update(target_model)
+            .where(target_model.id == target_id, target_model.likes > 0)
+            .values(likes=target_model.likes - 1)
+        )
+        if on_change is not None:
+            on_change(-1)
+        liked = False
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(like_model).values({'user_id': current_user.id, fk_column.key: target_id}))
+            db.session.execute(
+                update(target_model)
+                .where(target_model.id == target_id)
+                .values(likes=target_model.likes + 1)
+            )
+            if on_change is not None:
+                on_change(1)
+        except IntegrityError:
+            # a concurrent request from the same user already inserted the like
+            pass
+        liked = True
+    likes = db.session.scalar(select(target_model.likes).where(target_model.id == target_id))
+    return likes, liked
+
+def liked_ids(like_model, fk_column, target_ids):
+    """Return the subset of target_ids the current user has liked, in one query"""
+    target_ids = list(target_ids)
+    if not target_ids or not current_user.is_authenticated:
+        return set()
+    return set(db.session.scalars(
+        select(fk_column).where(like_model.user_id == current_user.id, fk_column.in_(target_ids))
+    ))
 
 @main.route('/')
 def index():
     if current_user.is_authenticated:
         return redirect(url_for('main.dashboard'))
     daily_emojis_obj = get_or_create_daily_prompt()
-    emojis = daily_emojis_obj.emojis.split()
-    return render_template('base.html', emojis=emojis)
+    return render_template('base.html', emojis=daily_emojis_obj.emojis)
 
 @main.route('/dashboard')
 @login_required
 def dashboard():
     daily_emojis_obj = get_or_create_daily_prompt()
     user_story_for_today = Story.query.filter_by(
-        author=current_user,
+        user_id=current_user.id,
         daily_emoji_id=daily_emojis_obj.id
     ).first()
     return render_template('dashboard.html',
@@ -130,36 +183,32 @@ def submit_story():
         flash("Your story must be at least 10 characters long.", "warning")
         return redirect(url_for('main.dashboard'))
 
-    if moderation_enabled and gemini_model:
-        try:
-            emojis_for_prompt = daily_emojis_obj.emojis if daily_emojis_obj else ''
-            prompt = f"""
-            Analyze the user's story for relevance to the given emojis and for any harmful content.
-            The story should be creatively related to the emojis, but be lenient to encourage imagination.
-            Reject only if there is absolutely no possible connection or if it contains explicit content, hate speech, or severe toxicity.
-            Respond with ONLY one of the following decisions: "Yes", "No, explicit", or "No, off-topic".
-            EMOJIS: {emojis_for_prompt}
-            USER STORY: \"{story_content}\"
-            """
-            response = gemini_model.generate_content(prompt)
-            decision = response.text.strip()
-            if "No" in decision:
-                flash(f"Your story was flagged as inappropriate or off-topic. Please revise.", "danger")
-                return redirect(url_for('main.dashboard'))
-        except Exception as e:
-            print(f"ERROR: Gemini API call failed: {e}")
-            flash("Could not verify story content. Please try again later.", "warning")
-            return redirect(url_for('main.dashboard'))
-
-    if Story.query.filter_by(author=current_user, daily_emoji_id=daily_emojis_obj.id).first():
+    if moderation_queue.is_full():
+        flash("We're reviewing a lot of stories right now. Please try again in a few minutes.", "warning")
+        return redirect(url_for('main.dashboard'))
+
+    if has_posted_today(daily_emojis_obj):
         return redirect(url_for('main.stories'))
 
     try:
-        new_story = Story(title=story_title, content=story_content, author=current_user, daily_emoji_id=daily_emojis_obj.id)
-        current_user.update_streak(date.today())
+        user = db.session.get(User, current_user.id)
+        new_story = Story(title=story_title, content=story_content, author=user, daily_emoji_id=daily_emojis_obj.id)
+        moderation_queue.submit_for_review(new_story)
+        user.update_streak(daily_emojis_obj.date)
         db.session.add(new_story)
+        count_story(user.id)
         db.session.commit()
-        flash(f"Story submitted! Your current streak: {current_user.current_streak} days!", "success")
+        moderation_queue.notify()
+        # a new story lands on the first page of the newest-first feed (the only cached sort)
+        feed_fragment_cache.invalidate((daily_emojis_obj.id, 'new', None))
+        if new_story.moderation_status == MODERATION_APPROVED:
+            flash(f"Story submitted! Your current streak: {user.current_streak} days!", "success")
+        else:
+            flash(f"Story submitted! It will appear in the feed once it has been reviewed. Your current streak: {user.current_streak} days!", "success")
+        return redirect(url_for('main.stories'))
+    except IntegrityError:
+        # a concurrent submit from the same user won the unique (user, prompt) slot
+        db.session.rollback()
         return redirect(url_for('main.stories'))
     except Exception as e:
         db.session.rollback()
@@ -167,47 +216,337 @@ def submit_story():
         flash("Error submitting your story. Please try again.", "error")
         return redirect(url_for('main.dashboard'))
 
+# --- STORIES FEED ---
+# ?sort= value -> column the feed is ordered by
+FEED_SORTS = {
+    'new': Story.timestamp,
+    'hot': Story.hot_score,
+    'top': Story.top_score,
+}
+# Scores change while a reader scrolls (likes, comments, `flask ranking decay`),
+# so a keyset position in them goes stale: decay alone would replay the whole
+# feed. These sorts page by offset instead. Decay keeps the order, and the feed
+# script drops stories it has already shown; a story that climbs above the
+# reader's position only shows up on a reload.
+OFFSET_SORTS = ('hot', 'top')
+# Only the newest-first feed is cached. Likes, comments and `flask ranking
+# decay` move stories between pages of the score-ordered sorts, so a cached
+# hot/top page could repeat or skip stories.
+CACHED_SORTS = ('new',)
+
+def feed_page(daily_emoji_id, cursor=None, limit=None, sort='new'):
+    """One page of a day's stories in FEED_SORTS order, best/newest first.
+
+    `cursor` is a decode_feed_cursor() value. Authors are joined in; comment
+    counts come from Story.comment_count. Returns (stories, next_cursor).
+    """
+    limit = limit or current_app.config.get('FEED_PAGE_SIZE', 20)
+    query = (Story.query
+             .options(joinedload(Story.author))
+             .filter(Story.daily_emoji_id == daily_emoji_id,
+                     Story.moderation_status == MODERATION_APPROVED))
+    column = FEED_SORTS[sort]
+    if sort in OFFSET_SORTS:
+        offset = cursor or 0
+        rows = query.order_by(column.desc(), Story.id.desc()).offset(offset).limit(limit + 1).all()
+        next_cursor = str(offset + limit) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    return keyset_page(query, column, Story.id, cursor, limit,
+                       position=lambda story: (getattr(story, column.key), story.id))
+
+def decode_feed_cursor(cursor, sort):
+    """Parse a feed cursor for `sort`; raises ValueError when malformed"""
+    if sort in OFFSET_SORTS:
+        offset = int(cursor)
+        if offset < 0:
+            raise ValueError(cursor)
+        return offset
+    return decode_cursor(cursor)
+
+def rendered_feed_page(daily_emoji_id, cursor=None, sort='new'):
+    """User-neutral story cards for one feed page, served from feed_fragment_cache
+    for CACHED_SORTS.
+
+    Returns (cards_html, next_cursor, story_ids).
+    """
+    key = (daily_emoji_id, sort, cursor)
+    cached = sort in CACHED_SORTS
+    page = feed_fragment_cache.get(key) if cached else None
+    if page is None:
+        rows, next_cursor = feed_page(daily_emoji_id, cursor, sort=sort)
+        cards_html = Markup(render_template('_story_cards.html', stories=rows))
+        story_ids = tuple(story.id for story in rows)
+        page = (cards_html, next_cursor, story_ids)
+        if cached:
+            feed_fragment_cache.set(key, page, len(cards_html.encode()), story_ids)
+    return page
+
+def has_posted_today(daily_emojis_obj):
+    return db.session.query(
+        Story.query.filter_by(user_id=current_user.id, daily_emoji_id=daily_emojis_obj.id).exists()
+    ).scalar()
+
 @main.route('/stories')
 @login_required
 def stories():
     daily_emojis_obj = get_or_create_daily_prompt()
-    if not Story.query.filter_by(author=current_user, daily_emoji_id=daily_emojis_obj.id).first():
+    if not has_posted_today(daily_emojis_obj):
         flash("You must post your own story before you can view others'.", "warning")
         return redirect(url_for('main.dashboard'))
-    
-    all_stories = Story.query.filter_by(daily_emoji_id=daily_emojis_obj.id).order_by(Story.timestamp.desc()).all()
-    liked_stories = session.get('liked_stories', [])
-    
+
+    sort = request.args.get('sort', 'new')
+    if sort not in FEED_SORTS:
+        sort = 'new'
+    cards_html, next_cursor, story_ids = rendered_feed_page(daily_emojis_obj.id, sort=sort)
+    liked_stories = liked_ids(StoryLike, StoryLike.story_id, story_ids)
+
     return render_template('stories.html',
-                           stories=all_stories,
+                           cards_html=cards_html,
+                           next_cursor=next_cursor,
+                           sort=sort,
                            prompt_emojis=daily_emojis_obj.emojis,
                            liked_stories=liked_stories)
 
+@main.route('/api/stories')
+@login_required
+def api_stories():
+    daily_emojis_obj = get_or_create_daily_prompt()
+    if not has_posted_today(daily_emojis_obj):
+        return jsonify({'success': False, 'message': "Post your own story before viewing others'."}), 403
+
+    sort = request.args.get('sort', 'new')
+    if sort not in FEED_SORTS:
+        return jsonify({'success': False, 'message': 'Unknown sort.'}), 400
+    cursor = request.args.get('cursor')
+    try:
+        cursor = decode_feed_cursor(cursor, sort) if cursor else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor.'}), 400
+
+    rows, next_cursor = feed_page(daily_emojis_obj.id, cursor, sort=sort)
+    liked_stories = liked_ids(StoryLike, StoryLike.story_id, (story.id for story in rows))
+    return jsonify({
+        'success': True,
+        'stories': [{
+            'id': story.id,
+            'title': story.title,
+            'content': story.content,
+            'username': story.author.username,
+            'user_id': story.user_id,
+            'timestamp': story.timestamp.strftime('%Y-%m-%d %H:%M'),
+            'likes': story.likes,
+            'comment_count': story.comment_count,
+            'liked': story.id in liked_stories,
+            'url': url_for('main.story_detail', story_id=story.id)
+        } for story in rows],
+        'next_cursor': next_cursor
+    })
+
+@main.route('/api/stories/top')
+@login_required
+def api_top_stories():
+    """The best stories across every day; today's only once you've posted"""
+    by = request.args.get('by', 'top')
+    if by not in ('top', 'hot'):
+        return jsonify({'success': False, 'message': 'Unknown ranking.'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), current_app.config['TOP_STORIES_MAX'])
+    daily_emojis_obj = get_or_create_daily_prompt()
+    hidden = None if has_posted_today(daily_emojis_obj) else daily_emojis_obj.id
+    rows = top_stories(limit, by, exclude_daily_emoji_id=hidden)
+    return jsonify({
+        'success': True,
+        'stories': [{
+            'id': story.id,
+            'title': story.title,
+            'username': story.author.username,
+            'user_id': story.user_id,
+            'prompt_date': story.daily_emoji_set.date_posted.isoformat(),
+            'likes': story.likes,
+            'score': story.hot_score if by == 'hot' else story.top_score,
+            'url': url_for('main.story_detail', story_id=story.id)
+        } for story in rows]
+    })
+
+# --- STORY THREAD ---
+def comment_json(comment, liked_comments):
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'username': comment.author.username,
+        'user_id': comment.user_id,
+        'timestamp': comment.timestamp.strftime('%Y-%m-%d %H:%M'),
+        'likes': comment.likes,
+        'liked': comment.id in liked_comments
+    }
+
+def comments_page(story_id, cursor=None, limit=None):
+    """One page of a story's comments, oldest first; returns (comments, next_cursor)"""
+    limit = limit or current_app.config.get('COMMENTS_PAGE_SIZE', 50)
+    query = Comments.query.options(joinedload(Comments.author)).filter(Comments.story_id == story_id)
+    return keyset_page(query, Comments.timestamp, Comments.id, cursor, limit, descending=False)
+
+def story_changes(story_id, since, limit=100):
+    """Comments written and like counts changed after live version `since`.
+
+    Returns None for an unknown story. When more than `limit` comments
+    changed, 'version' stops at the last one returned so the client can ask
+    again from there.
+    """
+    row = db.session.execute(select(Story.live_version, Story.likes).where(Story.id == story_id)).one_or_none()
+    if row is None:
+        return None
+    version, likes = row
+    comments = []
+    if version > since:
+        comments = (Comments.query.options(joinedload(Comments.author))
+                    .filter(Comments.story_id == story_id, Comments.live_version > since)
+                    .order_by(Comments.live_version).limit(limit + 1).all())
+        if len(comments) > limit:
+            comments = comments[:limit]
+            version = comments[-1].live_version
+    liked_comments = liked_ids(CommentLike, CommentLike.comment_id, (c.id for c in comments))
+    return {'version': version, 'likes': likes,
+            'comments': [comment_json(c, liked_comments) for c in comments]}
+
+def can_view_story(moderation_status, author_id):
+    """Approved stories are visible to everyone; pending and rejected ones only to their author"""
+    return moderation_status == MODERATION_APPROVED or author_id == current_user.id
+
+def visible_story(story_id):
+    """The story, or None if it doesn't exist or the current user may not see it"""
+    story = db.session.get(Story, story_id)
+    if story is None or not can_view_story(story.moderation_status, story.user_id):
+        return None
+    return story
+
 @main.route('/story/<int:story_id>')
 @login_required
 def story_detail(story_id):
-    story = Story.query.get_or_404(story_id)
+    story = db.session.get(Story, story_id)
+    if story is None:
+        return archived_story_detail(story_id)
+    if not can_view_story(story.moderation_status, story.user_id):
+        abort(404)
     prompt = DailyEmoji.query.get(story.daily_emoji_id)
-    comments = Comments.query.filter_by(story_id=story.id).order_by(Comments.timestamp.asc()).all()
-    liked_stories = session.get('liked_stories', [])
-    liked_comments = session.get('liked_comments', [])
+    comments, next_cursor = comments_page(story.id)
+    liked_stories = liked_ids(StoryLike, StoryLike.story_id, [story.id])
+    liked_comments = liked_ids(CommentLike, CommentLike.comment_id, (c.id for c in comments))
     return render_template('story_detail.html',
                            story=story,
                            prompt=prompt,
                            comments=comments,
+                           comment_count=story.comment_count,
+                           next_cursor=next_cursor,
                            liked_stories=liked_stories,
                            liked_comments=liked_comments)
 
+def archived_story_detail(story_id):
+    """Read-only view of a story that `flask archive` moved out of the hot tables"""
+    archived = db.session.get(ArchivedStory, story_id)
+    loaded = archived and read_archived_story(current_app.config['ARCHIVE_DIR'], archived)
+    if not loaded:
+        abort(404)
+    prompt, story, comments = loaded
+    if not can_view_story(story['moderation_status'], story['user_id']):
+        abort(404)
+    return render_template('story_archived.html', prompt=prompt, story=story, comments=comments)
+
+@main.route('/story/<int:story_id>/comments')
+@login_required
+def story_comments(story_id):
+    if visible_story(story_id) is None:
+        return jsonify({'success': False, 'message': 'Story not found.'}), 404
+    cursor = request.args.get('cursor')
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor.'}), 400
+
+    comments, next_cursor = comments_page(story_id, cursor)
+    liked_comments = liked_ids(CommentLike, CommentLike.comment_id, (c.id for c in comments))
+    return jsonify({'success': True,
+                    'comments': [comment_json(c, liked_comments) for c in comments],
+                    'next_cursor': next_cursor})
+
+@main.route('/story/<int:story_id>/updates')
+@login_required
+@long_lived
+def story_updates(story_id):
+    """Long-poll: answer as soon as the story moves past ?since=, or after LIVE_WAIT_TIMEOUT"""
+    since = request.args.get('since', 0, type=int)
+    changes = story_changes(story_id, since) if visible_story(story_id) is not None else None
+    if changes is None:
+        return jsonify({'success': False, 'message': 'Story not found.'}), 404
+    if changes['version'] > since:
+        return jsonify(changes)
+    if not story_watcher.acquire():
+        # this worker is holding as many waiting requests as it allows
+        return jsonify(dict(changes, retry_after=current_app.config['LIVE_POLL_INTERVAL'] * 5))
+    try:
+        # nothing to read while we wait; give the connection back to the pool
+        db.session.close()
+        changed = story_watcher.wait(story_id, since, current_app.config['LIVE_WAIT_TIMEOUT'])
+    finally:
+        story_watcher.release()
+    return jsonify(story_changes(story_id, since) if changed else changes)
+
+@main.route('/story/<int:story_id>/events')
+@login_required
+@long_lived
+def story_events(story_id):
+    """Server-Sent Events: one event per batch of changes, id = the story's live version"""
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+    if visible_story(story_id) is None:
+        abort(404)
+    config = current_app.config
+    has_slot = story_watcher.acquire()
+
+    def stream(since):
+        try:
+            deadline = time.monotonic() + config['LIVE_STREAM_DURATION']
+            while True:
+                changes = story_changes(story_id, since)
+                db.session.close()
+                if changes['version'] > since:
+                    since = changes['version']
+                    yield f"id: {since}\ndata: {json.dumps(changes)}\n\n"
+                    continue
+                remaining = deadline - time.monotonic()
+                if not has_slot or remaining <= 0:
+                    break
+                if not story_watcher.wait(story_id, since, min(config['LIVE_WAIT_TIMEOUT'], remaining)):
+                    yield ': keep-alive\n\n'
+            # the browser reconnects (with Last-Event-ID) after this many ms
+            retry = 1000 if has_slot else int(config['LIVE_POLL_INTERVAL'] * 5000)
+            yield f'retry: {retry}\n\n'
+        finally:
+            if has_slot:
+                story_watcher.release()
+
+    return Response(stream_with_context(stream(since)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @main.route('/story/<int:story_id>/comment', methods=['POST'])
 @login_required
 def add_comment(story_id):
     content = request.form.get('content')
     if not content or len(content.strip()) < 1:
         return jsonify({'success': False, 'message': 'Comment cannot be empty.'}), 400
-    
-    new_comment = Comments(content=content, story_id=story_id, user_id=current_user.id)
+
+    if visible_story(story_id) is None:
+        return jsonify({'success': False, 'message': 'Story not found.'}), 404
+    version = bump_live_version(story_id)
+    if version is None:
+        return jsonify({'success': False, 'message': 'Story not found.'}), 404
+    bump_scores(story_id, comments=1)
+    count_comment(story_id, current_user.id)
+    new_comment = Comments(content=content, story_id=story_id, user_id=current_user.id, live_version=version)
     db.session.add(new_comment)
     db.session.commit()
+    story_watcher.notify(story_id, version)
+    feed_fragment_cache.invalidate_story(story_id)
     
     return jsonify({
         'success': True,
@@ -225,48 +564,43 @@ def add_comment(story_id):
 @login_required
 def like_comment(comment_id):
     comment = Comments.query.get_or_404(comment_id)
-    liked_list = session.get('liked_comments', [])
-    if comment_id in liked_list:
-        comment.likes = max(0, comment.likes - 1)
-        liked_list.remove(comment_id)
-        liked = False
-    else:
-        comment.likes += 1
-        liked_list.append(comment_id)
-        liked = True
-    session['liked_comments'] = liked_list
+    if visible_story(comment.story_id) is None:
+        abort(404)
+    likes, liked = toggle_like(CommentLike, CommentLike.comment_id, Comments, comment_id)
+    comment.live_version = bump_live_version(comment.story_id)
     db.session.commit()
-    return jsonify({'likes': comment.likes, 'liked': liked})
+    story_watcher.notify(comment.story_id, comment.live_version)
+    return jsonify({'likes': likes, 'liked': liked})
 
 @main.route('/comment/<int:comment_id>/edit', methods=['POST'])
 @login_required
 def edit_comment(comment_id):
     comment = Comments.query.get_or_404(comment_id)
+    if visible_story(comment.story_id) is None:
+        abort(404)
     if comment.user_id != current_user.id:
         return jsonify({'success': False, 'message': 'Not authorized.'}), 403
     new_content = request.json.get('content', '').strip()
     if not new_content:
         return jsonify({'success': False, 'message': 'Comment cannot be empty.'}), 400
     comment.content = new_content
+    comment.live_version = bump_live_version(comment.story_id)
     db.session.commit()
+    story_watcher.notify(comment.story_id, comment.live_version)
     return jsonify({'success': True, 'content': comment.content})
 
 @main.route('/stories/<int:story_id>/like', methods=['POST'])
 @login_required
 def like_story(story_id):
-    story = Story.query.get_or_404(story_id)
-    liked_list = session.get('liked_stories', [])
-    if story_id in liked_list:
-        story.likes = max(0, story.likes - 1)
-        liked_list.remove(story_id)
-        liked = False
-    else:
-        story.likes += 1
-        liked_list.append(story_id)
-        liked = True
-    session['liked_stories'] = liked_list
+    if visible_story(story_id) is None:
+        abort(404)
+    likes, liked = toggle_like(StoryLike, StoryLike.story_id, Story, story_id,
+                               on_change=lambda delta: bump_scores(story_id, likes=delta))
+    version = bump_live_version(story_id)
     db.session.commit()
-    return jsonify({'likes': story.likes, 'liked': liked})
+    story_watcher.notify(story_id, version)
+    feed_fragment_cache.invalidate_story(story_id)
+    return jsonify({'likes': likes, 'liked': liked})
 
 @main.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -274,32 +608,190 @@ def profile():
     if request.method == 'POST':
         file = request.files.get('profile_pic')
         if file and file.filename != '':
-            filename = secure_filename(file.filename)
-            unique_filename = f"user_{current_user.id}_{filename}"
-            upload_path = os.path.join('app', 'static', 'profile_pics')
-            os.makedirs(upload_path, exist_ok=True)
-            file.save(os.path.join(upload_path, unique_filename))
-            current_user.profile_pic = f'profile_pics/{unique_filename}'
-            db.session.commit()
-            flash('Your profile picture has been updated!', 'success')
+            if not uploads_available():
+                flash('Profile picture uploads are not available right now.', 'warning')
+                return redirect(url_for('main.profile'))
+            try:
+                upload = read_upload(file, current_app.config['PROFILE_PIC_MAX_BYTES'],
+                                     current_app.config['PROFILE_PIC_MAX_PIXELS'])
+            except UploadRejected as e:
+                flash(str(e), 'warning')
+                return redirect(url_for('main.profile'))
+            if current_user.profile_pic_error:
+                db.session.get(User, current_user.id).profile_pic_error = None
+                db.session.commit()
+            submit_profile_pic(current_app._get_current_object(), current_user.id, upload)
+            flash('Your new profile picture is being processed and will appear shortly.', 'success')
         return redirect(url_for('main.profile'))
 
-    user_posts = Story.query.filter_by(author=current_user).order_by(Story.timestamp.desc()).all()
-    user_comments = db.session.query(Comments, Story.title.label('story_title')).join(Story, Comments.story_id == Story.id).filter(Comments.user_id == current_user.id).order_by(Comments.timestamp.desc()).all()
-    
-    liked_ids = session.get('liked_stories', [])
-    user_likes = Story.query.filter(Story.id.in_(liked_ids)).all() if liked_ids else []
+    return render_template('user.html', counts=profile_counts(current_user.id))
+
+def profile_counts(user_id):
+    """Posts, comments and likes for the profile header, in one round trip"""
+    likes = select(func.count()).select_from(StoryLike).where(StoryLike.user_id == user_id).scalar_subquery()
+    posts, comments, likes = db.session.execute(
+        select(User.story_count, User.comment_count, likes).where(User.id == user_id)).one()
+    return {'posts': posts, 'comments': comments, 'likes': likes}
+
+def profile_section(section, user_id, cursor=None, limit=None):
+    """One page of a profile tab, newest first; returns (items, next_cursor)"""
+    limit = limit or current_app.config.get('PROFILE_PAGE_SIZE', 20)
+    if section == 'posts':
+        query = Story.query.filter(Story.user_id == user_id)
+        rows, next_cursor = keyset_page(query, Story.timestamp, Story.id, cursor, limit)
+        items = [{
+            'id': story.id,
+            'title': story.title,
+            'content': story.content,
+            'moderation_status': story.moderation_status,
+            'timestamp': story.timestamp.strftime('%Y-%m-%d'),
+            'url': url_for('main.story_detail', story_id=story.id)
+        } for story in rows]
+    elif section == 'comments':
+        query = (db.session.query(Comments, Story.title)
+                 .join(Story, Comments.story_id == Story.id)
+                 .filter(Comments.user_id == user_id))
+        rows, next_cursor = keyset_page(query, Comments.timestamp, Comments.id, cursor, limit,
+                                        position=lambda row: (row[0].timestamp, row[0].id))
+        items = [{
+            'id': comment.id,
+            'content': comment.content,
+            'story_title': story_title,
+            'timestamp': comment.timestamp.strftime('%Y-%m-%d %H:%M'),
+            'url': url_for('main.story_detail', story_id=comment.story_id) + f'#comment-{comment.id}'
+        } for comment, story_title in rows]
+    elif section == 'likes':
+        query = (db.session.query(Story.id, Story.title, User.username, StoryLike.timestamp, StoryLike.id.label('like_id'))
+                 .join(StoryLike, StoryLike.story_id == Story.id)
+                 .join(User, User.id == Story.user_id)
+                 .filter(StoryLike.user_id == user_id))
+        rows, next_cursor = keyset_page(query, StoryLike.timestamp, StoryLike.id, cursor, limit,
+                                        position=lambda row: (row.timestamp, row.like_id))
+        items = [{
+            'id': row.id,
+            'title': row.title,
+            'username': row.username,
+            'timestamp': row.timestamp.strftime('%Y-%m-%d'),
+            'url': url_for('main.story_detail', story_id=row.id)
+        } for row in rows]
+    else:
+        return None, None
+    return items, next_cursor
 
-    return render_template('user.html',
-                           user_posts=user_posts,
-                           user_comments=user_comments,
-                           user_likes=user_likes)
+@main.route('/api/profile/<section>')
+@login_required
+def api_profile_section(section):
+    cursor = request.args.get('cursor')
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor.'}), 400
+
+    items, next_cursor = profile_section(section, current_user.id, cursor)
+    if items is None:
+        return jsonify({'success': False, 'message': 'Unknown section.'}), 404
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+@main.app_template_global()
+def avatar_url(user, variant='avatar'):
+    """URL of a user's profile picture; variant is 'avatar' or 'thumb'"""
+    path = (user.profile_thumb if variant == 'thumb' else None) or user.profile_pic
+    if not path:
+        return url_for('static', filename='images/default_pfp.png')
+    return url_for('main.profile_pic', filename=path.split('/', 1)[-1])
+
+@main.route('/profile_pics/<path:filename>')
+def profile_pic(filename):
+    if not HASHED_NAME.match(filename):
+        return send_from_directory(current_app.config['PROFILE_PICS_DIR'], filename)
+    # content-addressed: a new picture always gets a new URL
+    response = send_from_directory(current_app.config['PROFILE_PICS_DIR'], filename, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @main.route('/streak')
 @login_required
 def streak():
     return render_template('streak.html', current_streak=current_user.current_streak)
 
+@main.route('/leaderboard')
+def leaderboard():
+    by = request.args.get('by', 'current')
+    column = User.longest_streak if by == 'longest' else User.current_streak
+    limit = current_app.config.get('LEADERBOARD_SIZE', 20)
+    leaders = (db.session.query(User.id, User.username, User.current_streak, User.longest_streak)
+               .filter(column > 0)
+               .order_by(column.desc(), User.id)
+               .limit(limit).all())
+    return render_template('leaderboard.html', leaders=leaders, by='longest' if by == 'longest' else 'current')
+
+# --- EXPORT ---
+def export_response(prompts, filename, user_id=None, approved_only=True):
+    """Stream `prompts` as a gzip JSON Lines download; 503 rather than a partial file if an archive is missing"""
+    archive_dir = current_app.config['ARCHIVE_DIR']
+    missing = missing_archives(prompts, archive_dir)
+    if missing:
+        current_app.logger.error('Export refused; archive files missing for %s',
+                                 ', '.join(day.isoformat() for day in missing))
+        abort(503)
+    records = export_records(prompts, user_id=user_id, approved_only=approved_only, archive_dir=archive_dir)
+    return Response(stream_with_context(gzip_jsonl(records)), mimetype='application/gzip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@main.route('/export/me')
+@login_required
+def export_me():
+    """Everything the current user wrote, as gzipped JSON Lines, including stories still pending or rejected"""
+    user_id = current_user.id
+    return export_response(export_prompts(user_id=user_id), f'glyphy-{current_user.username}.jsonl.gz',
+                           user_id=user_id, approved_only=False)
+
+@main.route('/export/day/<day>')
+@login_required
+def export_day(day):
+    """One prompt day's approved stories and their comments"""
+    try:
+        day = date.fromisoformat(day)
+    except ValueError:
+        abort(404)
+    prompt = DailyEmoji.query.filter_by(date_posted=day).first_or_404()
+    daily_emojis_obj = get_or_create_daily_prompt()
+    if prompt.id == daily_emojis_obj.id and not has_posted_today(daily_emojis_obj):
+        abort(403)
+    return export_response([prompt], f'glyphy-{day.isoformat()}.jsonl.gz')
+
+@main.route('/search')
+@login_required
+def search_view():
+    query = request.args.get('q', '').strip()
+    author = request.args.get('author', '').strip()
+    day = request.args.get('date', '').strip()
+    page = min(max(request.args.get('page', 1, type=int), 1), 50)
+    hits, has_more, problem = [], False, None
+
+    if not search_available():
+        problem = 'Search is not available right now.'
+    elif query:
+        filters = {}
+        daily_emojis_obj = get_or_create_daily_prompt()
+        # today's stories stay hidden until you've posted, as on /stories
+        if not has_posted_today(daily_emojis_obj):
+            filters['exclude_daily_emoji_id'] = daily_emojis_obj.id
+        if day:
+            try:
+                filters['daily_emoji_id'] = db.session.scalar(
+                    select(DailyEmoji.id).where(DailyEmoji.date_posted == date.fromisoformat(day))) or -1
+            except ValueError:
+                problem = 'Dates look like 2024-01-31.'
+        if author:
+            filters['author_id'] = db.session.scalar(select(User.id).where(User.username == author)) or -1
+        if problem is None:
+            hits, has_more = search(query, page, current_app.config.get('SEARCH_PAGE_SIZE', 20), **filters)
+
+    return render_template('search.html', query=query, author=author, date=day, page=page,
+                           hits=hits, has_more=has_more, problem=problem, highlight=highlight)
+
 @main.route('/home')
 def home():
     return redirect(url_for('main.index'))
@@ -324,8 +816,14 @@ def edit_story(story_id):
     if not new_content or len(new_content) < 10:
         return jsonify({'success': False, 'message': 'Story must be at least 10 characters long.'}), 400
 
-    story.title = new_title
-    story.content = new_content
+    if (new_title, new_content) != (story.title, story.content):
+        story.title = new_title
+        story.content = new_content
+        # edited text goes back through moderation before it reappears in the feed
+        moderation_queue.submit_for_review(story)
     db.session.commit()
+    moderation_queue.notify()
+    feed_fragment_cache.invalidate_story(story_id)
     
-    return jsonify({'success': True, 'title': story.title, 'content': story.content})
\ No newline at end of file
+    return jsonify({'success': True, 'title': story.title, 'content': story.content,
+                    'moderation_status': story.moderation_status})
\ No newline at end of file
@@ -0,0 +1,197 @@
+from collections import defaultdict
+import bisect
+import hmac
+import threading
+import time
+
+from flask import Response, abort, current_app, request
+from sqlalchemy import event
+
+# Seconds; also used for moderation latency
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233, 500, 1000)
+
+MAX_SLOW_STATEMENTS = 50
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._series = defaultdict(lambda: [0] * (len(buckets) + 2))
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series[labels]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(items):
+            base = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            sep = ',' if base else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{base}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{base}}} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_latency = Histogram('glyphy_request_duration_seconds', 'Request latency by endpoint.',
+                            ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+request_queries = Histogram('glyphy_request_sql_queries', 'SQL statements issued per request.',
+                            ('endpoint',), COUNT_BUCKETS)
+request_rows = Histogram('glyphy_request_rows_loaded', 'ORM rows loaded per request.',
+                         ('endpoint',), COUNT_BUCKETS)
+moderation_latency = Histogram('glyphy_moderation_duration_seconds', 'Remote moderation call latency by outcome.',
+                               ('backend', 'outcome'), LATENCY_BUCKETS)
+
+HISTOGRAMS = (request_latency, request_queries, request_rows, moderation_latency)
+
+_state = threading.local()
+
+
+def observe_moderation(backend, *args, **kwargs):
+    """Call backend.classify, recording latency and outcome (approved/rejected/error)"""
+    start = time.perf_counter()
+    try:
+        approved = backend.classify(*args, **kwargs)
+    except Exception:
+        moderation_latency.observe((backend.name, 'error'), time.perf_counter() - start)
+        raise
+    moderation_latency.observe((backend.name, 'approved' if approved else 'rejected'), time.perf_counter() - start)
+    return approved
+
+
+def long_lived(view):
+    """Mark a view that holds its request open on purpose (long-poll, SSE); it skips the slow-request log"""
+    view.long_lived = True
+    return view
+
+
+# --- HOOKS ---
+def _before_request():
+    _state.active = True
+    _state.start = time.perf_counter()
+    _state.queries = 0
+    _state.rows = 0
+    _state.statements = []
+
+
+def _after_request(response):
+    if not getattr(_state, 'active', False):
+        return response
+    _state.active = False
+    elapsed = time.perf_counter() - _state.start
+    endpoint = request.endpoint or 'unmatched'
+    request_latency.observe((endpoint, request.method, str(response.status_code)), elapsed)
+    request_queries.observe((endpoint,), _state.queries)
+    request_rows.observe((endpoint,), _state.rows)
+
+    threshold = current_app.config.get('SLOW_REQUEST_THRESHOLD')
+    view = current_app.view_functions.get(request.endpoint)
+    if threshold and elapsed >= threshold and not getattr(view, 'long_lived', False):
+        statements = '\n'.join(f'  {duration * 1000:.1f}ms  {statement}'
+                               for statement, duration in _state.statements)
+        current_app.logger.warning(
+            'Slow request: %s %s -> %s in %.1fms with %d queries\n%s',
+            request.method, request.full_path, response.status_code, elapsed * 1000,
+            _state.queries, statements)
+    _state.statements = []
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_state, 'active', False):
+        _state.queries += 1
+        _state.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_state, 'active', False) and len(_state.statements) < MAX_SLOW_STATEMENTS:
+        _state.statements.append((' '.join(statement.split()), time.perf_counter() - _state.query_start))
+
+
+def _on_load(target, context):
+    if getattr(_state, 'active', False):
+        _state.rows += 1
+
+
+# --- EXPOSITION ---
+def _cache_lines():
+    from .cache import daily_prompt_cache, feed_fragment_cache, user_cache
+    from .moderation import moderation_queue
+    from .security import login_ip_limiter, login_username_limiter
+    lines = ['# TYPE glyphy_cache_events_total counter']
+    for cache_name, stats in (('daily_prompt', daily_prompt_cache.stats()),
+                              ('feed_fragment', feed_fragment_cache.stats()),
+                              ('user', user_cache.stats())):
+        for event_name in ('hits', 'misses', 'evictions'):
+            if event_name in stats:
+                lines.append(f'glyphy_cache_events_total{{cache="{cache_name}",event="{event_name}"}} {stats[event_name]}')
+    lines.append('# TYPE glyphy_login_throttled_total counter')
+    for bucket, limiter in (('ip', login_ip_limiter), ('username', login_username_limiter)):
+        lines.append(f'glyphy_login_throttled_total{{bucket="{bucket}"}} {limiter.rejected}')
+    backend = moderation_queue.backend
+    if backend is not None and hasattr(backend, 'stats'):
+        stats = backend.stats()
+        lines.append('# TYPE glyphy_moderation_tier_total counter')
+        for tier, count in stats['counts'].items():
+            if tier == 'total':
+                continue
+            lines.append(f'glyphy_moderation_tier_total{{tier="{tier}"}} {count}')
+        lines.append('# TYPE glyphy_moderation_breaker_open gauge')
+        lines.append(f'glyphy_moderation_breaker_open {0 if stats["breaker"]["state"] == "closed" else 1}')
+    return lines
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(_cache_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        if not current_app.config.get('METRICS_PUBLIC', False):
+            abort(404)
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app, db):
+    """Install request/SQL hooks and the /metrics endpoint"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    if not event.contains(db.Model, 'load', _on_load):
+        event.listen(db.Model, 'load', _on_load, propagate=True)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,151 @@
+import re
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from .extensions import db
+
+# Columns added to existing tables after their first release, as
+# (table, column, DDL). db.create_all() never alters an existing table, so
+# these are applied by hand to older databases.
+ADDED_COLUMNS = [
+    ('story', 'moderation_status', "VARCHAR(16) NOT NULL DEFAULT 'approved'"),
+    ('user', 'profile_thumb', "VARCHAR(200)"),
+    ('user', 'longest_streak', "INTEGER NOT NULL DEFAULT 0"),
+    ('story', 'live_version', "INTEGER NOT NULL DEFAULT 0"),
+    ('comments', 'live_version', "INTEGER NOT NULL DEFAULT 0"),
+    ('story', 'hot_score', "FLOAT NOT NULL DEFAULT 0"),
+    ('story', 'top_score', "INTEGER NOT NULL DEFAULT 0"),
+    ('story', 'comment_count', "INTEGER NOT NULL DEFAULT 0"),
+    ('moderation_job', 'revision', "INTEGER NOT NULL DEFAULT 0"),
+    ('user', 'story_count', "INTEGER NOT NULL DEFAULT 0"),
+    ('user', 'comment_count', "INTEGER NOT NULL DEFAULT 0"),
+    ('user', 'profile_pic_error', "VARCHAR(200)"),
+]
+
+# Indexes added to existing tables after their first release, as
+# (name, table, columns, unique); created after ADDED_COLUMNS are in place.
+ADDED_INDEXES = [
+    ('ix_story_moderation_status', 'story', 'moderation_status', False),
+    ('ix_user_current_streak', 'user', 'current_streak', False),
+    ('ix_user_longest_streak', 'user', 'longest_streak', False),
+    ('ix_story_daily_emoji_timestamp', 'story', 'daily_emoji_id, timestamp, id', False),
+    ('ix_story_user_timestamp', 'story', 'user_id, timestamp', False),
+    ('ix_comments_story_timestamp', 'comments', 'story_id, timestamp', False),
+    ('ix_comments_user_timestamp', 'comments', 'user_id, timestamp', False),
+    ('ix_story_like_user_timestamp', 'story_like', 'user_id, timestamp', False),
+    ('ix_comments_story_live_version', 'comments', 'story_id, live_version', False),
+    ('ix_story_daily_emoji_hot', 'story', 'daily_emoji_id, hot_score, id', False),
+    ('ix_story_daily_emoji_top', 'story', 'daily_emoji_id, top_score, id', False),
+    ('ix_story_hot', 'story', 'hot_score, id', False),
+    ('ix_story_top', 'story', 'top_score, id', False),
+    ('uq_story_user_daily_emoji', 'story', 'user_id, daily_emoji_id', True),
+]
+
+# Tables created without AUTOINCREMENT before their rows could be archived, as
+# (table, archive table holding the ids of rows moved out of it). Plain SQLite
+# rowids restart at max(id) + 1, which would hand an archived id to a new row.
+AUTOINCREMENT_TABLES = [
+    ('story', 'archived_story'),
+    ('comments', 'archived_comment'),
+]
+
+
+def reserve_archived_ids(conn):
+    """Move each AUTOINCREMENT_TABLES sequence past every id its archive table remembers"""
+    for table, archive_table in AUTOINCREMENT_TABLES:
+        floor = conn.execute(text(
+            f'SELECT MAX(COALESCE((SELECT MAX(id) FROM "{table}"), 0), '
+            f'COALESCE((SELECT MAX(id) FROM "{archive_table}"), 0))'
+        )).scalar()
+        if not conn.execute(text('UPDATE sqlite_sequence SET seq = MAX(seq, :floor) WHERE name = :table'),
+                            {'floor': floor, 'table': table}).rowcount:
+            conn.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :floor)'),
+                         {'floor': floor, 'table': table})
+
+
+def _rebuild_with_autoincrement(table):
+    """Recreate `table` from its model with AUTOINCREMENT, keeping rows, ids and indexes.
+
+    SQLite can't add AUTOINCREMENT in place; this is its documented
+    create-copy-drop-rename sequence. Triggers on the table are dropped with
+    it; install_search_index() puts the search triggers back.
+    """
+    model_table = db.metadata.tables[table]
+    new_name = f'_{table}_autoincrement'
+    columns = ', '.join(f'"{c.name}"' for c in model_table.columns)
+    ddl = re.sub(rf'CREATE TABLE "?{table}"? ', f'CREATE TABLE {new_name} ',
+                 str(CreateTable(model_table).compile(db.engine)), count=1)
+    # explicit BEGIN/COMMIT: the driver would otherwise run the DDL outside the transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        foreign_keys = conn.exec_driver_sql('PRAGMA foreign_keys').scalar()
+        # only takes effect outside a transaction; ids are copied unchanged, so references stay valid
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        try:
+            conn.exec_driver_sql('BEGIN')
+            try:
+                indexes = conn.execute(text(
+                    "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"
+                ), {'table': table}).scalars().all()
+                conn.exec_driver_sql(ddl)
+                conn.exec_driver_sql(f'INSERT INTO {new_name} ({columns}) SELECT {columns} FROM "{table}"')
+                conn.exec_driver_sql(f'DROP TABLE "{table}"')
+                conn.exec_driver_sql(f'ALTER TABLE {new_name} RENAME TO "{table}"')
+                for sql in indexes:
+                    conn.exec_driver_sql(sql)
+                conn.exec_driver_sql('COMMIT')
+            except Exception:
+                conn.exec_driver_sql('ROLLBACK')
+                raise
+        finally:
+            conn.exec_driver_sql(f'PRAGMA foreign_keys={"ON" if foreign_keys else "OFF"}')
+
+
+def upgrade_schema():
+    """Bring an existing database up to the current models; safe to run repeatedly.
+
+    Returns a list of problems that kept a step from being applied.
+    """
+    problems = []
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+        for name, table, columns, unique in ADDED_INDEXES:
+            if table not in tables:
+                continue
+            if name == 'uq_story_user_daily_emoji':
+                duplicates = conn.execute(text(
+                    'SELECT COUNT(*) FROM (SELECT 1 FROM story GROUP BY user_id, daily_emoji_id HAVING COUNT(*) > 1)'
+                )).scalar()
+                if duplicates:
+                    problems.append(f'{name} skipped: {duplicates} user/prompt pair(s) have more than one story')
+                    continue
+            kind = 'UNIQUE INDEX' if unique else 'INDEX'
+            conn.execute(text(f'CREATE {kind} IF NOT EXISTS {name} ON "{table}" ({columns})'))
+    for table, _ in AUTOINCREMENT_TABLES:
+        if table not in tables:
+            continue
+        with db.engine.connect() as conn:
+            sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                               {'name': table}).scalar()
+        if 'AUTOINCREMENT' not in sql.upper():
+            try:
+                _rebuild_with_autoincrement(table)
+            except Exception as e:
+                problems.append(f'{table} not rebuilt with AUTOINCREMENT: {e}')
+    if {table for pair in AUTOINCREMENT_TABLES for table in pair} <= tables:
+        with db.engine.begin() as conn:
+            reserve_archived_ids(conn)
+    return problems
+
+
+def init_db():
+    """Create missing tables, apply upgrade_schema() and install the search index; returns their problems"""
+    from .search import install_search_index
+    db.create_all()
+    return upgrade_schema() + install_search_index()
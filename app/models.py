@@ -1,25 +1,39 @@
 from .extensions import db
 from datetime import datetime, date, timedelta
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+from .security import password_hasher
+
+# Story.moderation_status values
+MODERATION_PENDING = 'pending'
+MODERATION_APPROVED = 'approved'
+MODERATION_REJECTED = 'rejected'
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(162))
-    current_streak = db.Column(db.Integer, default=0)
+    current_streak = db.Column(db.Integer, default=0, index=True)
+    longest_streak = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
     last_story_date = db.Column(db.Date)
     profile_pic = db.Column(db.String(200), nullable=True)
+    profile_thumb = db.Column(db.String(200), nullable=True)
+    # why the last upload couldn't be turned into a picture; cleared by the next upload
+    profile_pic_error = db.Column(db.String(200), nullable=True)
+    # maintained by app.counters alongside every story/comment write
+    story_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     stories = db.relationship('Story', backref='author', lazy='dynamic')
     comments = db.relationship('Comments', backref='author', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
     def can_post_today(self):
         """Check if user can post a story today"""
@@ -41,6 +55,71 @@ class User(UserMixin, db.Model):
             self.current_streak = 1
 
         self.last_story_date = story_date
+        self.longest_streak = max(self.longest_streak or 0, self.current_streak)
+
+    @staticmethod
+    def reset_broken_streaks(today):
+        """Zero every streak whose owner didn't post yesterday or today, in one UPDATE.
+
+        Also backfills longest_streak. Returns the number of streaks reset.
+        """
+        yesterday = today - timedelta(days=1)
+        db.session.execute(
+            db.update(User)
+            .where(User.current_streak > User.longest_streak)
+            .values(longest_streak=User.current_streak)
+        )
+        reset = db.session.execute(
+            db.update(User)
+            .where(User.current_streak > 0,
+                   db.or_(User.last_story_date.is_(None), User.last_story_date < yesterday))
+            .values(current_streak=0)
+        ).rowcount
+        db.session.commit()
+        # bulk UPDATEs bypass the ORM events that keep cached user snapshots fresh
+        from .cache import user_cache
+        user_cache.clear()
+        return reset
+
+    @staticmethod
+    def reset_streaks_once(today):
+        """reset_broken_streaks(today), unless it has already run for `today`.
+
+        The StreakState row is claimed with a conditional UPDATE in the same
+        transaction as the reset, so one caller per day does the work and a
+        caller that dies mid-way leaves the day unclaimed for the next.
+        Returns the number of streaks reset, or None if already done.
+        """
+        state = db.session.get(StreakState, 1)
+        try:
+            if state is None:
+                db.session.add(StreakState(id=1, reset_for=today))
+                db.session.flush()
+            elif not db.session.execute(
+                db.update(StreakState)
+                .where(StreakState.id == 1, StreakState.reset_for < today)
+                .values(reset_for=today)
+            ).rowcount:
+                db.session.rollback()
+                return None
+        except IntegrityError:
+            # another caller inserted the row first
+            db.session.rollback()
+            return None
+        return User.reset_broken_streaks(today)
+
+class UserSnapshot(UserMixin):
+    """Read-only copy of a User row, cached by the login user loader.
+
+    Enough to render any page; request handlers that write to the user load the
+    ORM row with db.session.get(User, current_user.id).
+    """
+    __slots__ = ('id', 'username', 'email', 'current_streak', 'longest_streak',
+                 'last_story_date', 'profile_pic', 'profile_thumb', 'profile_pic_error')
+
+    def __init__(self, user):
+        for name in self.__slots__:
+            setattr(self, name, getattr(user, name))
 
 class DailyEmoji(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -54,17 +133,138 @@ class Story(db.Model):
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     likes = db.Column(db.Integer, nullable=False, default=0)
+    # rows that predate moderation are treated as approved
+    moderation_status = db.Column(db.String(16), nullable=False, default=MODERATION_PENDING,
+                                  server_default=MODERATION_APPROVED, index=True)
+    # bumped by every comment/like write; see app.live
+    live_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # feed ranking, kept up to date by every like/comment write; see app.ranking.
+    # A new story starts with ranking.NEW_STORY_HEAT.
+    hot_score = db.Column(db.Float, nullable=False, default=1.0, server_default='0')
+    top_score = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # maintained by app.counters; saves a COUNT per story in list views
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     daily_emoji_id = db.Column(db.Integer, db.ForeignKey('daily_emoji.id'))
 
     comments = db.relationship('Comments', backref='story', lazy='dynamic', cascade="all, delete-orphan")
+    liked_by = db.relationship('StoryLike', backref='story', lazy='dynamic', cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # serves the keyset-paginated daily feed
+        db.Index('ix_story_daily_emoji_timestamp', 'daily_emoji_id', 'timestamp', 'id'),
+        # one story per user per prompt; also the "has this user posted today?" lookup
+        db.Index('uq_story_user_daily_emoji', 'user_id', 'daily_emoji_id', unique=True),
+        db.Index('ix_story_user_timestamp', 'user_id', 'timestamp'),
+        # ?sort=hot|top within a day, and the cross-day top-k lists
+        db.Index('ix_story_daily_emoji_hot', 'daily_emoji_id', 'hot_score', 'id'),
+        db.Index('ix_story_daily_emoji_top', 'daily_emoji_id', 'top_score', 'id'),
+        db.Index('ix_story_hot', 'hot_score', 'id'),
+        db.Index('ix_story_top', 'top_score', 'id'),
+        # archived stories keep their ids (ArchivedStory), so an id is never handed out twice
+        {'sqlite_autoincrement': True},
+    )
+
+class StreakState(db.Model):
+    """Single row recording the last day broken streaks were reset for"""
+    id = db.Column(db.Integer, primary_key=True)
+    reset_for = db.Column(db.Date, nullable=False)
+
+class RankingState(db.Model):
+    """Single row recording when hot scores were last decayed"""
+    id = db.Column(db.Integer, primary_key=True)
+    decayed_at = db.Column(db.DateTime, nullable=False)
+
+class ModerationJob(db.Model):
+    """Persistent moderation queue; one row per story awaiting a verdict"""
+    id = db.Column(db.Integer, primary_key=True)
+    story_id = db.Column(db.Integer, db.ForeignKey('story.id'), unique=True, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # NULL once the job has exhausted its retries
+    next_attempt_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    # bumped whenever an edit re-arms the job; a verdict only applies to the revision it read
+    revision = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_error = db.Column(db.String(500))
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
+    story = db.relationship('Story', backref=db.backref('moderation_job', uselist=False, cascade="all, delete-orphan"))
+
+class ArchivedStory(db.Model):
+    """Where a story moved by `flask archive` lives now: its day's archive file"""
+    # the story's original id, so /story/<id> links keep resolving
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    daily_emoji_id = db.Column(db.Integer, db.ForeignKey('daily_emoji.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    archived = db.Column(db.DateTime, default=datetime.utcnow)
+
+    daily_emoji = db.relationship('DailyEmoji')
+
+class ArchivedComment(db.Model):
+    """Who wrote a comment moved by `flask archive`, so personal exports find its day"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    story_id = db.Column(db.Integer, nullable=False)
+    daily_emoji_id = db.Column(db.Integer, db.ForeignKey('daily_emoji.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
 
 class Comments(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(500), nullable=False)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     likes = db.Column(db.Integer, nullable=False, default=0)
+    # the story's live_version at this comment's last write
+    live_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    liked_by = db.relationship('CommentLike', backref='comment', lazy='dynamic', cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index('ix_comments_story_timestamp', 'story_id', 'timestamp'),
+        db.Index('ix_comments_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_comments_story_live_version', 'story_id', 'live_version'),
+        # archived comments keep their ids (ArchivedComment)
+        {'sqlite_autoincrement': True},
+    )
+
+class StoryLike(db.Model):
+    """One row per (user, story) like; the unique constraint makes toggles idempotent"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=False, index=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'story_id', name='uq_story_like_user_story'),
+        # a user's likes, newest first (profile page)
+        db.Index('ix_story_like_user_timestamp', 'user_id', 'timestamp'),
+    )
+
+class CommentLike(db.Model):
+    """One row per (user, comment) like"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    comment_id = db.Column(db.Integer, db.ForeignKey('comments.id'), nullable=False, index=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'comment_id', name='uq_comment_like_user_comment'),)
+
+
+@db.event.listens_for(User, 'after_update')
+def _collect_updated_user(mapper, connection, target):
+    """Streak, profile picture and password writes all flush through here"""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('updated_user_ids', set()).add(target.id)
+
+@db.event.listens_for(Session, 'after_commit')
+def _invalidate_cached_users(session):
+    # evicting at flush time, before the commit, would let a concurrent request
+    # cache the old row again for the whole TTL
+    user_ids = session.info.pop('updated_user_ids', None)
+    if user_ids:
+        from .cache import user_cache
+        for user_id in user_ids:
+            user_cache.invalidate(user_id)
@@ -0,0 +1,545 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import hashlib
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import delete, select, update, func
+from .extensions import db
+from .models import ModerationJob, Story, MODERATION_PENDING, MODERATION_APPROVED, MODERATION_REJECTED
+from .cache import feed_fragment_cache
+from .metrics import observe_moderation
+
+
+# --- BACKENDS ---
+# A backend exposes classify(emojis, content, timeout, on_topic) -> True (approve) / False (reject)
+# and raises on failure so the job is retried. With on_topic=True the story is already
+# known to fit the prompt, and only its content needs checking.
+
+class GeminiModerationBackend:
+    name = 'gemini'
+
+    PROMPT = """
+            Analyze the user's story for relevance to the given emojis and for any harmful content.
+            The story should be creatively related to the emojis, but be lenient to encourage imagination.
+            Reject only if there is absolutely no possible connection or if it contains explicit content, hate speech, or severe toxicity.
+            Respond with ONLY one of the following decisions: "Yes", "No, explicit", or "No, off-topic".
+            EMOJIS: {emojis}
+            USER STORY: \"{content}\"
+            """
+
+    SAFETY_PROMPT = """
+            Analyze the user's story for harmful content.
+            Reject only if it contains explicit content, hate speech, or severe toxicity.
+            Respond with ONLY one of the following decisions: "Yes" or "No, explicit".
+            USER STORY: \"{content}\"
+            """
+
+    def __init__(self, api_key, model_name='gemini-2.5-flash'):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        # the SDK import and client setup are deferred to the first moderation call
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+                    print("SUCCESS: Gemini API client initialized.")
+        return self._model
+
+    def classify(self, emojis, content, timeout=None, on_topic=False):
+        template = self.SAFETY_PROMPT if on_topic else self.PROMPT
+        prompt = template.format(emojis=emojis, content=content)
+        request_options = {'timeout': timeout} if timeout else None
+        response = self.model.generate_content(prompt, request_options=request_options)
+        return "No" not in response.text.strip()
+
+
+class StubModerationBackend:
+    """Local stand-in for Gemini used by tests and benchmarks"""
+    name = 'stub'
+
+    def __init__(self, reject_words=('explicit', 'off-topic'), latency=0.0):
+        self.reject_words = tuple(w.lower() for w in reject_words)
+        self.latency = latency
+
+    def classify(self, emojis, content, timeout=None, on_topic=False):
+        if self.latency:
+            threading.Event().wait(self.latency)
+        lowered = content.lower()
+        return not any(word in lowered for word in self.reject_words)
+
+
+def make_remote_backend(config):
+    """Build the configured model backend, or None when moderation is disabled"""
+    name = config.get('MODERATION_BACKEND', 'gemini')
+    if name == 'stub':
+        return StubModerationBackend(latency=config.get('MODERATION_STUB_LATENCY', 0.0))
+    if name == 'gemini':
+        api_key = config.get('GEMINI_API_KEY')
+        if not api_key:
+            print("WARNING: GEMINI_API_KEY not found. Moderation is disabled.")
+            return None
+        # no SDK import here; GeminiModerationBackend connects on first use
+        return GeminiModerationBackend(api_key)
+    return None
+
+
+# --- TIERED PIPELINE ---
+class LocalPreFilter:
+    """Cheap local checks run before the model.
+
+    classify() rejects on a blocklist match and otherwise leaves the story
+    undecided (None). It never approves, because only the model checks for
+    explicit or hateful content. is_on_topic() reports a story that uses enough
+    of the prompt's emojis that the model can skip the relevance question.
+    """
+
+    def __init__(self, blocklist=(), min_emoji_overlap=3):
+        words = [re.escape(w) for w in blocklist if w]
+        self.blocklist = re.compile(r'\b(?:' + '|'.join(words) + r')\b', re.IGNORECASE) if words else None
+        self.min_emoji_overlap = min_emoji_overlap
+
+    def classify(self, emojis, content):
+        if self.blocklist is not None and self.blocklist.search(content):
+            return False
+        return None
+
+    def is_on_topic(self, emojis, content):
+        if not self.min_emoji_overlap:
+            return False
+        overlap = sum(1 for emoji in set(emojis.split()) if emoji in content)
+        return overlap >= self.min_emoji_overlap
+
+
+class VerdictCache:
+    """LRU of model verdicts keyed by hash of (emoji set, normalized content)"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(emojis, content):
+        normalized = ' '.join(content.lower().split())
+        material = ' '.join(sorted(set(emojis.split()))) + '\x00' + normalized
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is not None:
+                self._entries.move_to_end(key)
+            return verdict
+
+    def set(self, key, verdict):
+        with self._lock:
+            self._entries[key] = verdict
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Stops calling a degraded remote model.
+
+    A call counts as bad when it raises or takes longer than `latency_budget`.
+    Once the share of bad calls in the last `window` calls exceeds
+    `error_budget`, the circuit opens for `cooldown` seconds; afterwards a
+    single trial call decides whether it closes again.
+    """
+
+    def __init__(self, latency_budget=5.0, error_budget=0.5, window=20, min_calls=5, cooldown=30.0):
+        self.latency_budget = latency_budget
+        self.error_budget = error_budget
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def call(self, fn, *args, **kwargs):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial_in_flight):
+                raise CircuitOpenError('moderation backend circuit is open')
+            trial = state == 'half-open'
+            if trial:
+                self._trial_in_flight = True
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self._record(False, trial)
+            raise
+        self._record(time.monotonic() - start <= self.latency_budget, trial)
+        return result
+
+    def _record(self, ok, trial):
+        with self._lock:
+            if trial:
+                self._trial_in_flight = False
+                self._outcomes.clear()
+                self._opened_at = None if ok else time.monotonic()
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if (self._opened_at is None and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) > self.error_budget):
+                self._opened_at = time.monotonic()
+                self.trips += 1
+
+
+class ModerationPipeline:
+    """Pre-filter -> verdict cache -> circuit-broken remote model.
+
+    `fallback` decides what happens while the remote model is unavailable:
+    'approve', 'reject', or 'defer' (raise, so the queue retries the job later).
+    """
+    name = 'pipeline'
+
+    def __init__(self, remote, prefilter=None, cache=None, breaker=None, fallback='defer'):
+        self.remote = remote
+        self.prefilter = prefilter or LocalPreFilter()
+        self.cache = cache or VerdictCache()
+        self.breaker = breaker or CircuitBreaker()
+        self.fallback = fallback
+        self._counts_lock = threading.Lock()
+        self.counts = {'total': 0, 'prefilter': 0, 'cache': 0, 'remote': 0, 'fallback': 0}
+
+    def _count(self, tier):
+        with self._counts_lock:
+            self.counts['total'] += 1
+            self.counts[tier] += 1
+
+    def classify(self, emojis, content, timeout=None):
+        verdict = self.prefilter.classify(emojis, content)
+        if verdict is not None:
+            self._count('prefilter')
+            return verdict
+
+        key = self.cache.key(emojis, content)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            self._count('cache')
+            return verdict
+
+        on_topic = self.prefilter.is_on_topic(emojis, content)
+        try:
+            verdict = self.breaker.call(observe_moderation, self.remote, emojis, content,
+                                        timeout=timeout, on_topic=on_topic)
+        except Exception:
+            if self.fallback == 'defer' or self.breaker.state == 'closed':
+                # a single failure with a healthy circuit is retried, not guessed at
+                raise
+            self._count('fallback')
+            return self.fallback == 'approve'
+        self._count('remote')
+        self.cache.set(key, verdict)
+        return verdict
+
+    def stats(self):
+        with self._counts_lock:
+            counts = dict(self.counts)
+        total = counts['total'] or 1
+        return {
+            'counts': counts,
+            'hit_rates': {tier: counts[tier] / total for tier in ('prefilter', 'cache', 'remote', 'fallback')},
+            'breaker': {'state': self.breaker.state, 'trips': self.breaker.trips},
+        }
+
+
+def make_backend(config):
+    """Wrap the configured model backend in the tiered pipeline (None when disabled)"""
+    remote = make_remote_backend(config)
+    if remote is None:
+        return None
+    return ModerationPipeline(
+        remote,
+        prefilter=LocalPreFilter(config.get('MODERATION_BLOCKLIST', ()),
+                                 config.get('MODERATION_PREFILTER_MIN_OVERLAP', 3)),
+        cache=VerdictCache(config.get('MODERATION_VERDICT_CACHE_SIZE', 10000)),
+        breaker=CircuitBreaker(latency_budget=config.get('MODERATION_LATENCY_BUDGET', 5.0),
+                               error_budget=config.get('MODERATION_ERROR_BUDGET', 0.5),
+                               cooldown=config.get('MODERATION_BREAKER_COOLDOWN', 30.0)),
+        fallback=config.get('MODERATION_FALLBACK', 'defer'),
+    )
+
+
+# --- QUEUE ---
+class ModerationQueue:
+    """Drains ModerationJob rows with a bounded worker pool.
+
+    The table is the queue, so pending work survives restarts and can be shared
+    by several processes: a job is claimed by leasing it (locked_until) with a
+    conditional UPDATE, and a crashed worker's lease simply expires.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self._executor = None
+        self._slots = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        # process that started the threads; a forked child has none of them
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # workers are started by the serving entry points (run.py, wsgi.py) or
+        # `flask moderation work`, never here: CLI commands must not claim jobs
+        self.app = app
+        self.backend = make_backend(app.config)
+        app.extensions['moderation_queue'] = self
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    # -- producer side (called from request handlers) --
+    def submit_for_review(self, story):
+        """Mark a new/edited story for moderation; the caller commits"""
+        if not self.enabled:
+            story.moderation_status = MODERATION_APPROVED
+            return
+        story.moderation_status = MODERATION_PENDING
+        if story.moderation_job is None:
+            story.moderation_job = ModerationJob()
+        else:
+            job = story.moderation_job
+            job.attempts = 0
+            job.next_attempt_at = datetime.utcnow()
+            job.locked_until = None
+            # a worker still classifying the old text must not apply its verdict
+            job.revision = ModerationJob.revision + 1
+
+    def is_full(self):
+        """Backpressure: True when the backlog is too deep to accept more work"""
+        if not self.enabled:
+            return False
+        backlog = db.session.scalar(
+            select(func.count(ModerationJob.id)).where(ModerationJob.next_attempt_at.isnot(None))
+        )
+        return backlog >= self.app.config['MODERATION_MAX_BACKLOG']
+
+    def notify(self):
+        self._wake.set()
+
+    # -- consumer side --
+    def start(self):
+        """Start the dispatcher and worker pool; returns False when moderation is disabled or already running.
+
+        Safe to call on every request: threads inherited through fork() are
+        gone in the child, so a forked process starts its own.
+        """
+        workers = self.app.config['MODERATION_WORKERS']
+        if not self.enabled or workers < 1:
+            return False
+        if self._dispatcher is not None and self._pid == os.getpid():
+            return False
+        with self._start_lock:
+            if self._dispatcher is not None and self._pid == os.getpid():
+                return False
+            self._stop.clear()
+            self._wake = threading.Event()
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='moderation')
+            self._slots = threading.Semaphore(workers)
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='moderation-dispatcher',
+                                                daemon=True)
+            self._pid = os.getpid()
+            self._dispatcher.start()
+            return True
+
+    def wait(self):
+        """Block until stop() is called (for `flask moderation work`)"""
+        dispatcher = self._dispatcher
+        # join with a timeout so Ctrl-C still reaches the main thread
+        while dispatcher is not None and dispatcher.is_alive():
+            dispatcher.join(1)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _dispatch_loop(self):
+        poll_interval = self.app.config['MODERATION_POLL_INTERVAL']
+        while not self._stop.is_set():
+            free = 0
+            while self._slots.acquire(blocking=False):
+                free += 1
+            claimed = []
+            try:
+                if free:
+                    with self.app.app_context():
+                        claimed = self.claim(free)
+            except Exception as e:
+                print(f"ERROR: moderation dispatcher failed to claim jobs: {e}")
+            for job_id in claimed:
+                self._executor.submit(self._run, job_id)
+            for _ in range(free - len(claimed)):
+                self._slots.release()
+            if not claimed:
+                self._wake.wait(poll_interval)
+                self._wake.clear()
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                self.process(job_id)
+        except Exception as e:
+            print(f"ERROR: moderation job {job_id} crashed: {e}")
+        finally:
+            self._slots.release()
+            self._wake.set()
+
+    def claim(self, limit):
+        """Lease up to `limit` due jobs; returns the claimed job ids"""
+        now = datetime.utcnow()
+        lease = now + timedelta(seconds=self.app.config['MODERATION_TIMEOUT'] * 2)
+        candidates = db.session.scalars(
+            select(ModerationJob.id)
+            .where(ModerationJob.next_attempt_at <= now,
+                   (ModerationJob.locked_until.is_(None)) | (ModerationJob.locked_until < now))
+            .order_by(ModerationJob.next_attempt_at)
+            .limit(limit)
+        ).all()
+        claimed = []
+        for job_id in candidates:
+            won = db.session.execute(
+                update(ModerationJob)
+                .where(ModerationJob.id == job_id,
+                       (ModerationJob.locked_until.is_(None)) | (ModerationJob.locked_until < now))
+                .values(locked_until=lease)
+            ).rowcount
+            if won:
+                claimed.append(job_id)
+        db.session.commit()
+        return claimed
+
+    def process(self, job_id):
+        """Run one claimed job through the backend and record the verdict or retry.
+
+        The job's revision is read with the text. If the author edits the
+        story while it is being classified, the edit bumps the revision, the
+        conditional writes below match nothing, and the re-armed job stays
+        pending for the new text.
+
+        A job that runs out of attempts gets the MODERATION_FALLBACK verdict:
+        approved for 'approve', otherwise rejected. A rejected story keeps its
+        job, with the last error, so `flask moderation requeue` can retry it.
+        """
+        job = db.session.get(ModerationJob, job_id)
+        if job is None:
+            return
+        story = job.story
+        story_id, daily_emoji_id = story.id, story.daily_emoji_id
+        emojis, content = story.daily_emoji_set.emojis, story.content
+        revision, attempts = job.revision, job.attempts
+        # don't hold a read transaction open across the model call; the edit must be able to commit
+        db.session.close()
+        config = self.app.config
+        this_revision = (ModerationJob.id == job_id, ModerationJob.revision == revision)
+        try:
+            approved = self.backend.classify(emojis, content, timeout=config['MODERATION_TIMEOUT'])
+        except Exception as e:
+            print(f"ERROR: moderation of story {story_id} failed (attempt {attempts + 1}): {e}")
+            attempts += 1
+            exhausted = attempts >= config['MODERATION_MAX_ATTEMPTS']
+            if exhausted:
+                next_attempt_at = None
+            else:
+                backoff = config['MODERATION_RETRY_BACKOFF'] * 2 ** (attempts - 1)
+                next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+            updated = db.session.execute(
+                update(ModerationJob).where(*this_revision)
+                .values(attempts=attempts, last_error=str(e)[:500], locked_until=None,
+                        next_attempt_at=next_attempt_at)
+            ).rowcount
+            if not (exhausted and updated):
+                db.session.commit()
+                return
+            approved = config['MODERATION_FALLBACK'] == 'approve'
+            print(f"WARNING: giving up on moderating story {story_id}; "
+                  f"{'approving' if approved else 'rejecting'} it (MODERATION_FALLBACK)")
+            if approved:
+                db.session.execute(delete(ModerationJob).where(*this_revision))
+        else:
+            if not db.session.execute(delete(ModerationJob).where(*this_revision)).rowcount:
+                db.session.rollback()
+                return
+        db.session.execute(
+            update(Story).where(Story.id == story_id)
+            .values(moderation_status=MODERATION_APPROVED if approved else MODERATION_REJECTED)
+        )
+        db.session.commit()
+        # an approved story may belong on any page of its day
+        feed_fragment_cache.invalidate_matching(lambda key: key[0] == daily_emoji_id)
+
+    def requeue(self, story_ids=None):
+        """Put jobs that ran out of attempts back in the queue, their stories back to pending.
+
+        With `story_ids`, only those stories' jobs. Returns the number requeued.
+        """
+        exhausted = select(ModerationJob.story_id).where(ModerationJob.next_attempt_at.is_(None))
+        if story_ids is not None:
+            exhausted = exhausted.where(ModerationJob.story_id.in_(story_ids))
+        story_ids = db.session.scalars(exhausted).all()
+        if not story_ids:
+            return 0
+        db.session.execute(
+            update(ModerationJob).where(ModerationJob.story_id.in_(story_ids))
+            .values(attempts=0, next_attempt_at=datetime.utcnow(), locked_until=None,
+                    revision=ModerationJob.revision + 1)
+        )
+        db.session.execute(update(Story).where(Story.id.in_(story_ids)).values(moderation_status=MODERATION_PENDING))
+        db.session.commit()
+        self.notify()
+        return len(story_ids)
+
+    def drain(self):
+        """Synchronously process every due job; used by tests, benchmarks and the CLI"""
+        processed = 0
+        while True:
+            claimed = self.claim(100)
+            if not claimed:
+                return processed
+            for job_id in claimed:
+                self.process(job_id)
+                processed += 1
+
+
+moderation_queue = ModerationQueue()
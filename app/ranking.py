@@ -0,0 +1,140 @@
+"""Precomputed story rankings for ?sort=hot|top and the top-stories list.
+
+top_score is plain engagement: LIKE_WEIGHT per like plus COMMENT_WEIGHT per
+comment. hot_score is the same engagement with exponential decay: each write
+adds its weight at full strength, and `flask ranking decay` (run every few
+minutes from cron) multiplies every live score by 0.5 ** (elapsed /
+half-life) in one UPDATE. Both columns are indexed, so a ranked page or a
+top-k list reads only the rows it returns.
+"""
+from datetime import datetime, timedelta
+import math
+
+from flask import current_app
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import joinedload
+
+from .extensions import db
+from .models import Comments, RankingState, Story, StoryLike, MODERATION_APPROVED
+
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+# must match the Story.hot_score column default
+NEW_STORY_HEAT = 1.0
+# decayed scores below this are set to 0, so decay runs stop touching old stories
+HOT_FLOOR = 0.01
+REBUILD_CHUNK = 1000
+
+
+def _half_life():
+    return current_app.config['RANKING_HALF_LIFE_HOURS'] * 3600.0
+
+def bump_scores(story_id, likes=0, comments=0):
+    """Add (or, with negative counts, remove) engagement to a story's scores; the caller commits"""
+    delta = likes * LIKE_WEIGHT + comments * COMMENT_WEIGHT
+    if not delta:
+        return
+    # SQLite's two-argument max() is scalar; it keeps an unlike from going negative
+    db.session.execute(
+        update(Story)
+        .where(Story.id == story_id)
+        .values(top_score=func.max(Story.top_score + delta, 0),
+                hot_score=func.max(Story.hot_score + delta, 0.0))
+    )
+
+def decay_hot_scores(now=None):
+    """Decay every non-zero hot score by the time since the last run; returns rows updated.
+
+    The first run only records the time. Concurrent runs are safe: the one
+    that fails to claim the RankingState row does nothing.
+    """
+    now = now or datetime.utcnow()
+    state = db.session.get(RankingState, 1)
+    if state is None:
+        db.session.add(RankingState(id=1, decayed_at=now))
+        db.session.commit()
+        return 0
+    elapsed = (now - state.decayed_at).total_seconds()
+    if elapsed <= 0:
+        return 0
+    claimed = db.session.execute(
+        update(RankingState)
+        .where(RankingState.id == 1, RankingState.decayed_at == state.decayed_at)
+        .values(decayed_at=now)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return 0
+    factor = 0.5 ** (elapsed / _half_life())
+    decayed = Story.hot_score * factor
+    updated = db.session.execute(
+        update(Story)
+        .where(Story.hot_score > 0)
+        .values(hot_score=case((decayed < HOT_FLOOR, 0.0), else_=decayed))
+    ).rowcount
+    db.session.commit()
+    return updated
+
+def rebuild_scores(now=None):
+    """Recompute both scores from the like and comment tables; returns stories with heat.
+
+    top_score is rebuilt with one set-based UPDATE. hot_score is replayed
+    from the timestamps of recent stories, likes and comments; anything
+    older than the point where its weight would have decayed below HOT_FLOOR
+    contributes nothing, so only that window is read.
+    """
+    now = now or datetime.utcnow()
+    half_life = _half_life()
+    comment_count = (select(func.count(Comments.id)).where(Comments.story_id == Story.id)
+                     .correlate(Story).scalar_subquery())
+    db.session.execute(update(Story).values(
+        top_score=Story.likes * LIKE_WEIGHT + comment_count * COMMENT_WEIGHT,
+        hot_score=0.0,
+    ))
+
+    horizon = now - timedelta(seconds=half_life * math.log2(max(COMMENT_WEIGHT, LIKE_WEIGHT, NEW_STORY_HEAT)
+                                                             / HOT_FLOOR))
+    heat = {}
+
+    def add(story_id, timestamp, weight):
+        if timestamp is None or timestamp < horizon:
+            return
+        age = max((now - timestamp).total_seconds(), 0.0)
+        heat[story_id] = heat.get(story_id, 0.0) + weight * 0.5 ** (age / half_life)
+
+    for story_id, timestamp in db.session.execute(select(Story.id, Story.timestamp)
+                                                  .where(Story.timestamp >= horizon)):
+        add(story_id, timestamp, NEW_STORY_HEAT)
+    for story_id, timestamp in db.session.execute(select(StoryLike.story_id, StoryLike.timestamp)
+                                                  .where(StoryLike.timestamp >= horizon)):
+        add(story_id, timestamp, LIKE_WEIGHT)
+    for story_id, timestamp in db.session.execute(select(Comments.story_id, Comments.timestamp)
+                                                  .where(Comments.timestamp >= horizon)):
+        add(story_id, timestamp, COMMENT_WEIGHT)
+
+    rows = [{'id': story_id, 'hot_score': score} for story_id, score in heat.items() if score >= HOT_FLOOR]
+    for start in range(0, len(rows), REBUILD_CHUNK):
+        db.session.execute(update(Story), rows[start:start + REBUILD_CHUNK])
+
+    state = db.session.get(RankingState, 1)
+    if state is None:
+        db.session.add(RankingState(id=1, decayed_at=now))
+    else:
+        state.decayed_at = now
+    db.session.commit()
+    return len(rows)
+
+def top_stories(limit, by='top', exclude_daily_emoji_id=None):
+    """The `limit` highest-ranked approved stories across all days, best first.
+
+    Walks ix_story_top / ix_story_hot from the top, so it reads about
+    `limit` rows however many stories exist.
+    """
+    column = Story.hot_score if by == 'hot' else Story.top_score
+    # likely() tells SQLite most stories pass the filter, so it walks the score
+    # index and stops after `limit` rows instead of sorting every approved story
+    query = (Story.query.options(joinedload(Story.author), joinedload(Story.daily_emoji_set))
+             .filter(func.likely(Story.moderation_status == MODERATION_APPROVED)))
+    if exclude_daily_emoji_id is not None:
+        query = query.filter(Story.daily_emoji_id != exclude_daily_emoji_id)
+    return query.order_by(column.desc(), Story.id.desc()).limit(limit).all()
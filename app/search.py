@@ -0,0 +1,168 @@
+import re
+import sqlite3
+
+from markupsafe import Markup, escape
+from sqlalchemy import inspect, text
+
+from .extensions import db
+
+# One FTS5 row per story (title + content) and per comment (content only).
+# Both share the index so they are ranked against each other; rowids are
+# 2*story.id and 2*comment.id + 1 so triggers can address a row directly.
+# author_id and story_id are stored for filtering and joins, not searched.
+SEARCH_TABLE = 'search_index'
+
+SEARCH_DDL = f"""
+CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+    title, body, kind UNINDEXED, story_id UNINDEXED, author_id UNINDEXED,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+)
+"""
+
+# Triggers rather than ORM events, so bulk inserts and set-based updates are indexed too
+SEARCH_TRIGGERS = {
+    'search_story_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS search_story_insert AFTER INSERT ON story BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, title, body, kind, story_id, author_id)
+            VALUES (new.id * 2, new.title, new.content, 'story', new.id, new.user_id);
+        END""",
+    'search_story_update': f"""
+        CREATE TRIGGER IF NOT EXISTS search_story_update AFTER UPDATE OF title, content, user_id ON story BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+            INSERT INTO {SEARCH_TABLE} (rowid, title, body, kind, story_id, author_id)
+            VALUES (new.id * 2, new.title, new.content, 'story', new.id, new.user_id);
+        END""",
+    'search_story_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS search_story_delete AFTER DELETE ON story BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+        END""",
+    'search_comment_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS search_comment_insert AFTER INSERT ON comments BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, title, body, kind, story_id, author_id)
+            VALUES (new.id * 2 + 1, '', new.content, 'comment', new.story_id, new.user_id);
+        END""",
+    'search_comment_update': f"""
+        CREATE TRIGGER IF NOT EXISTS search_comment_update AFTER UPDATE OF content, story_id, user_id ON comments BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+            INSERT INTO {SEARCH_TABLE} (rowid, title, body, kind, story_id, author_id)
+            VALUES (new.id * 2 + 1, '', new.content, 'comment', new.story_id, new.user_id);
+        END""",
+    'search_comment_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS search_comment_delete AFTER DELETE ON comments BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+        END""",
+}
+
+# bm25 column weights: a hit in a title counts for more than one in a body
+TITLE_WEIGHT = 4.0
+BODY_WEIGHT = 1.0
+
+MAX_TERMS = 8
+
+# snippet() wraps matched terms in these; highlight() turns them into <mark> after escaping
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+_fts5 = None
+
+
+def search_available():
+    """FTS5 is compiled into almost every SQLite build, but it is an option"""
+    global _fts5
+    if _fts5 is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute('CREATE VIRTUAL TABLE probe USING fts5(x)')
+            _fts5 = True
+        except sqlite3.OperationalError:
+            _fts5 = False
+        finally:
+            conn.close()
+    return _fts5
+
+
+def install_search_index():
+    """Create the FTS table and its triggers if missing; a new table is filled from existing rows.
+
+    Returns a list of problems, like upgrade_schema().
+    """
+    if db.engine.dialect.name != 'sqlite' or not search_available():
+        return ['search index skipped: SQLite FTS5 is not available']
+    created = SEARCH_TABLE not in inspect(db.engine).get_table_names()
+    with db.engine.begin() as conn:
+        if created:
+            conn.execute(text(SEARCH_DDL))
+        for ddl in SEARCH_TRIGGERS.values():
+            conn.execute(text(ddl))
+    if created:
+        rebuild_search_index()
+    return []
+
+
+def rebuild_search_index():
+    """Re-index every story and comment from scratch; returns (stories, comments) indexed"""
+    with db.engine.begin() as conn:
+        conn.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+        stories = conn.execute(text(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, body, kind, story_id, author_id) "
+            f"SELECT id * 2, title, content, 'story', id, user_id FROM story"
+        )).rowcount
+        comments = conn.execute(text(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, body, kind, story_id, author_id) "
+            f"SELECT id * 2 + 1, '', content, 'comment', story_id, user_id FROM comments"
+        )).rowcount
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    return stories, comments
+
+
+def match_expression(query):
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix.
+
+    Returns None when there is nothing to search for.
+    """
+    terms = re.findall(r'\w+', query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    return (escape(snippet).replace(HIGHLIGHT_START, Markup('<mark>'))
+            .replace(HIGHLIGHT_END, Markup('</mark>')))
+
+
+def search(query, page=1, per_page=20, daily_emoji_id=None, author_id=None, exclude_daily_emoji_id=None):
+    """Ranked hits for `query` over approved stories and their comments.
+
+    Returns (hits, has_more). Each hit is a row with kind ('story' or
+    'comment'), story_id, story_title, author, prompt_date, snippet and rank.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return [], False
+    filters = ["story.moderation_status = 'approved'"]
+    params = {'expression': expression, 'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    if daily_emoji_id is not None:
+        filters.append('story.daily_emoji_id = :daily_emoji_id')
+        params['daily_emoji_id'] = daily_emoji_id
+    if exclude_daily_emoji_id is not None:
+        filters.append('story.daily_emoji_id != :exclude_daily_emoji_id')
+        params['exclude_daily_emoji_id'] = exclude_daily_emoji_id
+    if author_id is not None:
+        filters.append(f'{SEARCH_TABLE}.author_id = :author_id')
+        params['author_id'] = author_id
+    rows = db.session.execute(text(f"""
+        SELECT {SEARCH_TABLE}.kind, {SEARCH_TABLE}.story_id, story.title AS story_title, author.username AS author,
+               daily_emoji.date_posted AS prompt_date,
+               snippet({SEARCH_TABLE}, -1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 16) AS snippet,
+               bm25({SEARCH_TABLE}, {TITLE_WEIGHT}, {BODY_WEIGHT}) AS rank
+        FROM {SEARCH_TABLE}
+        JOIN story ON story.id = {SEARCH_TABLE}.story_id
+        JOIN "user" AS author ON author.id = {SEARCH_TABLE}.author_id
+        LEFT JOIN daily_emoji ON daily_emoji.id = story.daily_emoji_id
+        WHERE {SEARCH_TABLE} MATCH :expression AND {' AND '.join(filters)}
+        ORDER BY rank, {SEARCH_TABLE}.rowid
+        LIMIT :limit OFFSET :offset
+    """), params).all()
+    return rows[:per_page], len(rows) > per_page
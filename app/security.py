@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import math
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class TokenBucket:
+    """Per-key token buckets: `burst` attempts at once, refilled at `per_minute`.
+
+    Keys are kept in LRU order and capped at `max_keys`, so a flood of distinct
+    keys can't grow memory without bound (a forgotten key starts full again).
+    """
+
+    def __init__(self, burst=10, per_minute=5, max_keys=100000):
+        self.burst = burst
+        self.per_minute = per_minute
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self.rejected = 0
+
+    def _level(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.per_minute / 60.0)
+
+    def _wait(self, tokens):
+        return math.ceil((1 - tokens) * 60.0 / self.per_minute) if self.per_minute else 60
+
+    def check(self, key):
+        """Like take(), but without spending a token"""
+        with self._lock:
+            tokens = self._level(key, time.monotonic())
+            if tokens < 1:
+                self.rejected += 1
+                return self._wait(tokens)
+            return 0
+
+    def take(self, key):
+        """Spend one token for `key`; returns 0 when allowed, else seconds until the next token"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._level(key, now)
+            if tokens < 1:
+                self.rejected += 1
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+                return self._wait(tokens)
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+login_ip_limiter = TokenBucket()
+login_username_limiter = TokenBucket()
+
+
+class HasherBusy(RuntimeError):
+    """Every password-hash slot is taken, or the hash timed out; the caller should ask the user to retry"""
+
+
+class PasswordHasher:
+    """Runs password hashing on a small, bounded pool.
+
+    Hashes are deliberately slow, so at most `workers` run at once (leaving
+    the other cores to ordinary requests) and at most `max_pending` may wait
+    for a worker; past that, callers get HasherBusy immediately.
+    """
+
+    def __init__(self, method='scrypt', workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._prefix = None
+        self._dummy_hash = None
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+        self._prefix = None
+        self._dummy_hash = None
+        app.extensions['password_hasher'] = self
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher')
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # the slot is held until the hash itself finishes (or is cancelled), not until
+        # the caller gives up waiting, so max_pending really bounds the executor's backlog
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy() from None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Check `password`; with no stored hash, burn the same time against a dummy one"""
+        if not password_hash:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash('dummy password')
+            self._run(check_password_hash, self._dummy_hash, password)
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when `password_hash` was made with other parameters than PASSWORD_HASH_METHOD"""
+        if self._prefix is None:
+            # 'scrypt' and 'scrypt:32768:8:1' are the same method; compare werkzeug's own spelling,
+            # which costs one full hash, so it runs on the pool like any other
+            self._prefix = self._run(generate_password_hash, '', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+password_hasher = PasswordHasher()
+
+
+def init_app(app):
+    login_ip_limiter.burst = app.config['LOGIN_IP_BURST']
+    login_ip_limiter.per_minute = app.config['LOGIN_IP_PER_MINUTE']
+    login_username_limiter.burst = app.config['LOGIN_USERNAME_BURST']
+    login_username_limiter.per_minute = app.config['LOGIN_USERNAME_PER_MINUTE']
+    login_ip_limiter.clear()
+    login_username_limiter.clear()
+    password_hasher.init_app(app)
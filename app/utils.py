@@ -0,0 +1,41 @@
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+# --- KEYSET PAGINATION ---
+def encode_cursor(timestamp, row_id):
+    """Opaque cursor pointing at a (timestamp, id) position in a feed"""
+    return f"{timestamp.isoformat()}_{row_id}"
+
+def decode_cursor(cursor):
+    """Parse a cursor from encode_cursor(); raises ValueError when malformed"""
+    timestamp, _, row_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def after_cursor(timestamp_column, id_column, cursor, descending=True):
+    """Filter clause selecting rows strictly after `cursor` in (timestamp, id) order"""
+    timestamp, row_id = cursor
+    if descending:
+        return or_(timestamp_column < timestamp,
+                   and_(timestamp_column == timestamp, id_column < row_id))
+    return or_(timestamp_column > timestamp,
+               and_(timestamp_column == timestamp, id_column > row_id))
+
+def keyset_page(query, timestamp_column, id_column, cursor, limit,
+                position=lambda row: (row.timestamp, row.id), descending=True):
+    """Run `query` from `cursor` in (timestamp, id) order; returns (rows, next_cursor).
+
+    `position` maps a result row to the (timestamp, id) the cursor encodes.
+    """
+    if cursor is not None:
+        query = query.filter(after_cursor(timestamp_column, id_column, cursor, descending))
+    if descending:
+        query = query.order_by(timestamp_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(timestamp_column, id_column)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*position(rows[-1]))
+    return rows, next_cursor
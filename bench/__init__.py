@@ -0,0 +1 @@
+"""Benchmarks for the Glyphy app. Run modules with `python -m bench.<name> --help`."""
@@ -0,0 +1,124 @@
+"""Synthetic datasets for benchmarks."""
+from datetime import datetime, timedelta
+import os
+import random
+import tempfile
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from config import Config
+from app.extensions import db
+from app.models import User, DailyEmoji, Story, Comments, StoryLike, MODERATION_APPROVED
+from app.counters import reconcile_counters
+from app.ranking import rebuild_scores
+from app.cache import daily_prompt_cache, feed_fragment_cache, user_cache, prompt_date
+from app.migrations import init_db
+
+BENCH_PASSWORD = 'Bench-passw0rd!'
+
+WORDS = ("the a quiet storm river laughed under moon ghost pizza rocket cat dragon "
+         "forgot sang ran lost found over bright tiny enormous door secret garden").split()
+
+
+class BenchConfig(Config):
+    WTF_CSRF_ENABLED = False
+    MODERATION_BACKEND = 'stub'
+    # workers are started by the harness once the dataset (and schema) exists
+    MODERATION_WORKERS = 0
+    MODERATION_POLL_INTERVAL = 0.2
+    # every virtual user logs in from 127.0.0.1
+    LOGIN_IP_BURST = 1000000
+    LOGIN_USERNAME_BURST = 1000000
+
+
+def bench_config(db_path=None, base=BenchConfig, **overrides):
+    """Config class pointing at a scratch SQLite file"""
+    db_path = db_path or os.path.join(tempfile.mkdtemp(prefix='glyphy-bench-'), 'bench.db')
+    attrs = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path}
+    attrs.update(overrides)
+    return type('ScratchBenchConfig', (base,), attrs)
+
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def build_dataset(app, users=100, days=7, stories_per_day=50, comments_per_story=5,
+                  likes_per_story=5, seed=1234, chunk=5000):
+    """Fill the app's database with a reproducible synthetic dataset.
+
+    Creates `days` DailyEmoji prompts ending today. Every day, a random
+    `stories_per_day` users post (capped at `users`). Today's writers are
+    listed in the result, so traffic can tell them apart from users who
+    still have to post.
+    """
+    rng = random.Random(seed)
+    stories_per_day = min(stories_per_day, users)
+    password_hash = generate_password_hash(BENCH_PASSWORD, app.config['PASSWORD_HASH_METHOD'])  # hashed once, shared by every user
+    now = datetime.utcnow()
+
+    with app.app_context():
+        init_db()
+        db.session.execute(insert(User), [
+            {'username': f'bench{i}', 'email': f'bench{i}@example.com',
+             'password_hash': password_hash, 'current_streak': 0, 'longest_streak': 0}
+            for i in range(users)
+        ])
+        user_ids = [row[0] for row in db.session.query(User.id).order_by(User.id)]
+        position = {uid: i for i, uid in enumerate(user_ids)}
+
+        today = prompt_date(app.config['DAILY_PROMPT_ROLLOVER_HOUR'])
+        prompt_ids = []
+        for offset in range(days - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            prompt = DailyEmoji(emojis=' '.join(rng.sample(['😀', '🐶', '🌊', '🚀', '🍕', '🎸', '👻', '🌵', '💎', '🧠'], 6)),
+                                date_posted=day)
+            db.session.add(prompt)
+            db.session.flush()
+            prompt_ids.append((prompt.id, offset))
+        db.session.commit()
+
+        todays_writers = []
+        for prompt_id, offset in prompt_ids:
+            writers = rng.sample(user_ids, stories_per_day)
+            if offset == 0:
+                todays_writers = writers
+            base_time = now - timedelta(days=offset)
+            rows = [{'title': _sentence(rng, 3)[:120], 'content': _sentence(rng, 40),
+                     'timestamp': base_time - timedelta(seconds=rng.randint(0, 80000)),
+                     'likes': 0, 'moderation_status': MODERATION_APPROVED,
+                     'user_id': uid, 'daily_emoji_id': prompt_id} for uid in writers]
+            for start in range(0, len(rows), chunk):
+                db.session.execute(insert(Story), rows[start:start + chunk])
+        db.session.commit()
+
+        story_rows = db.session.query(Story.id, Story.timestamp).all()
+        comment_rows, like_rows = [], []
+        for story_id, timestamp in story_rows:
+            for _ in range(comments_per_story):
+                comment_rows.append({'content': _sentence(rng, 12), 'story_id': story_id,
+                                     'user_id': rng.choice(user_ids), 'likes': 0,
+                                     'timestamp': timestamp + timedelta(seconds=rng.randint(1, 3600))})
+            for uid in rng.sample(user_ids, min(likes_per_story, len(user_ids))):
+                like_rows.append({'user_id': uid, 'story_id': story_id})
+        for start in range(0, len(comment_rows), chunk):
+            db.session.execute(insert(Comments), comment_rows[start:start + chunk])
+        for start in range(0, len(like_rows), chunk):
+            db.session.execute(insert(StoryLike), like_rows[start:start + chunk])
+        db.session.execute(db.text(
+            'UPDATE story SET likes = (SELECT COUNT(*) FROM story_like WHERE story_like.story_id = story.id)'
+        ))
+        db.session.commit()
+        reconcile_counters()
+        rebuild_scores()
+
+    daily_prompt_cache.clear()
+    feed_fragment_cache.clear()
+    user_cache.clear()
+    return {
+        'users': users, 'days': days, 'stories': len(story_rows),
+        'comments': len(comment_rows), 'likes': len(like_rows),
+        'usernames': [f'bench{i}' for i in range(users)],
+        'todays_writers': {f'bench{position[uid]}' for uid in todays_writers},
+    }
@@ -0,0 +1,326 @@
+"""Replay a realistic traffic mix against every blueprint route.
+
+    python -m bench.routes --users 500 --days 14 --stories-per-day 200 \
+        --concurrency 8 --requests 4000 --output bench_results.json
+
+Reports p50/p95/p99 latency, throughput and SQL queries per request for each
+route, as JSON so runs can be compared across commits.
+"""
+import argparse
+from collections import defaultdict
+import http.cookiejar
+import json
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from sqlalchemy import event
+
+from app import create_app
+from app.extensions import db
+from app.moderation import moderation_queue
+from .dataset import BENCH_PASSWORD, bench_config, build_dataset
+
+# (name, weight) -- roughly what a day of real traffic looks like
+TRAFFIC_MIX = (
+    ('feed', 30),
+    ('feed_api', 10),
+    ('feed_hot', 5),
+    ('top_stories', 2),
+    ('story_detail', 20),
+    ('dashboard', 12),
+    ('like_story', 10),
+    ('comment', 5),
+    ('like_comment', 4),
+    ('profile', 5),
+    ('submit', 2),
+    ('login', 2),
+)
+
+
+class QueryCounter:
+    """Counts SQL statements per request and reports them in an X-Query-Count header.
+
+    Counting happens on the thread that serves the request, so it works the
+    same for the test client and for the HTTP server's worker threads.
+    """
+
+    HEADER = 'X-Query-Count'
+
+    def __init__(self, app, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+        app.before_request(self._reset)
+        app.after_request(self._report)
+
+    def _on_execute(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def _reset(self):
+        self._local.count = 0
+
+    def _report(self, response):
+        response.headers[self.HEADER] = str(getattr(self._local, 'count', 0))
+        return response
+
+
+# --- CLIENTS ---
+class TestClientSession:
+    """Drives the app in-process through Flask's test client"""
+
+    def __init__(self, app, base_url=None):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, json_body=None):
+        response = self.client.open(path, method=method, data=data, json=json_body)
+        body = response.get_data()
+        return response.status_code, body, response.headers
+
+
+class HTTPSession:
+    """Drives a real HTTP server with its own cookie jar"""
+
+    def __init__(self, app, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect())
+
+    def request(self, method, path, data=None, json_body=None):
+        headers = {}
+        payload = None
+        if json_body is not None:
+            payload = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            payload = urllib.parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=payload, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as response:
+                return response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+# --- VIRTUAL USERS ---
+class VirtualUser:
+    def __init__(self, session, username, has_posted, rng):
+        self.session = session
+        self.username = username
+        self.has_posted = has_posted
+        self.rng = rng
+        self.story_ids = []
+        self.comment_ids = []
+
+    def login(self):
+        return self.session.request('POST', '/auth/login', data={
+            'username': self.username, 'password': BENCH_PASSWORD, 'submit_login': 'Sign In'})
+
+    def ensure_posted(self):
+        if not self.has_posted:
+            self.submit()
+
+    def submit(self):
+        result = self.session.request('POST', '/submit', data={
+            'story_title': 'Benchmark story',
+            'story_content': 'A benchmark story about a rocket, a cat and a pizza.'})
+        self.has_posted = True
+        return result
+
+    def remember_stories(self, body):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return
+        self.story_ids = [s['id'] for s in payload.get('stories', [])] or self.story_ids
+
+    def run(self, action):
+        story_id = self.rng.choice(self.story_ids) if self.story_ids else 1
+        if action == 'feed':
+            return self.session.request('GET', '/stories')
+        if action == 'feed_api':
+            result = self.session.request('GET', '/api/stories')
+            self.remember_stories(result[1])
+            return result
+        if action == 'feed_hot':
+            return self.session.request('GET', '/stories?sort=hot')
+        if action == 'top_stories':
+            return self.session.request('GET', '/api/stories/top?limit=20')
+        if action == 'story_detail':
+            return self.session.request('GET', f'/story/{story_id}')
+        if action == 'dashboard':
+            return self.session.request('GET', '/dashboard')
+        if action == 'like_story':
+            return self.session.request('POST', f'/stories/{story_id}/like')
+        if action == 'comment':
+            result = self.session.request('POST', f'/story/{story_id}/comment',
+                                          data={'content': 'Benchmark comment'})
+            try:
+                self.comment_ids.append(json.loads(result[1])['comment']['id'])
+            except (ValueError, KeyError, TypeError):
+                pass
+            return result
+        if action == 'like_comment':
+            comment_id = self.rng.choice(self.comment_ids) if self.comment_ids else 1
+            return self.session.request('POST', f'/comment/{comment_id}/like')
+        if action == 'profile':
+            return self.session.request('GET', '/profile')
+        if action == 'submit':
+            return self.submit()
+        if action == 'login':
+            self.session.request('GET', '/auth/logout')
+            return self.login()
+        raise ValueError(action)
+
+
+# --- REPORTING ---
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, wall_time):
+    routes = {}
+    for name, rows in sorted(samples.items()):
+        latencies = sorted(r[0] for r in rows)
+        queries = [r[1] for r in rows]
+        errors = sum(1 for r in rows if r[2] >= 500)
+        routes[name] = {
+            'requests': len(rows),
+            'errors': errors,
+            'throughput_rps': len(rows) / wall_time if wall_time else None,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'mean': sum(latencies) / len(latencies) * 1000,
+            },
+            'queries_per_request': {'mean': sum(queries) / len(queries), 'max': max(queries)},
+        }
+    total = sum(len(rows) for rows in samples.values())
+    return {'wall_time_s': wall_time, 'total_requests': total,
+            'throughput_rps': total / wall_time if wall_time else None, 'routes': routes}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- DRIVER ---
+def run(args):
+    app = create_app(bench_config(args.db))
+    dataset = build_dataset(app, users=args.users, days=args.days, stories_per_day=args.stories_per_day,
+                            comments_per_story=args.comments_per_story, likes_per_story=args.likes_per_story,
+                            seed=args.seed)
+    with app.app_context():
+        QueryCounter(app, db.engine)
+    app.config['MODERATION_WORKERS'] = args.moderation_workers
+    if args.moderation_workers:
+        moderation_queue.start()
+
+    server = None
+    session_class, base_url = TestClientSession, None
+    if args.http:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', args.port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        session_class, base_url = HTTPSession, f'http://127.0.0.1:{server.server_port}'
+
+    rng = random.Random(args.seed)
+    names = [name for name, _ in TRAFFIC_MIX]
+    weights = [weight for _, weight in TRAFFIC_MIX]
+    samples = defaultdict(list)
+    samples_lock = threading.Lock()
+    per_thread = args.requests // args.concurrency
+
+    def worker(thread_index):
+        thread_rng = random.Random(args.seed + thread_index)
+        usernames = thread_rng.sample(dataset['usernames'], min(args.users_per_thread, len(dataset['usernames'])))
+        users = []
+        for username in usernames:
+            user = VirtualUser(session_class(app, base_url), username,
+                               username in dataset['todays_writers'], thread_rng)
+            user.login()
+            user.ensure_posted()
+            user.remember_stories(user.session.request('GET', '/api/stories')[1])
+            users.append(user)
+        local = []
+        for _ in range(per_thread):
+            user = thread_rng.choice(users)
+            action = thread_rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            status, _, headers = user.run(action)
+            elapsed = time.perf_counter() - start
+            local.append((action, elapsed, int(headers.get(QueryCounter.HEADER) or 0), status))
+        with samples_lock:
+            for action, elapsed, queries, status in local:
+                samples[action].append((elapsed, queries, status))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall_time = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+    if args.moderation_workers:
+        moderation_queue.stop()
+
+    report = summarize(samples, wall_time)
+    report['meta'] = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'transport': 'http' if args.http else 'test_client',
+        'concurrency': args.concurrency,
+        'dataset': {k: v for k, v in dataset.items() if k not in ('usernames', 'todays_writers')},
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--stories-per-day', type=int, default=100)
+    parser.add_argument('--comments-per-story', type=int, default=5)
+    parser.add_argument('--likes-per-story', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=2000, help='total requests across all threads')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--users-per-thread', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--moderation-workers', type=int, default=1, help='stub moderation workers (0 to disable)')
+    parser.add_argument('--http', action='store_true', help='go through a local HTTP server instead of the test client')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--db', help='SQLite file to build the dataset in (default: a temp file)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Full-text search latency as the corpus grows.
+
+    python -m bench.search --days 7,30,90 --stories-per-day 200 --output search.json
+
+Builds one dataset per --days value and times search() for a fixed set of
+queries against each, so the JSON shows how p50/p95 move with corpus size.
+"""
+import argparse
+import json
+import time
+
+from app import create_app
+from app.extensions import db
+from app.models import DailyEmoji, User
+from app.search import search
+from .dataset import bench_config, build_dataset
+from .routes import git_revision, percentile
+
+# (name, query, filters); the dataset vocabulary is small, so single words match a lot
+QUERIES = (
+    ('one_word', 'dragon', {}),
+    ('two_words', 'quiet river', {}),
+    ('prefix', 'gard', {}),
+    ('no_match', 'zeppelin', {}),
+    ('by_author', 'moon', {'author': 'bench1'}),
+    ('by_date', 'secret', {'date': 'latest'}),
+    ('page_5', 'ghost', {'page': 5}),
+)
+
+
+def time_queries(app, repeat):
+    results = {}
+    with app.app_context():
+        latest = db.session.query(DailyEmoji.id).order_by(DailyEmoji.date_posted.desc()).limit(1).scalar()
+        for name, query, options in QUERIES:
+            kwargs = {'page': options.get('page', 1)}
+            if 'author' in options:
+                kwargs['author_id'] = db.session.query(User.id).filter_by(username=options['author']).scalar()
+            if options.get('date') == 'latest':
+                kwargs['daily_emoji_id'] = latest
+            search(query, **kwargs)  # warm the page cache
+            latencies = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                hits, _ = search(query, **kwargs)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            results[name] = {'hits': len(hits),
+                             'p50_ms': percentile(latencies, 50) * 1000,
+                             'p95_ms': percentile(latencies, 95) * 1000}
+            db.session.remove()
+    return results
+
+
+def run(args):
+    report = {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'sizes': []}
+    for days in args.days:
+        app = create_app(bench_config())
+        start = time.perf_counter()
+        dataset = build_dataset(app, users=args.users, days=days, stories_per_day=args.stories_per_day,
+                                comments_per_story=args.comments_per_story, likes_per_story=0,
+                                seed=args.seed)
+        build_s = time.perf_counter() - start
+        report['sizes'].append({
+            'days': days, 'stories': dataset['stories'], 'comments': dataset['comments'],
+            'build_s': build_s, 'queries': time_queries(app, args.repeat),
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=lambda v: [int(d) for d in v.split(',')], default=[7, 30, 90],
+                        help='comma-separated corpus sizes, in days of stories')
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--stories-per-day', type=int, default=200)
+    parser.add_argument('--comments-per-story', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Cold-start cost of importing the app package and running create_app().
+
+    python -m bench.startup --runs 15 --output startup.json
+    python -m bench.startup --max-ms 400     # exit 1 if the median regresses past a budget
+
+Each run is a fresh interpreter, so nothing is shared between samples.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from .routes import git_revision
+
+PROBE = r"""
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000,
+                  'create_app_ms': (created - imported) * 1000,
+                  'total_ms': (created - start) * 1000,
+                  'modules': len(__import__('sys').modules)}))
+"""
+
+
+def sample(env):
+    output = subprocess.check_output([sys.executable, '-c', PROBE], env=env,
+                                     cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(runs):
+    env = dict(os.environ)
+    # a throwaway database, so nothing in app.db affects the measurement
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='glyphy-startup-'), 'startup.db')
+    sample(env)  # warm the filesystem cache and .pyc files
+    samples = [sample(env) for _ in range(runs)]
+    report = {'runs': runs, 'revision': git_revision()}
+    for key in ('import_ms', 'create_app_ms', 'total_ms'):
+        values = sorted(s[key] for s in samples)
+        report[key] = {'median': statistics.median(values), 'min': values[0], 'max': values[-1]}
+    report['modules_loaded'] = samples[-1]['modules']
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, help='fail when the median total exceeds this budget')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args.runs)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.max_ms is not None and report['total_ms']['median'] > args.max_ms:
+        print(f"Startup regression: median {report['total_ms']['median']:.1f}ms > budget {args.max_ms:.1f}ms",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
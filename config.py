@@ -8,4 +8,142 @@ class Config:
     # This sets the path for our SQLite database file.
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
-        
\ No newline at end of file
+
+    # url_for('static', ...) resolves through static/dist/manifest.json once `flask assets build` has run
+    ASSETS_FINGERPRINT = os.environ.get('ASSETS_FINGERPRINT', '1') != '0'
+
+    # --- PROFILE PICTURES ---
+    PROFILE_PICS_DIR = os.path.join(basedir, 'app', 'static', 'profile_pics')
+    PROFILE_PIC_MAX_BYTES = int(os.environ.get('PROFILE_PIC_MAX_BYTES', 5 * 1024 * 1024))
+    # checked against the image header before decoding; a small file can declare a huge canvas
+    PROFILE_PIC_MAX_PIXELS = int(os.environ.get('PROFILE_PIC_MAX_PIXELS', 40_000_000))
+    # hard cap on any request body, enforced by Flask before the upload is parsed
+    MAX_CONTENT_LENGTH = PROFILE_PIC_MAX_BYTES + 64 * 1024
+
+    # Local hour at which the daily emoji prompt rolls over to the next day
+    DAILY_PROMPT_ROLLOVER_HOUR = int(os.environ.get('DAILY_PROMPT_ROLLOVER_HOUR', 0))
+
+    # Rows shown on /leaderboard
+    LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 20))
+
+    # Seconds a worker may serve a cached snapshot of the logged-in user
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+
+    # Number of stories per page of the feed / /api/stories
+    FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 20))
+
+    # Items per page of each profile tab (/api/profile/<section>)
+    PROFILE_PAGE_SIZE = int(os.environ.get('PROFILE_PAGE_SIZE', 20))
+
+    # Comments per page on a story's thread
+    COMMENTS_PAGE_SIZE = int(os.environ.get('COMMENTS_PAGE_SIZE', 50))
+
+    # Results per page on /search
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+
+    # --- RANKING (?sort=hot|top, /api/stories/top) ---
+    # a like or comment counts half as much toward "hot" after this many hours;
+    # `flask ranking decay` applies it, so run that every few minutes
+    RANKING_HALF_LIFE_HOURS = float(os.environ.get('RANKING_HALF_LIFE_HOURS', 6))
+    # most stories /api/stories/top returns at once
+    TOP_STORIES_MAX = int(os.environ.get('TOP_STORIES_MAX', 50))
+
+    # --- LIVE UPDATES (story thread SSE / long-poll) ---
+    # how often each worker checks watched stories for writes made by other workers
+    LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 1))
+    # long-poll timeout, and the SSE keep-alive period
+    LIVE_WAIT_TIMEOUT = float(os.environ.get('LIVE_WAIT_TIMEOUT', 25))
+    # an SSE stream is closed after this many seconds; the browser reconnects
+    LIVE_STREAM_DURATION = float(os.environ.get('LIVE_STREAM_DURATION', 300))
+    # open streams/long-polls per worker; past this, clients are told to poll
+    LIVE_MAX_WAITERS = int(os.environ.get('LIVE_MAX_WAITERS', 200))
+
+    # Rendered story-card cache for the feed (per worker)
+    FEED_CACHE_MAX_BYTES = int(os.environ.get('FEED_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+    FEED_CACHE_TTL = int(os.environ.get('FEED_CACHE_TTL', 60))
+
+    # --- EXPORT / ARCHIVE ---
+    # `flask archive` moves days older than this many days into gzipped JSON Lines files
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(basedir, 'archive')
+
+    # --- LOGIN HARDENING ---
+    # token buckets checked before any password hashing: a burst, then N per minute
+    LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', 20))
+    LOGIN_IP_PER_MINUTE = float(os.environ.get('LOGIN_IP_PER_MINUTE', 10))
+    LOGIN_USERNAME_BURST = int(os.environ.get('LOGIN_USERNAME_BURST', 5))
+    LOGIN_USERNAME_PER_MINUTE = float(os.environ.get('LOGIN_USERNAME_PER_MINUTE', 2))
+    # werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000';
+    # older hashes are upgraded on the user's next successful login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # hashes run on this many threads; beyond MAX_PENDING waiting, logins are refused
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+    # --- METRICS ---
+    # /metrics in Prometheus text format; set METRICS_TOKEN to require a bearer token.
+    # Without a token it is served only where METRICS_PUBLIC is on (not in production).
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '1') != '0'
+    # requests slower than this (seconds) are logged with their SQL statements
+    SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0.5))
+
+    # --- MODERATION ---
+    # 'gemini' (needs GEMINI_API_KEY), 'stub' (local classifier for tests/benchmarks) or 'none'
+    MODERATION_BACKEND = os.environ.get('MODERATION_BACKEND', 'gemini')
+    GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+    MODERATION_WORKERS = int(os.environ.get('MODERATION_WORKERS', 2))
+    MODERATION_TIMEOUT = float(os.environ.get('MODERATION_TIMEOUT', 15))
+    MODERATION_MAX_ATTEMPTS = int(os.environ.get('MODERATION_MAX_ATTEMPTS', 5))
+    MODERATION_RETRY_BACKOFF = float(os.environ.get('MODERATION_RETRY_BACKOFF', 5))
+    MODERATION_POLL_INTERVAL = float(os.environ.get('MODERATION_POLL_INTERVAL', 2))
+    # submissions are refused while this many stories are waiting for a verdict
+    MODERATION_MAX_BACKLOG = int(os.environ.get('MODERATION_MAX_BACKLOG', 1000))
+    MODERATION_STUB_LATENCY = float(os.environ.get('MODERATION_STUB_LATENCY', 0))
+    # tiered pipeline: local pre-filter, verdict cache, circuit breaker around the model
+    MODERATION_BLOCKLIST = [w for w in os.environ.get('MODERATION_BLOCKLIST', '').split(',') if w.strip()]
+    MODERATION_PREFILTER_MIN_OVERLAP = int(os.environ.get('MODERATION_PREFILTER_MIN_OVERLAP', 3))
+    MODERATION_VERDICT_CACHE_SIZE = int(os.environ.get('MODERATION_VERDICT_CACHE_SIZE', 10000))
+    MODERATION_LATENCY_BUDGET = float(os.environ.get('MODERATION_LATENCY_BUDGET', 5))
+    MODERATION_ERROR_BUDGET = float(os.environ.get('MODERATION_ERROR_BUDGET', 0.5))
+    MODERATION_BREAKER_COOLDOWN = float(os.environ.get('MODERATION_BREAKER_COOLDOWN', 30))
+    # 'defer' (retry later), 'approve' or 'reject' while the model is degraded; once a job has
+    # used up MODERATION_MAX_ATTEMPTS, 'approve' approves it and anything else rejects it
+    MODERATION_FALLBACK = os.environ.get('MODERATION_FALLBACK', 'defer')
+
+
+class ProductionConfig(Config):
+    """SQLite tuned for concurrent readers and short write transactions.
+
+    Select with APP_PROFILE=production.
+    """
+    # WAL lets readers proceed while a like/comment write holds the lock;
+    # busy_timeout makes writers wait instead of failing with "database is locked".
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 16 * 1024)),
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON',
+    }
+    # route names, latencies and queue depths are not for the public; /metrics
+    # answers 404 unless METRICS_TOKEN is set (or METRICS_PUBLIC=1 opts back in)
+    METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '0') != '0'
+    # one connection per request thread plus the moderation/image workers
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', int(os.environ.get('WORKER_THREADS', 8)) + 4))
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 4)),
+        'pool_timeout': 10,
+        'connect_args': {'timeout': 5, 'check_same_thread': False},
+    }
+
+
+configs = {
+    'default': Config,
+    'production': ProductionConfig,
+}
@@ -1,7 +1,17 @@
+import os
+
 from app import create_app
+from app.moderation import moderation_queue
 # create app
 app = create_app()
 
 if __name__ == '__main__':
+    # development server: make sure the schema exists first
+    from app.migrations import init_db
+    with app.app_context():
+        init_db()
+    # the reloader's parent process only watches files; moderate in the child that serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        moderation_queue.start()
     # run server
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from app import create_app
+from app.cache import daily_prompt_cache, feed_fragment_cache, user_cache
+from app.extensions import db
+from app.migrations import init_db
+
+PASSWORD = 'Passw0rd!'
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        MODERATION_BACKEND = 'stub'
+        MODERATION_RETRY_BACKOFF = 0
+        ARCHIVE_DIR = str(tmp_path / 'archive')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+        LOGIN_IP_BURST = 1000
+
+    # per-worker caches are module globals; don't carry ids over from another test's database
+    for cache in (daily_prompt_cache, feed_fragment_cache, user_cache):
+        cache.clear()
+    app = create_app(TestConfig)
+    with app.app_context():
+        init_db()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def register(app):
+    """register('name') -> a test client signed in as a new user"""
+    def register(username):
+        client = app.test_client()
+        client.post('/auth/login', data={'username': username, 'email': f'{username}@example.com',
+                                         'password': PASSWORD, 'password2': PASSWORD,
+                                         'submit_register': 'Register'})
+        return client
+    return register
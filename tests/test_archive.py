@@ -0,0 +1,182 @@
+from datetime import date, timedelta
+import gzip
+import json
+import os
+
+from sqlalchemy import text
+
+from app.archive import archive_day, archive_index_path, archive_path
+from app.extensions import db
+from app.migrations import init_db
+from app.models import (ArchivedComment, Comments, DailyEmoji, Story, User, MODERATION_APPROVED,
+                        MODERATION_REJECTED)
+
+OLD_DAY = date.today() - timedelta(days=30)
+
+
+def archived_day(app, client):
+    """Archive OLD_DAY, which holds one approved and one rejected story, each with a comment"""
+    with app.app_context():
+        author = User.query.filter_by(username='alice').one()
+        other = User.query.filter_by(username='bob').one()
+        prompt = DailyEmoji(emojis='🚀🐱', date_posted=OLD_DAY)
+        approved = Story(title='Kept', content='Approved story.', author=author, daily_emoji_set=prompt,
+                         moderation_status=MODERATION_APPROVED)
+        rejected = Story(title='Hidden', content='Rejected story.', author=other, daily_emoji_set=prompt,
+                         moderation_status=MODERATION_REJECTED)
+        db.session.add_all([prompt, approved, rejected])
+        db.session.flush()
+        db.session.add_all([Comments(content='Nice.', story_id=approved.id, user_id=author.id),
+                            Comments(content='Hidden too.', story_id=rejected.id, user_id=other.id)])
+        db.session.commit()
+        assert archive_day(prompt, app.config['ARCHIVE_DIR']) == 2
+
+
+def test_export_of_archived_day_reads_archive_file(app, register):
+    alice = register('alice')
+    register('bob')
+    archived_day(app, alice)
+
+    response = alice.get(f'/export/day/{OLD_DAY.isoformat()}')
+    assert response.status_code == 200
+    records = [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+    assert [(r['type'], r.get('title') or r.get('content') or r.get('date')) for r in records] == [
+        ('prompt', OLD_DAY.isoformat()), ('story', 'Kept'), ('comment', 'Nice.')]
+
+
+def test_export_of_archived_day_without_its_file_is_refused(app, register):
+    alice = register('alice')
+    register('bob')
+    archived_day(app, alice)
+    os.remove(archive_path(app.config['ARCHIVE_DIR'], OLD_DAY))
+
+    assert alice.get(f'/export/day/{OLD_DAY.isoformat()}').status_code == 503
+    assert alice.get('/export/me').status_code == 503
+
+
+def export_lines(response):
+    assert response.status_code == 200
+    return [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+
+
+def test_personal_export_finds_comment_on_archived_day(app, register):
+    alice = register('alice')
+    register('bob')
+    with app.app_context():
+        bob = User.query.filter_by(username='bob').one()
+        prompt = DailyEmoji(emojis='🚀🐱', date_posted=OLD_DAY)
+        story = Story(title="Bob's", content='Approved story.', author=bob, daily_emoji_set=prompt,
+                      moderation_status=MODERATION_APPROVED)
+        db.session.add_all([prompt, story])
+        db.session.flush()
+        # alice only commented that day
+        db.session.add(Comments(content='Lovely.', story_id=story.id,
+                                user_id=User.query.filter_by(username='alice').one().id))
+        db.session.commit()
+    # still pending review, but it is alice's own data
+    alice.post('/submit', data={'story_title': 'Today', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        assert archive_day(DailyEmoji.query.filter_by(date_posted=OLD_DAY).one(), app.config['ARCHIVE_DIR']) == 1
+
+    records = export_lines(alice.get('/export/me'))
+    assert [(r['type'], r.get('date') or r.get('title') or r.get('content')) for r in records] == [
+        ('prompt', OLD_DAY.isoformat()), ('comment', 'Lovely.'),
+        ('prompt', date.today().isoformat()), ('story', 'Today')]
+    assert records[-1]['moderation_status'] == 'pending'
+
+
+def test_reindex_restores_comment_index_from_archive_files(app, register):
+    alice = register('alice')
+    register('bob')
+    archived_day(app, alice)
+    with app.app_context():
+        expected = sorted((c.id, c.user_id) for c in ArchivedComment.query)
+        assert len(expected) == 2
+        ArchivedComment.query.delete()
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['archive', '--reindex'])
+    assert f'Indexed 2 comment(s) from {OLD_DAY.isoformat()}.' in result.output
+    with app.app_context():
+        assert sorted((c.id, c.user_id) for c in ArchivedComment.query) == expected
+
+
+def test_archived_ids_are_not_handed_out_again(app, register):
+    alice = register('alice')
+    register('bob')
+    # OLD_DAY holds the newest story and comment when it is archived
+    archived_day(app, alice)
+
+    alice.post('/submit', data={'story_title': 'Today', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        story = Story.query.filter_by(title='Today').one()
+        assert story.id == 3
+        db.session.add(Comments(content='Fresh.', story_id=story.id, user_id=story.user_id))
+        db.session.commit()
+        assert Comments.query.one().id == 3
+    assert 'Approved story.' in alice.get('/story/1').get_data(as_text=True)
+
+
+def test_archived_story_is_read_through_the_index(app, register):
+    alice = register('alice')
+    register('bob')
+    archived_day(app, alice)
+    with open(archive_index_path(app.config['ARCHIVE_DIR'], OLD_DAY)) as f:
+        assert sorted(json.load(f)['stories']) == ['1', '2']
+
+    page = alice.get('/story/1').get_data(as_text=True)
+    assert 'Approved story.' in page and 'Nice.' in page
+    # the whole file still reads as one stream
+    with gzip.open(archive_path(app.config['ARCHIVE_DIR'], OLD_DAY), 'rt', encoding='utf-8') as f:
+        assert [json.loads(line)['type'] for line in f] == ['prompt', 'story', 'story', 'comment', 'comment']
+
+
+def test_reindex_adds_story_index_to_older_archive_files(app, register):
+    alice = register('alice')
+    register('bob')
+    archived_day(app, alice)
+    path = archive_path(app.config['ARCHIVE_DIR'], OLD_DAY)
+    # the single-member layout written before archives were indexed
+    with gzip.open(path, 'rb') as f:
+        content = f.read()
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(content))
+    os.remove(archive_index_path(app.config['ARCHIVE_DIR'], OLD_DAY))
+    assert 'Nice.' in alice.get('/story/1').get_data(as_text=True)
+
+    result = app.test_cli_runner().invoke(args=['archive', '--reindex'])
+    assert f'Indexed the stories in {OLD_DAY.isoformat()}.' in result.output
+    assert os.path.exists(archive_index_path(app.config['ARCHIVE_DIR'], OLD_DAY))
+    assert 'Nice.' in alice.get('/story/1').get_data(as_text=True)
+
+
+def test_upgrade_adds_autoincrement_and_keeps_rows(app, register):
+    alice = register('alice')
+    register('bob')
+    archived_day(app, alice)
+    alice.post('/submit', data={'story_title': 'Today', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        objects = "SELECT name FROM sqlite_master WHERE tbl_name = 'story' ORDER BY name"
+        expected = db.session.execute(text(objects)).scalars().all()
+        indexes = db.session.execute(text(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = 'story' AND type = 'index' AND sql IS NOT NULL")).scalars().all()
+        db.session.commit()
+        with db.engine.begin() as conn:
+            # the story table as created before ids were declared AUTOINCREMENT
+            sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'story'")).scalar()
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            conn.exec_driver_sql(sql.replace('story', 'story_old', 1).replace(' AUTOINCREMENT', ''))
+            conn.exec_driver_sql('INSERT INTO story_old SELECT * FROM story')
+            conn.exec_driver_sql('DROP TABLE story')
+            conn.exec_driver_sql('ALTER TABLE story_old RENAME TO story')
+            conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'story'")
+
+            for sql in indexes:
+                conn.exec_driver_sql(sql)
+        assert init_db() == []
+        assert 'AUTOINCREMENT' in db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'story'")).scalar()
+        # indexes are carried over and the search triggers dropped with the table come back
+        assert db.session.execute(text(objects)).scalars().all() == expected
+        assert [s.title for s in Story.query] == ['Today']
+        # ids 1 and 2 went to the archive, 3 is in use
+        assert db.session.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'story'")).scalar() == 3
@@ -0,0 +1,68 @@
+import gzip
+import os
+
+from flask import url_for
+from PIL import Image
+
+from app import assets
+
+
+def built_static(app, tmp_path):
+    """A small static folder, built and wired into `app`; returns the build report"""
+    static = tmp_path / 'static'
+    (static / 'images').mkdir(parents=True)
+    Image.new('RGB', (8, 8), 'white').save(static / 'images' / 'logo.png')
+    (static / 'site.css').write_text('body { background: url("images/logo.png"); }\n' + 'p { margin: 0; }\n' * 40)
+    report = assets.build_assets(str(static))
+    app.static_folder = str(static)
+    assets.init_app(app)
+    return report
+
+
+def test_build_fingerprints_rewrites_css_and_precompresses(app, tmp_path):
+    report = built_static(app, tmp_path)
+    logo, _ = report['images/logo.png']
+    css, encodings = report['site.css']
+    assert logo.startswith('images/logo.') and css.startswith('site.')
+    assert 'gzip' in encodings
+
+    dist = tmp_path / 'static' / 'dist'
+    assert f'url("{logo}")' in (dist / css).read_text()
+    assert gzip.decompress((dist / (css + '.gz')).read_bytes()) == (dist / css).read_bytes()
+
+
+def test_static_urls_resolve_through_the_manifest(app, tmp_path):
+    report = built_static(app, tmp_path)
+    with app.test_request_context():
+        assert url_for('static', filename='site.css') == f"/static/dist/{report['site.css'][0]}"
+        # not in the manifest: served as before
+        assert url_for('static', filename='missing.css') == '/static/missing.css'
+
+
+def test_dist_files_are_served_in_the_best_accepted_encoding(app, tmp_path):
+    report = built_static(app, tmp_path)
+    css = report['site.css'][0]
+    client = app.test_client()
+
+    response = client.get(f'/static/dist/{css}', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert 'Content-Encoding' not in client.get(f'/static/dist/{css}').headers
+
+    # brotli output is preferred whenever the build could write it
+    (tmp_path / 'static' / 'dist' / (css + '.br')).write_bytes(b'br')
+    response = client.get(f'/static/dist/{css}', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert client.get('/static/dist/site.0000000000.css').status_code == 404
+
+
+def test_prune_keeps_only_current_build(app, tmp_path):
+    report = built_static(app, tmp_path)
+    stale = tmp_path / 'static' / 'dist' / 'site.0123456789.css'
+    stale.write_text('old')
+
+    assert assets.prune_assets(str(tmp_path / 'static')) == 1
+    assert not stale.exists()
+    assert os.path.exists(tmp_path / 'static' / 'dist' / report['site.css'][0])
@@ -0,0 +1,116 @@
+import re
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import text, update
+
+from app import cache
+from app.cache import FragmentCache, feed_fragment_cache, user_cache
+from app.extensions import db
+from app.models import Story, User, UserSnapshot, MODERATION_APPROVED
+
+
+def streak_shown(client):
+    return int(re.search(r'class="streak-count">(\d+)<', client.get('/streak').get_data(as_text=True)).group(1))
+
+
+# --- USER CACHE ---
+def test_cached_user_is_dropped_only_once_the_write_commits(app, register):
+    register('alice')
+    with app.app_context():
+        user = User.query.filter_by(username='alice').one()
+        old = UserSnapshot(user)
+        user.current_streak = 7
+        db.session.flush()
+        # a concurrent request still sees the committed row and caches it between flush and commit
+        user_cache.set(user.id, old)
+        db.session.commit()
+        assert user_cache.get(user.id) is None
+
+
+def test_streak_change_is_visible_right_after_commit(app, register):
+    alice = register('alice')
+    assert streak_shown(alice) == 0
+    alice.post('/submit', data={'story_title': 'Title', 'story_content': 'A story about a rocket and a cat.'})
+    assert streak_shown(alice) == 1
+
+
+def test_signed_in_requests_are_served_from_the_cached_snapshot(app, register, monkeypatch):
+    alice = register('alice')
+    assert streak_shown(alice) == 0
+    with app.app_context():
+        # a write that skips the ORM, e.g. another worker's, is not seen until the entry expires
+        db.session.execute(text("UPDATE user SET current_streak = 5 WHERE username = 'alice'"))
+        db.session.commit()
+    hits = user_cache.hits
+    assert streak_shown(alice) == 0
+    assert user_cache.hits > hits
+
+    later = time.monotonic() + user_cache.ttl + 1
+    monkeypatch.setattr(cache, 'time', SimpleNamespace(monotonic=lambda: later))
+    assert streak_shown(alice) == 5
+
+
+def test_rolled_back_write_keeps_the_cached_user(app, register):
+    register('alice')
+    with app.app_context():
+        user = User.query.filter_by(username='alice').one()
+        user_cache.set(user.id, UserSnapshot(user))
+        user.current_streak = 7
+        db.session.flush()
+        db.session.rollback()
+        assert user_cache.get(user.id) is not None
+
+
+# --- FEED FRAGMENT CACHE ---
+def card_footer(client, story_id):
+    page = client.get('/stories').get_data(as_text=True)
+    card = page[page.index(f'id="story-{story_id}"'):]
+    likes = re.search(r'class="likes-count">(\d+)<', card).group(1)
+    comments = re.search(r'(\d+) comments?', card).group(1)
+    return int(likes), int(comments)
+
+
+def test_feed_cards_are_cached_until_their_story_changes(app, register):
+    alice = register('alice')
+    bob = register('bob')
+    for client in (alice, bob):
+        client.post('/submit', data={'story_title': 'Title', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        db.session.execute(update(Story).values(moderation_status=MODERATION_APPROVED))
+        db.session.commit()
+    feed_fragment_cache.clear()
+
+    assert card_footer(bob, 1) == (0, 0)
+    hits = feed_fragment_cache.hits
+    assert card_footer(bob, 1) == (0, 0)
+    assert feed_fragment_cache.hits == hits + 1
+
+    bob.post('/stories/1/like')
+    assert card_footer(bob, 1) == (1, 0)
+    assert bob.post('/story/1/comment', data={'content': 'Lovely.'}).get_json()['success']
+    assert card_footer(alice, 1) == (1, 1)
+
+
+def test_fragment_invalidation_drops_only_pages_showing_the_story():
+    cache = FragmentCache()
+    cache.set('page1', 'one', 10, story_ids=(1, 2))
+    cache.set('page2', 'two', 10, story_ids=(3,))
+    cache.invalidate_story(2)
+    assert cache.get('page1') is None
+    assert cache.get('page2') == 'two'
+
+
+def test_fragment_cache_evicts_least_recently_used_and_expires():
+    cache = FragmentCache(max_bytes=20, ttl=60)
+    cache.set('a', 'A', 10)
+    cache.set('b', 'B', 10)
+    cache.get('a')
+    cache.set('c', 'C', 10)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == ('A', None, 'C')
+    assert cache.evictions == 1
+
+    cache.ttl = 0
+    cache.set('d', 'D', 1)
+    time.sleep(0.01)
+    assert cache.get('d') is None
@@ -0,0 +1,57 @@
+from sqlalchemy import update
+
+from app.counters import reconcile_counters
+from app.extensions import db
+from app.models import Story, User, MODERATION_APPROVED
+
+
+def counts(app):
+    with app.app_context():
+        users = {u.username: (u.story_count, u.comment_count) for u in User.query}
+        stories = {s.id: s.comment_count for s in Story.query}
+        return users, stories
+
+
+def story_with_comments(app, alice, bob):
+    alice.post('/submit', data={'story_title': 'Title', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        db.session.execute(update(Story).values(moderation_status=MODERATION_APPROVED))
+        db.session.commit()
+    alice.post('/story/1/comment', data={'content': 'Mine.'})
+    bob.post('/story/1/comment', data={'content': "Bob's."})
+    bob.post('/story/1/comment', data={'content': 'Again.'})
+
+
+def test_writes_keep_counters_current(app, register):
+    alice = register('alice')
+    bob = register('bob')
+    story_with_comments(app, alice, bob)
+
+    assert counts(app) == ({'alice': (1, 1), 'bob': (0, 2)}, {1: 3})
+    with app.app_context():
+        assert reconcile_counters(fix=False) == {'story.comment_count': 0, 'user.story_count': 0,
+                                                 'user.comment_count': 0}
+
+
+def test_reconcile_fixes_drifted_counters(app, register):
+    alice = register('alice')
+    bob = register('bob')
+    story_with_comments(app, alice, bob)
+    with app.app_context():
+        # e.g. a backup restored from before the counters were maintained
+        db.session.execute(update(Story).values(comment_count=0))
+        db.session.execute(update(User).where(User.username == 'bob').values(story_count=4, comment_count=7))
+        db.session.commit()
+    drifted = counts(app)
+    runner = app.test_cli_runner()
+
+    output = runner.invoke(args=['counters', 'reconcile', '--dry-run']).output
+    assert 'story.comment_count: 1 row(s) drifted.' in output
+    assert 'user.story_count: 1 row(s) drifted.' in output
+    assert counts(app) == drifted
+
+    output = runner.invoke(args=['counters', 'reconcile']).output
+    assert 'user.comment_count: 1 row(s) fixed.' in output
+    assert counts(app) == ({'alice': (1, 1), 'bob': (0, 2)}, {1: 3})
+    with app.app_context():
+        assert set(reconcile_counters(fix=False).values()) == {0}
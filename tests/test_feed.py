@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app.extensions import db
+from app.models import Story, User, MODERATION_APPROVED
+
+
+def day_of_stories(app, client, count):
+    """`count` approved stories on today's prompt, all with the same timestamp; returns their ids"""
+    client.post('/submit', data={'story_title': 'Mine', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        mine = Story.query.one()
+        for n in range(count - 1):
+            author = User(username=f'writer{n}', email=f'writer{n}@example.com')
+            db.session.add(Story(title=f'Story {n}', content='Another story.', author=author,
+                                 daily_emoji_id=mine.daily_emoji_id))
+        # a burst of stories in the same second: ties are broken by id
+        db.session.execute(update(Story).values(timestamp=datetime(2026, 1, 1, 12, 0),
+                                                moderation_status=MODERATION_APPROVED))
+        db.session.commit()
+        return [story.id for story in Story.query.order_by(Story.id)]
+
+
+def all_pages(client):
+    pages, cursor = [], ''
+    while True:
+        data = client.get('/api/stories', query_string={'cursor': cursor}).get_json()
+        pages.append([story['id'] for story in data['stories']])
+        cursor = data['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def test_pages_split_timestamp_ties_without_gaps_or_repeats(app, register):
+    app.config['FEED_PAGE_SIZE'] = 2
+    alice = register('alice')
+    ids = day_of_stories(app, alice, 5)
+
+    assert all_pages(alice) == [ids[:2:-1], ids[2:0:-1], ids[:1]]
+
+
+def test_last_full_page_has_no_next_cursor(app, register):
+    app.config['FEED_PAGE_SIZE'] = 2
+    alice = register('alice')
+    ids = day_of_stories(app, alice, 4)
+
+    assert all_pages(alice) == [ids[:1:-1], ids[1::-1]]
+
+
+def test_malformed_cursor_is_rejected(app, register):
+    alice = register('alice')
+    day_of_stories(app, alice, 1)
+
+    for cursor in ('nonsense', '2026-01-01T12:00:00_x'):
+        assert alice.get('/api/stories', query_string={'cursor': cursor}).status_code == 400
+    assert alice.get('/api/stories', query_string={'sort': 'top', 'cursor': '-1'}).status_code == 400
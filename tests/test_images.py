@@ -0,0 +1,45 @@
+import io
+
+from PIL import Image
+
+from app.extensions import db
+from app.images import process_profile_pic
+from app.models import User
+
+
+def image_bytes(kind='PNG', size=(8, 8)):
+    out = io.BytesIO()
+    Image.new('RGB', size, 'red').save(out, kind)
+    return out.getvalue()
+
+
+def upload(client, data):
+    return client.post('/profile', data={'profile_pic': (io.BytesIO(data), 'me.gif')},
+                       content_type='multipart/form-data', follow_redirects=True)
+
+
+def test_huge_declared_canvas_is_rejected_before_decoding(app, register):
+    alice = register('alice')
+    bomb = bytearray(image_bytes('GIF'))
+    # a few hundred bytes that claim to be 30000 x 30000
+    bomb[6:10] = (30000).to_bytes(2, 'little') * 2
+    response = upload(alice, bytes(bomb))
+    assert 'at most 40 megapixels' in response.get_data(as_text=True)
+    with app.app_context():
+        assert User.query.one().profile_pic is None
+
+
+def test_processing_failure_is_shown_until_a_picture_succeeds(app, register, tmp_path):
+    app.config['PROFILE_PICS_DIR'] = str(tmp_path / 'pics')
+    alice = register('alice')
+    with app.app_context():
+        user_id = User.query.one().id
+    # passes the signature check but can't be decoded
+    process_profile_pic(app, user_id, io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'\x00' * 64))
+    assert "couldn't be used: That image could not be processed." in alice.get('/profile').get_data(as_text=True)
+
+    process_profile_pic(app, user_id, io.BytesIO(image_bytes()))
+    assert "couldn't be used" not in alice.get('/profile').get_data(as_text=True)
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        assert user.profile_pic.endswith('_avatar.webp') and user.profile_pic_error is None
@@ -0,0 +1,56 @@
+from sqlalchemy import false, update
+
+from app import main_views
+from app.extensions import db
+from app.models import Comments, CommentLike, Story, StoryLike, User, MODERATION_APPROVED
+
+
+def approved_story(app, client):
+    client.post('/submit', data={'story_title': 'Title', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        db.session.execute(update(Story).values(moderation_status=MODERATION_APPROVED))
+        db.session.commit()
+        return Story.query.one().id
+
+
+def test_story_like_toggles_and_counts_each_user_once(app, register):
+    alice = register('alice')
+    bob = register('bob')
+    story_id = approved_story(app, alice)
+
+    assert alice.post(f'/stories/{story_id}/like').get_json() == {'likes': 1, 'liked': True}
+    assert bob.post(f'/stories/{story_id}/like').get_json() == {'likes': 2, 'liked': True}
+    assert alice.post(f'/stories/{story_id}/like').get_json() == {'likes': 1, 'liked': False}
+    assert alice.post(f'/stories/{story_id}/like').get_json() == {'likes': 2, 'liked': True}
+    with app.app_context():
+        story = db.session.get(Story, story_id)
+        assert story.likes == StoryLike.query.count() == 2
+        assert story.top_score == 2
+
+
+def test_comment_like_toggles(app, register):
+    alice = register('alice')
+    story_id = approved_story(app, alice)
+    with app.app_context():
+        comment = Comments(content='Nice.', story_id=story_id, user_id=User.query.one().id)
+        db.session.add(comment)
+        db.session.commit()
+        comment_id = comment.id
+
+    assert alice.post(f'/comment/{comment_id}/like').get_json() == {'likes': 1, 'liked': True}
+    assert alice.post(f'/comment/{comment_id}/like').get_json() == {'likes': 0, 'liked': False}
+    with app.app_context():
+        assert CommentLike.query.count() == 0
+
+
+def test_like_inserted_by_a_concurrent_request_is_not_counted_twice(app, register, monkeypatch):
+    alice = register('alice')
+    story_id = approved_story(app, alice)
+    assert alice.post(f'/stories/{story_id}/like').get_json()['likes'] == 1
+    real_delete = main_views.delete
+    # a second request from alice inserted its like after this one found nothing to remove
+    monkeypatch.setattr(main_views, 'delete', lambda model: real_delete(model).where(false()))
+
+    assert alice.post(f'/stories/{story_id}/like').get_json() == {'likes': 1, 'liked': True}
+    with app.app_context():
+        assert db.session.get(Story, story_id).likes == StoryLike.query.count() == 1
@@ -0,0 +1,90 @@
+import threading
+import time
+
+from sqlalchemy import update
+
+from app.extensions import db
+from app.live import bump_live_version, story_watcher
+from app.models import Comments, Story, User, MODERATION_APPROVED
+
+
+def watched_story(app, alice):
+    alice.post('/submit', data={'story_title': 'Title', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        db.session.execute(update(Story).values(moderation_status=MODERATION_APPROVED))
+        db.session.commit()
+    alice.post('/story/1/comment', data={'content': 'First.'})
+    return alice.get('/story/1/updates', query_string={'since': 0}).get_json()['version']
+
+
+def long_poll_in_background(client, since):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(
+        client.get('/story/1/updates', query_string={'since': since}).get_json()))
+    thread.start()
+    return thread, result
+
+
+def test_long_poll_answers_at_once_with_changes_since_version(app, register):
+    alice = register('alice')
+    version = watched_story(app, alice)
+    alice.post('/story/1/comment', data={'content': 'Second.'})
+
+    changes = alice.get('/story/1/updates', query_string={'since': version}).get_json()
+    assert changes['version'] == version + 1
+    assert [c['content'] for c in changes['comments']] == ['Second.']
+
+
+def test_long_poll_wakes_on_a_comment_from_this_worker(app, register):
+    app.config['LIVE_WAIT_TIMEOUT'] = 5
+    alice = register('alice')
+    bob = register('bob')
+    version = watched_story(app, alice)
+
+    thread, result = long_poll_in_background(alice, version)
+    time.sleep(0.1)
+    started = time.monotonic()
+    bob.post('/story/1/comment', data={'content': "Bob's."})
+    thread.join(5)
+    # woken by the write itself, well before the watcher's next poll of the database
+    assert time.monotonic() - started < 0.5
+    assert [c['content'] for c in result['comments']] == ["Bob's."]
+
+
+def test_long_poll_sees_a_change_made_by_another_worker(app, register, monkeypatch):
+    app.config['LIVE_WAIT_TIMEOUT'] = 5
+    monkeypatch.setattr(story_watcher, 'interval', 0.05)
+    alice = register('alice')
+    version = watched_story(app, alice)
+
+    thread, result = long_poll_in_background(alice, version)
+    time.sleep(0.1)
+    with app.app_context():
+        # written without notifying this worker's watcher
+        comment = Comments(content='Elsewhere.', story_id=1, user_id=User.query.one().id,
+                           live_version=bump_live_version(1))
+        db.session.add(comment)
+        db.session.commit()
+    thread.join(5)
+    assert [c['content'] for c in result['comments']] == ['Elsewhere.']
+
+
+def test_long_poll_times_out_without_changes(app, register):
+    app.config['LIVE_WAIT_TIMEOUT'] = 0.1
+    alice = register('alice')
+    version = watched_story(app, alice)
+
+    changes = alice.get('/story/1/updates', query_string={'since': version}).get_json()
+    assert changes['version'] == version and changes['comments'] == []
+
+
+def test_event_stream_resumes_from_last_event_id(app, register):
+    app.config['LIVE_STREAM_DURATION'] = 0
+    alice = register('alice')
+    version = watched_story(app, alice)
+
+    body = alice.get('/story/1/events').get_data(as_text=True)
+    assert body.startswith(f'id: {version}\ndata: ')
+    assert '"First."' in body and body.endswith('retry: 1000\n\n')
+    body = alice.get('/story/1/events', headers={'Last-Event-ID': str(version)}).get_data(as_text=True)
+    assert body == 'retry: 1000\n\n'
@@ -0,0 +1,22 @@
+from config import ProductionConfig
+
+
+def test_metrics_hidden_without_token_unless_public(app):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+    app.config['METRICS_PUBLIC'] = False
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_token_is_required_when_set(app):
+    app.config.update(METRICS_PUBLIC=False, METRICS_TOKEN='s3cret')
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert 'glyphy_' in response.get_data(as_text=True)
+
+
+def test_production_does_not_serve_metrics_publicly():
+    assert ProductionConfig.METRICS_PUBLIC is False
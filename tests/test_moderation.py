@@ -0,0 +1,321 @@
+from datetime import datetime, timedelta
+import threading
+import time
+
+import pytest
+
+from app.extensions import db
+from app.models import ModerationJob, Story, MODERATION_APPROVED, MODERATION_PENDING, MODERATION_REJECTED
+from app.moderation import (CircuitBreaker, CircuitOpenError, LocalPreFilter, ModerationPipeline,
+                            StubModerationBackend, VerdictCache, moderation_queue)
+
+
+class RecordingBackend:
+    """Remote stand-in that records each call and approves unless told otherwise"""
+    name = 'recording'
+
+    def __init__(self, verdict=True, error=None):
+        self.verdict = verdict
+        self.error = error
+        self.calls = []
+
+    def classify(self, emojis, content, timeout=None, on_topic=False):
+        self.calls.append((emojis, content, on_topic))
+        if self.error is not None:
+            raise self.error
+        return self.verdict
+
+
+def submit(client, content='A story about a rocket and a cat.'):
+    return client.post('/submit', data={'story_title': 'Title', 'story_content': content})
+
+
+# --- QUEUE ---
+def test_claim_leases_job_until_lease_expires(app, register):
+    submit(register('alice'))
+    with app.app_context():
+        first = moderation_queue.claim(10)
+        assert len(first) == 1
+        assert moderation_queue.claim(10) == []
+        # a crashed worker's lease runs out and the job is claimable again
+        job = db.session.get(ModerationJob, first[0])
+        job.locked_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert moderation_queue.claim(10) == first
+
+
+def test_failed_classification_is_retried_then_given_up(app, register):
+    app.config['MODERATION_MAX_ATTEMPTS'] = 2
+    submit(register('alice'))
+    with app.app_context():
+        moderation_queue.backend = ModerationPipeline(RecordingBackend(error=RuntimeError('model down')))
+        job_id, = moderation_queue.claim(1)
+        moderation_queue.process(job_id)
+        job = db.session.get(ModerationJob, job_id)
+        assert (job.attempts, job.locked_until, job.last_error) == (1, None, 'model down')
+        assert job.next_attempt_at is not None
+
+        assert moderation_queue.claim(1) == [job_id]
+        moderation_queue.process(job_id)
+        job = db.session.get(ModerationJob, job_id)
+        assert job.attempts == 2
+        assert job.next_attempt_at is None
+        assert moderation_queue.claim(1) == []
+        # out of attempts with the default 'defer' fallback: rejected, not left pending forever
+        assert db.session.get(Story, job.story_id).moderation_status == MODERATION_REJECTED
+
+        # `flask moderation requeue` puts it back in the queue
+        assert moderation_queue.requeue() == 1
+        assert db.session.get(Story, job.story_id).moderation_status == MODERATION_PENDING
+        moderation_queue.backend = ModerationPipeline(RecordingBackend())
+        assert moderation_queue.drain() == 1
+        assert db.session.get(Story, job.story_id).moderation_status == MODERATION_APPROVED
+        assert ModerationJob.query.count() == 0
+
+
+def test_exhausted_job_takes_approve_fallback(app, register):
+    app.config['MODERATION_MAX_ATTEMPTS'] = 1
+    app.config['MODERATION_FALLBACK'] = 'approve'
+    submit(register('alice'))
+    with app.app_context():
+        moderation_queue.backend = ModerationPipeline(RecordingBackend(error=RuntimeError('model down')))
+        assert moderation_queue.drain() == 1
+        assert Story.query.one().moderation_status == MODERATION_APPROVED
+        assert ModerationJob.query.count() == 0
+        assert moderation_queue.requeue() == 0
+
+
+def test_requeue_command_reports_count(app, register):
+    app.config['MODERATION_MAX_ATTEMPTS'] = 1
+    submit(register('alice'))
+    with app.app_context():
+        moderation_queue.backend = ModerationPipeline(RecordingBackend(error=RuntimeError('model down')))
+        moderation_queue.drain()
+    result = app.test_cli_runner().invoke(args=['moderation', 'requeue'])
+    assert result.output == 'Requeued 1 story for moderation.\n'
+
+
+def test_verdict_is_recorded_and_job_removed(app, register):
+    submit(register('alice'))
+    submit(register('bob'), 'An explicit story about a rocket.')
+    with app.app_context():
+        assert moderation_queue.drain() == 2
+        statuses = [story.moderation_status for story in Story.query.order_by(Story.id)]
+        assert statuses == [MODERATION_APPROVED, MODERATION_REJECTED]
+        assert ModerationJob.query.count() == 0
+
+
+def test_edit_during_classification_keeps_job_pending(app, register):
+    alice = register('alice')
+    submit(alice)
+
+    class SlowBackend(StubModerationBackend):
+        def __init__(self):
+            super().__init__()
+            self.started = threading.Event()
+            self.release = threading.Event()
+
+        def classify(self, *args, **kwargs):
+            self.started.set()
+            self.release.wait(5)
+            return super().classify(*args, **kwargs)
+
+    backend = SlowBackend()
+    with app.app_context():
+        moderation_queue.backend = ModerationPipeline(backend)
+        job_id, = moderation_queue.claim(1)
+
+    def work():
+        with app.app_context():
+            moderation_queue.process(job_id)
+
+    worker = threading.Thread(target=work)
+    worker.start()
+    assert backend.started.wait(5)
+    alice.post('/stories/1/edit', json={'title': 'Title', 'content': 'Now an explicit story.'})
+    backend.release.set()
+    worker.join(5)
+
+    with app.app_context():
+        # the verdict on the old text was discarded; the new text still needs review
+        assert db.session.get(Story, 1).moderation_status == MODERATION_PENDING
+        assert ModerationJob.query.count() == 1
+        moderation_queue.drain()
+        assert db.session.get(Story, 1).moderation_status == MODERATION_REJECTED
+
+
+def test_submissions_refused_when_backlog_is_full(app, register):
+    app.config['MODERATION_MAX_BACKLOG'] = 1
+    submit(register('alice'))
+    response = submit(register('bob'))
+    assert response.status_code == 302
+    assert response.location.endswith('/dashboard')
+    with app.app_context():
+        assert Story.query.count() == 1
+
+
+
+def test_workers_start_once_per_process(app, register):
+    app.config['MODERATION_POLL_INTERVAL'] = 0.01
+    assert moderation_queue.start()
+    try:
+        assert not moderation_queue.start()
+        inherited = moderation_queue._dispatcher
+        # as if this process had been forked from the one that started the threads
+        moderation_queue._pid = -1
+        assert moderation_queue.start()
+        assert moderation_queue._dispatcher is not inherited
+
+        submit(register('alice'))
+        deadline = time.monotonic() + 5
+        with app.app_context():
+            while Story.query.one().moderation_status == MODERATION_PENDING and time.monotonic() < deadline:
+                db.session.rollback()
+                time.sleep(0.01)
+            assert Story.query.one().moderation_status == MODERATION_APPROVED
+    finally:
+        moderation_queue.stop()
+        inherited.join(5)
+
+
+# --- PIPELINE ---
+def test_circuit_opens_then_half_opens_for_one_trial():
+    breaker = CircuitBreaker(error_budget=0.5, min_calls=2, cooldown=0.05)
+
+    def fail():
+        raise RuntimeError('down')
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            breaker.call(fail)
+    assert breaker.state == 'open'
+    assert breaker.trips == 1
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: True)
+
+    time.sleep(0.06)
+    assert breaker.state == 'half-open'
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    # a failed trial re-opens the circuit for another cooldown
+    assert breaker.state == 'open'
+
+    time.sleep(0.06)
+    assert breaker.call(lambda: True) is True
+    assert breaker.state == 'closed'
+
+
+def test_slow_calls_count_against_the_breaker():
+    breaker = CircuitBreaker(latency_budget=0.0, error_budget=0.5, min_calls=2, cooldown=60)
+    breaker.call(time.sleep, 0.001)
+    breaker.call(time.sleep, 0.001)
+    assert breaker.state == 'open'
+
+
+def test_open_circuit_uses_fallback():
+    remote = RecordingBackend(error=RuntimeError('down'))
+    pipeline = ModerationPipeline(remote, breaker=CircuitBreaker(min_calls=2, cooldown=60), fallback='reject')
+    # one failure with a healthy circuit is raised, so the job retries
+    with pytest.raises(RuntimeError):
+        pipeline.classify('🚀 🐱', 'first story')
+    # the second trips the breaker; from then on the fallback answers without calling the model
+    assert pipeline.classify('🚀 🐱', 'second story') is False
+    assert pipeline.classify('🚀 🐱', 'third story') is False
+    assert len(remote.calls) == 2
+    assert pipeline.stats()['counts']['fallback'] == 2
+
+
+def test_model_verdicts_are_cached():
+    remote = RecordingBackend(verdict=False)
+    pipeline = ModerationPipeline(remote)
+    assert pipeline.classify('🚀 🐱', 'Some story text') is False
+    # same emoji set and same text up to case and whitespace
+    assert pipeline.classify('🐱 🚀', '  some   STORY text ') is False
+    assert len(remote.calls) == 1
+    assert pipeline.stats()['counts'] == {'total': 2, 'prefilter': 0, 'cache': 1, 'remote': 1, 'fallback': 0}
+
+
+# --- VISIBILITY ---
+def test_unapproved_story_is_visible_only_to_its_author(app, register):
+    alice, bob = register('alice'), register('bob')
+    submit(alice, 'An explicit story about a rocket.')
+    with app.app_context():
+        moderation_queue.drain()
+        assert db.session.get(Story, 1).moderation_status == MODERATION_REJECTED
+
+    assert alice.get('/story/1').status_code == 200
+    assert bob.get('/story/1').status_code == 404
+    assert bob.get('/story/1/comments').status_code == 404
+    assert bob.get('/story/1/updates?since=0').status_code == 404
+    assert bob.get('/story/1/events').status_code == 404
+    assert bob.post('/story/1/comment', data={'content': 'hi'}).status_code == 404
+    assert bob.post('/stories/1/like').status_code == 404
+    with app.app_context():
+        assert db.session.get(Story, 1).likes == 0
+        assert db.session.get(Story, 1).comment_count == 0
+
+
+def test_approved_story_is_visible_to_everyone(app, register):
+    alice, bob = register('alice'), register('bob')
+    submit(alice)
+    with app.app_context():
+        moderation_queue.drain()
+    assert bob.get('/story/1').status_code == 200
+    assert bob.post('/stories/1/like').get_json() == {'likes': 1, 'liked': True}
+
+
+# --- PRE-FILTER ---
+def test_on_topic_abusive_story_still_reaches_the_model():
+    remote = RecordingBackend(verdict=False)
+    pipeline = ModerationPipeline(remote, prefilter=LocalPreFilter(min_emoji_overlap=3))
+    content = '😀🐶🍕 some explicit hate speech here'
+    assert pipeline.classify('😀 🐶 🍕', content) is False
+    # overlap only spares the model the relevance question
+    assert remote.calls == [('😀 🐶 🍕', content, True)]
+    assert pipeline.stats()['counts']['prefilter'] == 0
+
+
+def test_prefilter_never_approves():
+    prefilter = LocalPreFilter(min_emoji_overlap=1)
+    assert prefilter.classify('😀 🐶 🍕', '😀🐶🍕 a story using every emoji') is None
+
+
+def test_prefilter_rejects_blocklisted_words_locally():
+    remote = RecordingBackend()
+    pipeline = ModerationPipeline(remote, prefilter=LocalPreFilter(blocklist=['badword']))
+    assert pipeline.classify('😀 🐶', 'A story with a BadWord in it') is False
+    assert pipeline.classify('😀 🐶', 'A story about badwordsmithing') is True  # whole words only
+    assert len(remote.calls) == 1
+    assert pipeline.stats()['counts']['prefilter'] == 1
+
+
+def test_emoji_overlap_below_threshold_asks_about_relevance():
+    prefilter = LocalPreFilter(min_emoji_overlap=3)
+    assert prefilter.is_on_topic('😀 🐶 🍕', '😀🐶 two of three') is False
+    assert prefilter.is_on_topic('😀 🐶 🍕', '😀🐶🍕 all three') is True
+    assert LocalPreFilter(min_emoji_overlap=0).is_on_topic('😀 🐶 🍕', '😀🐶🍕') is False
+
+
+# --- VERDICT CACHE ---
+def test_verdict_cache_key_ignores_emoji_order_case_and_spacing():
+    assert VerdictCache.key('😀 🐶', 'A  Story\ntext') == VerdictCache.key('🐶 😀', 'a story text')
+    assert VerdictCache.key('😀 🐶', 'a story') != VerdictCache.key('😀 🍕', 'a story')
+    assert VerdictCache.key('😀 🐶', 'a story') != VerdictCache.key('😀 🐶', 'another story')
+
+
+def test_verdict_cache_evicts_least_recently_used():
+    cache = VerdictCache(max_entries=2)
+    cache.set('a', True)
+    cache.set('b', False)
+    assert cache.get('a') is True  # 'a' is now the most recent
+    cache.set('c', True)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (True, True)
+
+
+def test_cached_rejection_is_not_mistaken_for_a_miss():
+    remote = RecordingBackend(verdict=False)
+    pipeline = ModerationPipeline(remote, cache=VerdictCache())
+    pipeline.classify('😀', 'rejected text')
+    pipeline.classify('😀', 'rejected text')
+    assert len(remote.calls) == 1
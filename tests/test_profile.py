@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app.extensions import db
+from app.models import Comments, Story, MODERATION_APPROVED
+
+
+def section_pages(client, section):
+    pages, cursor = [], ''
+    while True:
+        data = client.get(f'/api/profile/{section}', query_string={'cursor': cursor}).get_json()
+        pages.append([item['id'] for item in data['items']])
+        cursor = data['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def commented_story(app, alice, bob):
+    alice.post('/submit', data={'story_title': 'Title', 'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        db.session.execute(update(Story).values(moderation_status=MODERATION_APPROVED))
+        db.session.commit()
+    for n in range(5):
+        alice.post('/story/1/comment', data={'content': f'Comment {n}'})
+    bob.post('/story/1/comment', data={'content': "Bob's"})
+    bob.post('/stories/1/like')
+
+
+def test_comment_tab_pages_through_own_comments_newest_first(app, register):
+    app.config['PROFILE_PAGE_SIZE'] = 2
+    alice = register('alice')
+    bob = register('bob')
+    commented_story(app, alice, bob)
+    with app.app_context():
+        # posted within the same second: the id breaks the tie
+        db.session.execute(update(Comments).values(timestamp=datetime(2026, 1, 1, 12, 0)))
+        db.session.commit()
+
+    assert section_pages(alice, 'comments') == [[5, 4], [3, 2], [1]]
+    assert section_pages(bob, 'comments') == [[6]]
+
+
+def test_profile_counts_and_sections(app, register):
+    alice = register('alice')
+    bob = register('bob')
+    commented_story(app, alice, bob)
+
+    page = bob.get('/profile').get_data(as_text=True)
+    assert 'Posts (0)' in page and 'Comments (1)' in page and 'Likes (1)' in page
+    assert section_pages(bob, 'likes') == [[1]]
+    assert section_pages(alice, 'posts') == [[1]]
+    assert alice.get('/api/profile/nonsense').status_code == 404
+    assert alice.get('/api/profile/posts', query_string={'cursor': 'nonsense'}).status_code == 400
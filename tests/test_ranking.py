@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+import re
+
+from sqlalchemy import update
+
+from app.extensions import db
+from app.models import Story, MODERATION_APPROVED
+from app.ranking import decay_hot_scores
+
+
+def titles(response):
+    return re.findall(r'Story by (\w+)', response.get_data(as_text=True))
+
+
+def test_liked_story_climbs_to_first_page_of_score_sorts(app, register):
+    app.config['FEED_PAGE_SIZE'] = 1
+    clients = {}
+    for name in ('alice', 'bob', 'carol'):
+        clients[name] = register(name)
+        clients[name].post('/submit', data={'story_title': f'Story by {name}',
+                                             'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        db.session.execute(update(Story).values(moderation_status=MODERATION_APPROVED))
+        db.session.commit()
+
+    carol = clients['carol']
+    for sort in ('top', 'hot'):
+        # equal scores tie-break on id, newest first
+        assert titles(carol.get(f'/stories?sort={sort}')) == ['carol']
+    # alice's story is on the last page; the like has to reorder the first one
+    assert clients['bob'].post('/stories/1/like').status_code == 200
+    for sort in ('top', 'hot'):
+        assert titles(carol.get(f'/stories?sort={sort}')) == ['alice']
+
+
+def test_hot_pages_survive_decay_between_requests(app, register):
+    app.config['FEED_PAGE_SIZE'] = 1
+    clients = {}
+    for name in ('alice', 'bob', 'carol'):
+        clients[name] = register(name)
+        clients[name].post('/submit', data={'story_title': f'Story by {name}',
+                                             'story_content': 'A story about a rocket and a cat.'})
+    with app.app_context():
+        db.session.execute(update(Story).values(moderation_status=MODERATION_APPROVED))
+        for story_id, score in ((1, 8.0), (2, 4.0), (3, 2.0)):
+            db.session.execute(update(Story).where(Story.id == story_id).values(hot_score=score))
+        db.session.commit()
+        start = datetime(2026, 1, 1)
+        decay_hot_scores(start)
+
+    carol = clients['carol']
+    seen, cursor = [], None
+    for page in range(3):
+        data = carol.get('/api/stories', query_string={'sort': 'hot', 'cursor': cursor or ''}).get_json()
+        seen += [story['id'] for story in data['stories']]
+        cursor = data['next_cursor']
+        with app.app_context():
+            # every score halves between two page loads
+            decay_hot_scores(start + timedelta(hours=app.config['RANKING_HALF_LIFE_HOURS'] * (page + 1)))
+    assert seen == [1, 2, 3]
+    assert cursor is None
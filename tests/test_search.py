@@ -0,0 +1,88 @@
+from datetime import date, timedelta
+
+from app.extensions import db
+from app.models import Comments, DailyEmoji, Story, User, MODERATION_APPROVED, MODERATION_PENDING
+from app.search import highlight, rebuild_search_index, search
+
+
+def story_ids(query, **filters):
+    return [(hit.kind, hit.story_id) for hit in search(query, **filters)[0]]
+
+
+def seeded(app):
+    """Two users' approved stories on two days, a pending story and a comment; returns the ids"""
+    with app.app_context():
+        alice = User(username='alice', email='alice@example.com')
+        bob = User(username='bob', email='bob@example.com')
+        old = DailyEmoji(emojis='🚀 🐱', date_posted=date.today() - timedelta(days=1))
+        new = DailyEmoji(emojis='🌙 🐶', date_posted=date.today())
+        stories = [
+            Story(title='Rocket garden', content='Seeds in orbit.', author=alice, daily_emoji_set=old,
+                  moderation_status=MODERATION_APPROVED),
+            Story(title='Quiet night', content='A rocket hums past the moon.', author=bob, daily_emoji_set=new,
+                  moderation_status=MODERATION_APPROVED),
+            Story(title='Rocket draft', content='Still under review.', author=alice, daily_emoji_set=new,
+                  moderation_status=MODERATION_PENDING),
+        ]
+        db.session.add_all(stories)
+        db.session.flush()
+        db.session.add(Comments(content='Rockets <3 gardens', story_id=stories[1].id, user_id=alice.id))
+        db.session.commit()
+        return {'alice': alice.id, 'old': old.id, 'garden': stories[0].id, 'night': stories[1].id}
+
+
+def test_triggers_keep_the_index_in_step_with_writes(app):
+    ids = seeded(app)
+    with app.app_context():
+        assert story_ids('orbit') == [('story', ids['garden'])]
+        story = db.session.get(Story, ids['garden'])
+        story.content = 'Seeds in a greenhouse.'
+        db.session.commit()
+        assert story_ids('orbit') == []
+        assert story_ids('greenhouse') == [('story', ids['garden'])]
+
+        assert story_ids('gardens') == [('story', ids['garden']), ('comment', ids['night'])]
+        Comments.query.delete()
+        db.session.commit()
+        assert story_ids('gardens') == [('story', ids['garden'])]
+
+
+def test_title_hits_rank_first_and_unapproved_stories_are_hidden(app):
+    ids = seeded(app)
+    with app.app_context():
+        # the last word matches as a prefix; the pending 'Rocket draft' is left out
+        hits = story_ids('rock')
+        assert hits[0] == ('story', ids['garden'])
+        assert sorted(hits[1:]) == [('comment', ids['night']), ('story', ids['night'])]
+
+
+def test_filters_by_day_and_author(app):
+    ids = seeded(app)
+    with app.app_context():
+        assert story_ids('rocket', daily_emoji_id=ids['old']) == [('story', ids['garden'])]
+        assert sorted(story_ids('rocket', exclude_daily_emoji_id=ids['old'])) == [('comment', ids['night']),
+                                                                                  ('story', ids['night'])]
+        assert story_ids('rocket', author_id=ids['alice']) == [('story', ids['garden']), ('comment', ids['night'])]
+        assert story_ids('?!') == []
+
+
+def test_rebuild_matches_trigger_maintained_index(app):
+    ids = seeded(app)
+    with app.app_context():
+        before = story_ids('rocket')
+        assert rebuild_search_index() == (3, 1)
+        assert story_ids('rocket') == before
+
+
+def test_snippets_are_escaped_before_highlighting():
+    assert str(highlight('\x02Rockets\x03 <3 gardens')) == '<mark>Rockets</mark> &lt;3 gardens'
+
+
+def test_search_page_hides_today_until_you_have_posted(app, register):
+    seeded(app)
+    carol = register('carol')
+
+    page = carol.get('/search', query_string={'q': 'rocket'}).get_data(as_text=True)
+    assert 'Rocket garden' in page and 'Quiet night' not in page
+    carol.post('/submit', data={'story_title': 'Mine', 'story_content': 'A story about a rocket and a cat.'})
+    assert 'Quiet night' in carol.get('/search', query_string={'q': 'rocket'}).get_data(as_text=True)
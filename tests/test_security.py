@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from app import security
+from app.security import HasherBusy, PasswordHasher, password_hasher
+
+
+def blocking_hasher(max_pending, timeout=5):
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1, max_pending=max_pending, timeout=timeout)
+    gate = threading.Event()
+    return hasher, gate
+
+
+def test_pending_slots_bound_the_work_even_after_callers_time_out():
+    hasher, gate = blocking_hasher(max_pending=2, timeout=0.05)
+    ran = []
+
+    def slow_hash():
+        ran.append(1)
+        gate.wait(5)
+
+    for _ in range(5):
+        with pytest.raises(HasherBusy):
+            hasher._run(slow_hash)
+    gate.set()
+    hasher.timeout = 5
+    assert hasher._run(lambda: 'done') == 'done'
+    # timed-out callers never leave more than max_pending hashes behind to run
+    assert len(ran) <= 2
+
+
+def test_timeout_becomes_hasher_busy():
+    hasher, gate = blocking_hasher(max_pending=4, timeout=0.05)
+    with pytest.raises(HasherBusy):
+        hasher._run(gate.wait, 5)
+    gate.set()
+
+
+def test_slow_hash_returns_503_not_500(app, register, monkeypatch):
+    register('alice')
+    client = app.test_client()
+    gate = threading.Event()
+    monkeypatch.setattr(password_hasher, 'timeout', 0.05)
+    monkeypatch.setattr('app.security.check_password_hash', lambda *args: gate.wait(5))
+    response = client.post('/auth/login', data={'username': 'alice', 'password': 'Passw0rd!',
+                                                'submit_login': 'Sign In'})
+    gate.set()
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+def test_needs_rehash_hashes_on_the_pool(monkeypatch):
+    threads = []
+    real = security.generate_password_hash
+
+    def recording(password, method):
+        threads.append(threading.current_thread().name)
+        return real(password, method)
+
+    monkeypatch.setattr(security, 'generate_password_hash', recording)
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+    assert not hasher.needs_rehash(real('pw', 'pbkdf2:sha256:1000'))
+    assert hasher.needs_rehash(real('pw', 'pbkdf2:sha256:2000'))
+    assert len(threads) == 1 and threads[0].startswith('hasher')
+
+
+# --- LOGIN THROTTLING ---
+def login(client, username, password=None):
+    data = {'username': username, 'submit_login': 'Sign In'}
+    if password is not None:
+        data['password'] = password
+    return client.post('/auth/login', data=data)
+
+
+def test_invalid_posts_do_not_lock_out_the_username(app, register):
+    register('alice').get('/auth/logout')
+    attacker = app.test_client()
+    for _ in range(app.config['LOGIN_USERNAME_BURST'] * 2):
+        assert login(attacker, 'alice').status_code == 200
+    assert login(app.test_client(), 'alice', 'Passw0rd!').status_code == 302
+
+
+def test_wrong_passwords_lock_out_the_username(app, register):
+    register('alice').get('/auth/logout')
+    client = app.test_client()
+    for _ in range(app.config['LOGIN_USERNAME_BURST']):
+        assert login(client, 'alice', 'wrong password').status_code == 200
+    response = login(app.test_client(), 'alice', 'Passw0rd!')
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
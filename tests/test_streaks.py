@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+
+from app.cache import daily_prompt_cache, user_cache
+from app.extensions import db
+from app.models import DailyEmoji, StreakState, User
+
+
+def broken_streak(app, today):
+    """Give alice a streak broken two days ago, as of yesterday's reset"""
+    with app.app_context():
+        user = User.query.filter_by(username='alice').one()
+        user.current_streak = 3
+        user.last_story_date = today - timedelta(days=3)
+        db.session.merge(StreakState(id=1, reset_for=today - timedelta(days=1)))
+        db.session.commit()
+
+
+def test_rollover_resets_streaks_when_another_worker_created_the_day(app, register):
+    alice = register('alice')
+    today = date.today()
+    broken_streak(app, today)
+    # the worker that inserted today's prompt row died before resetting anything
+    with app.app_context():
+        if DailyEmoji.query.filter_by(date_posted=today).first() is None:
+            db.session.add(DailyEmoji(emojis='🚀 🐱', date_posted=today))
+            db.session.commit()
+    daily_prompt_cache.clear()
+    user_cache.clear()
+
+    assert alice.get('/dashboard').status_code == 200
+    with app.app_context():
+        assert User.query.filter_by(username='alice').one().current_streak == 0
+        assert db.session.get(StreakState, 1).reset_for == today
+
+
+def test_streak_reset_runs_once_per_day(app, register):
+    register('alice')
+    today = date.today()
+    broken_streak(app, today)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['streaks', 'reset'])
+    assert 'Reset 1 broken streak(s)' in result.output
+    assert 'already reset' in runner.invoke(args=['streaks', 'reset']).output
+    with app.app_context():
+        assert User.reset_streaks_once(today) is None
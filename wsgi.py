@@ -0,0 +1,19 @@
+"""Production entry point: `gunicorn wsgi:app`.
+
+Unlike `flask --app run.py ...`, this runs the moderation workers inside each
+server process. They start on the process's first request rather than at
+import, so they also run under `gunicorn --preload`, where the app is
+imported in the master and threads started there would not survive the fork
+into the workers. Any multi-process or threaded WSGI server works the same
+way. To moderate in a separate `flask moderation work` process instead, set
+MODERATION_WORKERS=0 for the web server.
+"""
+from app import create_app
+from app.moderation import moderation_queue
+
+app = create_app()
+
+
+@app.before_request
+def start_moderation_workers():
+    moderation_queue.start()